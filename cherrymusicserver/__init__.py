@@ -188,15 +188,21 @@ if needs_serve_file_utf8_fix:
 from cherrymusicserver import configuration as cfg
 config = None
 
+from cherrymusicserver import tweak
+from cherrymusicserver import util
+tweaks = util.ReloadingModule(tweak)
+
 
 from cherrymusicserver import cherrymodel
 from cherrymusicserver import database
 from cherrymusicserver import httphandler
 from cherrymusicserver import log
+from cherrymusicserver import mediawatcher
 from cherrymusicserver import migrations
 from cherrymusicserver import playlistdb
 from cherrymusicserver import service
 from cherrymusicserver import sqlitecache
+from cherrymusicserver import updatejobs
 from cherrymusicserver import userdb
 from cherrymusicserver import useroptiondb
 from cherrymusicserver import api
@@ -215,6 +221,7 @@ def setup_services():
     """
     service.provide('filecache', sqlitecache.SQLiteCache)
     service.provide('cherrymodel', cherrymodel.CherryModel)
+    service.provide('updatejobs', updatejobs.UpdateJobs)
     service.provide('playlist', playlistdb.PlaylistDB)
     service.provide('users', userdb.UserDB)
     service.provide('useroptions', useroptiondb.UserOptionDB)
@@ -309,12 +316,22 @@ def update_filedb(paths):
         See :cls:`~cherrymusicserver.sqlitecache.SQLiteCache` methods
         :meth:`~cherrymusicserver.sqlitecache.SQLiteCache.full_update` and
         :meth:`~cherrymusicserver.sqlitecache.SQLiteCache.parital_update`.
+        An interrupted update of the same paths resumes from its last
+        checkpoint.
     """
     cache = sqlitecache.SQLiteCache()
     target = cache.partial_update if paths else cache.full_update
     updater = threading.Thread(name='Updater', target=target, args=paths)
     updater.start()
 
+def recount_filedb_words():
+    """ Recounts the occurrences of all words in the file database.
+
+        Occurrences are kept up to date during updates; see
+        :meth:`~cherrymusicserver.sqlitecache.SQLiteCache.update_word_occurrences`.
+    """
+    sqlitecache.SQLiteCache().update_word_occurrences()
+
 
 def create_default_config_file(path):
     """ Creates or overwrites a default configuration file at `path` """
@@ -499,6 +516,10 @@ If you are sure that cherrymusic is not running, you can delete this file and re
                     'tools.staticfile.filename': resourcedir + '/img/favicon.ico',
                 }})
         api.v1.mount('/api/v1')
+        if config['media.watch']:
+            watcher = mediawatcher.MediaWatcher()
+            cherrypy.engine.subscribe('start', watcher.start)
+            cherrypy.engine.subscribe('stop', watcher.stop)
         log.i(_('Starting server on port %s ...') % config['server.port'])
 
         cherrypy.lib.caching.expires(0)  # disable expiry caching
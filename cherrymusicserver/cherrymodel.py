@@ -35,17 +35,13 @@ will delegate different calls between other classes.
 from __future__ import unicode_literals
 
 import os
+import uuid
 from random import choice
 import codecs
 import json
 import cherrypy
 import audiotranscode
 
-try:
-    from imp import reload
-except ModuleNotFoundError:
-    from importlib import reload
-
 try:
     from urllib.parse import quote
 except ImportError:
@@ -57,15 +53,19 @@ except ImportError:
 
 import cherrymusicserver as cherry
 from cherrymusicserver import service
+from cherrymusicserver import metainfo
 from cherrymusicserver import pathprovider
-from cherrymusicserver.util import Performance
+from cherrymusicserver.util import Performance, LRUCache
 from cherrymusicserver import resultorder
 from cherrymusicserver import log
 
 # used for sorting
 NUMBERS = ('0', '1', '2', '3', '4', '5', '6', '7', '8', '9')
 
-@service.user(cache='filecache')
+# search cursors kept even if search.cache_size is smaller, so paging works
+MIN_SEARCH_CURSORS = 20
+
+@service.user(cache='filecache', updates='updatejobs')
 class CherryModel:
     def __init__(self):
         CherryModel.NATIVE_BROWSER_FORMATS = ['opus', 'ogg', 'mp3']
@@ -75,6 +75,9 @@ class CherryModel:
             formats = CherryModel.supportedFormats
             formats += self.transcoder.available_decoder_formats()
             CherryModel.supportedFormats = list(set(formats))
+        self.search_results = LRUCache(cherry.config['search.cache_size'])
+        self.search_cursors = LRUCache(max(cherry.config['search.cache_size'],
+                                           MIN_SEARCH_CURSORS))
 
     @classmethod
     def abspath(cls, path):
@@ -189,9 +192,14 @@ class CherryModel:
             if CherryModel.isplayable(fullpath):
                 list.append(MusicEntry(relpath))
 
-    def updateLibrary(self):
-        self.cache.full_update()
-        return True
+    def updateLibrary(self, paths=()):
+        '''Start updating the given paths in the media library, or all of
+        it; returns the :class:`~cherrymusicserver.updatejobs.UpdateJob`.'''
+        return self.updates.start(paths)
+
+    def updateStatus(self, jobid):
+        '''The update job with the given id, or None'''
+        return self.updates.get(jobid)
 
     def file_size_within_limit(self, filelist, maximum_download_size):
         acc_size = 0
@@ -202,17 +210,85 @@ class CherryModel:
         return True
 
     def search(self, term):
-        reload(cherry.tweak)
-        tweaks = cherry.tweak.CherryModelTweaks
+        results = self.ranked_search(term)
+        self.count_subfolders(results)
+        return results
+
+    def search_page(self, term, offset=0, limit=None, cursor=None):
+        """One page of the results of a search. search.maxresults limits
+        the size of a page, not the whole search: results are ranked as far
+        as the requested page reaches, and kept under the returned cursor.
+        Later pages are taken from the same list, even if the library
+        changes in between; reaching further than before only appends to
+        it. If the cursor is unknown or has expired, the search is run
+        again.
+
+        Only the entries of the page are checked to still exist, so a page
+        can be shorter than requested if files have disappeared.
+
+        Returns a tuple (cursor, number of results ranked so far, page);
+        subfolders are not counted for the entries in the page yet."""
+        self._log_search(term)
+        max_page = cherry.config['search.maxresults']
+        limit = max_page if limit is None else min(limit, max_page)
+        depth = offset + limit
+        term = ' '.join(term.lower().split())
+        ranked = self.search_cursors.get(cursor) if cursor else None
+        if ranked is None:
+            cursor = uuid.uuid4().hex
+            ranked = (depth, self._rank(term, depth))
+            self.search_cursors.put(cursor, ranked)
+        elif ranked[0] < depth and len(ranked[1]) == ranked[0]:
+            # the list was cut off before the page; rank further
+            known = set(strippath(entry.path) for entry in ranked[1])
+            further = [entry for entry in self._rank(term, depth)
+                       if strippath(entry.path) not in known]
+            ranked = (depth, ranked[1] + further[:depth - len(ranked[1])])
+            self.search_cursors.put(cursor, ranked)
+        results = ranked[1]
+        with Performance(_('checking and classifying results:')):
+            page = list(filter(CherryModel.isValidMediaEntry,
+                               results[offset:depth]))
+        return cursor, len(results), page
+
+    def ranked_search(self, term):
+        """The sorted and filtered results of a search, without subfolder
+        counts. Results are cached until the library changes."""
+        self._log_search(term)
+        term = ' '.join(term.lower().split())
+        max_search_results = cherry.config['search.maxresults']
+        key = (term, self.cache.library_generation(), max_search_results)
+        results = self.search_results.get(key)
+        if results is not None:
+            log.d(_('search results from cache (%(hits)d hits, %(misses)d misses)'),
+                  {'hits': self.search_results.hits,
+                   'misses': self.search_results.misses})
+            return list(results)
+        results = self._rank(term, max_search_results)
+        with Performance(_('checking and classifying results:')):
+            results = list(filter(CherryModel.isValidMediaEntry, results))
+        self.search_results.put(key, results)
+        return list(results)
+
+    def count_subfolders(self, entries):
+        if cherry.config['media.show_subfolder_count']:
+            for entry in entries:
+                entry.count_subfolders_and_files()
+
+    def _log_search(self, term):
         user = cherrypy.session.get('username', None)
         if user:
             log.d(_("%(user)s searched for '%(term)s'"), {'user': user, 'term': term})
-        max_search_results = cherry.config['search.maxresults']
+
+    def _rank(self, term, max_search_results):
+        """Up to `max_search_results` results of a search, best first,
+        without checking that they still exist."""
+        tweaks = cherry.tweaks.current().CherryModelTweaks
         results = self.cache.searchfor(term, maxresults=max_search_results)
         with Performance(_('sorting DB results using ResultOrder')) as perf:
             debug = tweaks.result_order_debug
-            order_function = resultorder.ResultOrder(term, debug=debug)
-            results = sorted(results, key=order_function, reverse=True)
+            order = resultorder.ResultOrder(term, debug=debug)
+            results = order.sort(results)
             results = results[:min(len(results), max_search_results)]
             if debug:
                 n = tweaks.result_order_debug_files
@@ -220,14 +296,11 @@ class CherryModel:
                     perf.log(sortedResults.debugOutputSort)
                 for sortedResults in results:
                     sortedResults.debugOutputSort = None  # free ram
-
-        with Performance(_('checking and classifying results:')):
-            results = list(filter(CherryModel.isValidMediaEntry, results))
-        if cherry.config['media.show_subfolder_count']:
-            for result in results:
-                result.count_subfolders_and_files()
         return results
 
+    def autocomplete(self, text, count):
+        return self.cache.autocomplete(text, count)
+
     def check_for_updates(self):
         try:
             url = 'http://fomori.org/cherrymusic/update_check.php?version='
@@ -304,11 +377,16 @@ class CherryModel:
             oneliner = oneliner.replace('{liquid}', choice(liquid))
         return oneliner
 
+    def songInfo(self, path):
+        '''The tags of a file relative to basedir, from the media database if
+        they are stored there and from the file itself otherwise.'''
+        info = self.cache.songinfo([path]).get(path)
+        if info is None:
+            info = metainfo.getSongInfo(CherryModel.abspath(path))
+        return info
+
     def randomMusicEntries(self, count):
-        loadCount = int(count * 1.5) + 1           # expect 70% valid entries
-        entries = self.cache.randomFileEntries(loadCount)
-        filteredEntries = list(filter(CherryModel.isValidMediaEntry, entries))
-        return filteredEntries[:count]
+        return self.cache.randomFileEntries(count, CherryModel.supportedFormats)
 
     @classmethod
     def isValidMediaEntry(cls, file):
@@ -123,6 +123,74 @@ def from_defaults():
                     Defaults to {default_value} {default_unit}.
                             """.format(default_value='250', default_unit=_('megabytes')))
 
+    with c['media.scan_threads'] as scan_threads:
+        scan_threads.value = 1
+        scan_threads.valid = '[1-9][0-9]*'
+        # i18n: Don't mind whitespace - string will be re-wrapped automatically. Use blank lines to separate paragraphs.
+        scan_threads.doc = _("""
+                    Number of threads used to read directories while the
+                    media library is scanned. The database is always written
+                    by a single thread. Values above 1 can speed up scans of
+                    large libraries on network shares or slow disks;
+                    1 scans one directory at a time.
+                            """)
+
+    with c['media.tag_workers'] as tag_workers:
+        tag_workers.value = 1
+        tag_workers.valid = '[1-9][0-9]*'
+        # i18n: Don't mind whitespace - string will be re-wrapped automatically. Use blank lines to separate paragraphs.
+        tag_workers.doc = _("""
+                    Number of processes used to read the tags of new and
+                    changed audio files while the media library is scanned.
+                    Reading tags keeps a CPU busy, so scans of large
+                    libraries get faster with up to one process per CPU;
+                    1 reads tags in the scanning process.
+                            """)
+
+    with c['media.watch'] as watch:
+        watch.value = False
+        # i18n: Don't mind whitespace - string will be re-wrapped automatically. Use blank lines to separate paragraphs.
+        watch.doc = _("""
+                    Watch the media directory while the server is running
+                    and add, update or remove changed files automatically,
+                    so new music shows up within seconds without a manual
+                    update.
+
+                    Uses inotify on Linux. On other systems, the media
+                    directory is checked for changed folders once a minute.
+                            """)
+
+    with c['media.db_wal'] as wal:
+        wal.value = False
+        # i18n: Don't mind whitespace - string will be re-wrapped automatically. Use blank lines to separate paragraphs.
+        wal.doc = _("""
+                    Keep the media database in write-ahead log mode. Searches
+                    and directory listings then run in parallel, even while
+                    the library is updated, and a crash during an update
+                    can't damage the database. Uses a few extra files next
+                    to the database.
+                            """)
+
+    with c['media.db_mmap_size'] as mmap_size:
+        mmap_size.value = 0
+        mmap_size.valid = '[0-9]+'
+        # i18n: Don't mind whitespace - string will be re-wrapped automatically. Use blank lines to separate paragraphs.
+        mmap_size.doc = _("""
+                    Number of bytes of the media database that are read
+                    through memory-mapped I/O, which saves copying data
+                    between the operating system and CherryMusic.
+                    0 turns memory-mapping off.
+                            """)
+
+    with c['media.db_cache_size'] as db_cache_size:
+        db_cache_size.value = 2000
+        db_cache_size.valid = '[1-9][0-9]*'
+        # i18n: Don't mind whitespace - string will be re-wrapped automatically. Use blank lines to separate paragraphs.
+        db_cache_size.doc = _("""
+                    Size in kilobytes of the page cache of each connection to
+                    the media database.
+                            """)
+
     with c['search.maxresults'] as maxresults:
         maxresults.value = 20
         # i18n: Don't mind whitespace - string will be re-wrapped automatically. Use blank lines to separate paragraphs.
@@ -130,6 +198,64 @@ def from_defaults():
                     MAXRESULTS sets the maximum amount of search results
                     to be displayed. If MAXRESULTS is set to a higher value,
                     the search will take longer, but will also be more accurate.
+
+                    Clients that fetch search results page by page get at
+                    most MAXRESULTS results per page.
+                            """)
+
+    with c['search.engine'] as engine:
+        engine.value = 'dictionary'
+        engine.valid = '(dictionary|fts5|memory)'
+        # i18n: Don't mind whitespace - string will be re-wrapped automatically. Use blank lines to separate paragraphs.
+        engine.doc = _("""
+                    How to find files matching a search: "dictionary" looks
+                    up the search words in the database, preferring files
+                    that match all of them; "memory" does the same with a
+                    copy of the search index kept in memory, which is faster
+                    but needs some memory for every word in the library;
+                    "fts5" uses the full text search index of SQLite, which
+                    ranks files by how well they match all words together.
+
+                    The memory index is built when the server starts. The
+                    fts5 index is built from the existing database when
+                    first enabled. If your SQLite version lacks fts5 support,
+                    dictionary search is used.
+                            """)
+
+    with c['search.substring_index'] as substring:
+        substring.value = False
+        # i18n: Don't mind whitespace - string will be re-wrapped automatically. Use blank lines to separate paragraphs.
+        substring.doc = _("""
+                    Also find files whose names contain a search word
+                    anywhere, not just at the start of a word: "beatles"
+                    will then find "thebeatles_live". This needs an extra
+                    index that is about as large as the rest of the file
+                    database; it is built when first enabled.
+                            """)
+
+    with c['search.typo_tolerance'] as typo:
+        typo.value = False
+        # i18n: Don't mind whitespace - string will be re-wrapped automatically. Use blank lines to separate paragraphs.
+        typo.doc = _("""
+                    Correct typos in searches: a search word that no word in
+                    the library starts with is replaced by the most similar
+                    words, so "beatels" finds "beatles". This needs an index
+                    of all words that is built when the server starts.
+                            """)
+
+    with c['search.cache_size'] as cache_size:
+        cache_size.value = 100
+        cache_size.valid = '[0-9]+'
+        # i18n: Don't mind whitespace - string will be re-wrapped automatically. Use blank lines to separate paragraphs.
+        cache_size.doc = _("""
+                    Number of recent searches whose results are kept in
+                    memory, so repeating a search is answered immediately.
+                    Kept results are discarded whenever the media database
+                    is updated. 0 disables the cache.
+
+                    Searches fetched page by page keep their results for
+                    further pages as well; at least 20 of them are kept,
+                    even if the cache is disabled.
                             """)
 
     with c['search.load_file_db_into_memory'] as memory:
@@ -0,0 +1,5 @@
+DROP TABLE IF EXISTS files;
+
+DROP TABLE IF EXISTS dictionary;
+
+DROP TABLE IF EXISTS search;
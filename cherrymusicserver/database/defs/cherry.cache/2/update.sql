@@ -0,0 +1,7 @@
+-- filesystem stat of each file, to tell unchanged directories on rescan
+
+ALTER TABLE files ADD COLUMN mtime REAL;
+
+ALTER TABLE files ADD COLUMN size INTEGER;
+
+ALTER TABLE files ADD COLUMN inode INTEGER;
@@ -0,0 +1,9 @@
+DROP TABLE IF EXISTS files;
+
+DROP TABLE IF EXISTS dictionary;
+
+DROP TABLE IF EXISTS search;
+
+DROP TABLE IF EXISTS search_fts;
+
+DROP TABLE IF EXISTS trigrams;
@@ -0,0 +1,6 @@
+-- posting lists of name trigrams, for substring search
+
+CREATE TABLE trigrams(
+    trigram TEXT NOT NULL,
+    frowid INTEGER NOT NULL
+);
@@ -0,0 +1,28 @@
+CREATE INDEX IF NOT EXISTS idx_files_parent ON files(parent);
+CREATE INDEX IF NOT EXISTS idx_dictionary_word ON dictionary(word);
+CREATE INDEX IF NOT EXISTS idx_search_drowid_frowid ON search(drowid, frowid);    -- for lookup
+CREATE INDEX IF NOT EXISTS idx_search_frowid_drowid ON search(frowid, drowid);    -- for deletion
+
+CREATE TRIGGER IF NOT EXISTS trigger_files_after_update_set_modified
+    AFTER UPDATE ON files
+    FOR EACH ROW
+    BEGIN
+        UPDATE files SET _modified=(strftime('%s', 'now')) WHERE _id = new._id;
+    END;
+
+CREATE TRIGGER IF NOT EXISTS trigger_files_after_rename_update_paths
+    AFTER UPDATE OF parent, filename, filetype ON files
+    FOR EACH ROW
+    BEGIN
+        UPDATE files SET path = (
+                SELECT path || '/' FROM files WHERE _id = new.parent
+                UNION ALL SELECT '' WHERE new.parent = -1
+            ) || new.filename || new.filetype
+            WHERE _id = new._id;
+        UPDATE files SET path = (SELECT path FROM files WHERE _id = new._id)
+                                || substr(path, length(old.path) + 1)
+            WHERE substr(path, 1, length(old.path) + 1) = old.path || '/';
+    END;
+
+CREATE INDEX IF NOT EXISTS idx_trigrams_trigram_frowid ON trigrams(trigram, frowid);    -- for lookup
+CREATE INDEX IF NOT EXISTS idx_trigrams_frowid ON trigrams(frowid);    -- for deletion
@@ -0,0 +1,21 @@
+-- materialized path of each file relative to basedir, '/'-separated
+
+ALTER TABLE files ADD COLUMN path TEXT;
+
+CREATE TEMPORARY TABLE _tmp_paths(
+    _id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL
+);
+
+INSERT INTO _tmp_paths(_id, path)
+    WITH RECURSIVE paths(_id, path) AS (
+        SELECT _id, filename || filetype FROM files WHERE parent = -1
+        UNION ALL
+        SELECT files._id, paths.path || '/' || files.filename || files.filetype
+            FROM files JOIN paths ON files.parent = paths._id
+    )
+    SELECT _id, path FROM paths;
+
+UPDATE files SET path = (SELECT path FROM _tmp_paths WHERE _tmp_paths._id = files._id);
+
+DROP TABLE _tmp_paths;
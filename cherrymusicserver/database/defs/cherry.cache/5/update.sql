@@ -0,0 +1,3 @@
+-- look up files by path with one index probe
+
+CREATE INDEX IF NOT EXISTS idx_files_path ON files(path);
@@ -0,0 +1,34 @@
+-- dense numbering of the playable files of each type, to pick random tracks
+-- from
+
+CREATE TABLE playables(
+    filetype TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    frowid INTEGER NOT NULL,
+    PRIMARY KEY (filetype, number)
+);
+
+CREATE TEMPORARY TABLE _tmp_playables(
+    _id INTEGER PRIMARY KEY,
+    filetype TEXT NOT NULL,
+    frowid INTEGER NOT NULL
+);
+
+INSERT INTO _tmp_playables(filetype, frowid)
+    SELECT lower(filetype), _id FROM files
+    WHERE isdir = 0 AND lower(filetype) IN (
+        '.aac', '.flac', '.m4a', '.mp3', '.mp4', '.oga', '.ogg', '.opus',
+        '.wav', '.wma')
+    ORDER BY lower(filetype), _id;
+
+CREATE TEMPORARY TABLE _tmp_playables_start AS
+    SELECT filetype, MIN(_id) AS start FROM _tmp_playables GROUP BY filetype;
+
+INSERT INTO playables(filetype, number, frowid)
+    SELECT _tmp_playables.filetype, _id - start + 1, frowid
+    FROM _tmp_playables JOIN _tmp_playables_start
+        ON _tmp_playables_start.filetype = _tmp_playables.filetype;
+
+DROP TABLE _tmp_playables_start;
+
+DROP TABLE _tmp_playables;
@@ -0,0 +1,68 @@
+CREATE INDEX IF NOT EXISTS idx_files_parent ON files(parent);
+CREATE INDEX IF NOT EXISTS idx_files_path ON files(path);
+CREATE INDEX IF NOT EXISTS idx_dictionary_word ON dictionary(word);
+CREATE INDEX IF NOT EXISTS idx_search_drowid_frowid ON search(drowid, frowid);    -- for lookup
+CREATE INDEX IF NOT EXISTS idx_search_frowid_drowid ON search(frowid, drowid);    -- for deletion
+
+CREATE TRIGGER IF NOT EXISTS trigger_files_after_update_set_modified
+    AFTER UPDATE ON files
+    FOR EACH ROW
+    BEGIN
+        UPDATE files SET _modified=(strftime('%s', 'now')) WHERE _id = new._id;
+    END;
+
+CREATE TRIGGER IF NOT EXISTS trigger_files_after_rename_update_paths
+    AFTER UPDATE OF parent, filename, filetype ON files
+    FOR EACH ROW
+    BEGIN
+        UPDATE files SET path = (
+                SELECT path || '/' FROM files WHERE _id = new.parent
+                UNION ALL SELECT '' WHERE new.parent = -1
+            ) || new.filename || new.filetype
+            WHERE _id = new._id;
+        UPDATE files SET path = (SELECT path FROM files WHERE _id = new._id)
+                                || substr(path, length(old.path) + 1)
+            WHERE substr(path, 1, length(old.path) + 1) = old.path || '/';
+    END;
+
+CREATE INDEX IF NOT EXISTS idx_trigrams_trigram_frowid ON trigrams(trigram, frowid);    -- for lookup
+CREATE INDEX IF NOT EXISTS idx_trigrams_frowid ON trigrams(frowid);    -- for deletion
+
+CREATE INDEX IF NOT EXISTS idx_playables_frowid ON playables(frowid);
+
+-- playables numbers the playable audio files of each file type from 1 to n
+-- without gaps, so random tracks of some types can be picked by number. A
+-- deleted file's number goes to the file of its type with the highest
+-- number. The file types are those of PLAYABLE_FILETYPES in sqlitecache.py.
+
+CREATE TRIGGER IF NOT EXISTS trigger_files_after_insert_add_playable
+    AFTER INSERT ON files
+    FOR EACH ROW WHEN new.isdir = 0 AND lower(new.filetype) IN (
+        '.aac', '.flac', '.m4a', '.mp3', '.mp4', '.oga', '.ogg', '.opus',
+        '.wav', '.wma')
+    BEGIN
+        INSERT INTO playables(filetype, number, frowid) VALUES (
+            lower(new.filetype),
+            (SELECT COALESCE(MAX(number), 0) + 1 FROM playables
+                WHERE filetype = lower(new.filetype)),
+            new._id);
+    END;
+
+CREATE TRIGGER IF NOT EXISTS trigger_files_after_delete_remove_playable
+    AFTER DELETE ON files
+    FOR EACH ROW WHEN EXISTS (SELECT 1 FROM playables WHERE frowid = old._id)
+    BEGIN
+        UPDATE playables SET frowid = (
+                SELECT frowid FROM playables WHERE filetype = lower(old.filetype)
+                ORDER BY number DESC LIMIT 1
+            ) WHERE frowid = old._id;
+        DELETE FROM playables WHERE filetype = lower(old.filetype) AND number = (
+            SELECT MAX(number) FROM playables WHERE filetype = lower(old.filetype));
+    END;
+
+CREATE TRIGGER IF NOT EXISTS trigger_files_after_delete_remove_tags
+    AFTER DELETE ON files
+    FOR EACH ROW
+    BEGIN
+        DELETE FROM tags WHERE frowid = old._id;
+    END;
@@ -0,0 +1,11 @@
+-- tags read from audio files during library scans. Existing files get
+-- theirs with the next full update.
+
+CREATE TABLE tags(
+    frowid INTEGER PRIMARY KEY NOT NULL,
+    artist TEXT,
+    album TEXT,
+    title TEXT,
+    track TEXT,
+    duration REAL
+);
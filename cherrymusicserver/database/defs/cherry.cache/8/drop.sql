@@ -0,0 +1,15 @@
+DROP TABLE IF EXISTS files;
+
+DROP TABLE IF EXISTS dictionary;
+
+DROP TABLE IF EXISTS search;
+
+DROP TABLE IF EXISTS search_fts;
+
+DROP TABLE IF EXISTS trigrams;
+
+DROP TABLE IF EXISTS playables;
+
+DROP TABLE IF EXISTS tags;
+
+DROP TABLE IF EXISTS scan_checkpoints;
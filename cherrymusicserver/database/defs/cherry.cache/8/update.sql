@@ -0,0 +1,10 @@
+-- progress of unfinished library scans, so they can be resumed
+
+CREATE TABLE scan_checkpoints(
+    startpath TEXT PRIMARY KEY NOT NULL,
+    lastpath TEXT NOT NULL,
+    added INTEGER NOT NULL DEFAULT 0,
+    removed INTEGER NOT NULL DEFAULT 0,
+    started REAL,
+    updated REAL
+);
@@ -37,6 +37,7 @@ import os  # shouldn't have to list any folder in the future!
 import json
 import cherrypy
 import codecs
+import inspect
 import re
 import sys
 
@@ -48,6 +49,10 @@ try:
     from urllib import parse
 except ImportError:
     from backport.urllib import parse
+try:
+    _stringtypes = (basestring,)   # Python 2
+except NameError:
+    _stringtypes = (str,)
 
 
 import audiotranscode
@@ -60,7 +65,6 @@ from cherrymusicserver import service
 from cherrymusicserver.pathprovider import readRes
 from cherrymusicserver.pathprovider import albumArtFilePath
 import cherrymusicserver as cherry
-import cherrymusicserver.metainfo as metainfo
 from cherrymusicserver.util import Performance, MemoryZipFile
 
 from cherrymusicserver.ext import zipstream
@@ -85,6 +89,8 @@ class HTTPHandler(object):
 
         self.handlers = {
             'search': self.api_search,
+            'streamsearch': self.api_streamsearch,
+            'autocomplete': self.api_autocomplete,
             'rememberplaylist': self.api_rememberplaylist,
             'saveplaylist': self.api_saveplaylist,
             'loadplaylist': self.api_loadplaylist,
@@ -106,6 +112,9 @@ class HTTPHandler(object):
             'getdecoders': self.api_getdecoders,
             'transcodingenabled': self.api_transcodingenabled,
             'updatedb': self.api_updatedb,
+            'updatestatus': self.api_updatestatus,
+            'gettweaks': self.api_gettweaks,
+            'reloadtweaks': self.api_reloadtweaks,
             'getconfiguration': self.api_getconfiguration,
             'compactlistdir': self.api_compactlistdir,
             'listdir': self.api_listdir,
@@ -455,8 +464,8 @@ class HTTPHandler(object):
                 for i, filename in enumerate(files):
                     if i >= METADATA_ALBUMART_MAX_FILES:
                         break
-                    path = os.path.join(localpath, filename)
-                    metadata = metainfo.getSongInfo(path)
+                    path = os.path.join(directory, filename)
+                    metadata = self.model.songInfo(path)
                     if metadata.artist and metadata.album:
                         keywords = '{} - {}'.format(metadata.artist, metadata.album)
                         break
@@ -501,15 +510,57 @@ class HTTPHandler(object):
         except ValueError:
             raise cherrypy.HTTPError(400, 'Bad Request')
 
-    def api_search(self, searchstring):
-        if not searchstring.strip():
-            jsonresults = '[]'
-        else:
-            with Performance(_('processing whole search request')):
-                searchresults = self.model.search(searchstring.strip())
-                with Performance(_('rendering search results as json')):
-                    jsonresults = [entry.to_dict() for entry in searchresults]
-        return jsonresults
+    def api_search(self, searchstring, offset=None, limit=None, cursor=None):
+        """Without offset, limit or cursor, returns all results. Otherwise
+        returns a page of at most search.maxresults of them, along with the
+        number of results found so far and a cursor, which can be passed
+        along to get more pages of the same results without searching
+        again. If the results found so far reach the end of the page, a
+        later page may find more."""
+        if offset is None and limit is None and cursor is None:
+            if not searchstring.strip():
+                jsonresults = '[]'
+            else:
+                with Performance(_('processing whole search request')):
+                    searchresults = self.model.search(searchstring.strip())
+                    with Performance(_('rendering search results as json')):
+                        jsonresults = [entry.to_dict() for entry in searchresults]
+            return jsonresults
+        offset, limit = _page_bounds(offset, limit)
+        cursor, total, page = self.model.search_page(
+            searchstring.strip(), offset, limit, cursor)
+        self.model.count_subfolders(page)
+        return {'cursor': cursor, 'total': total, 'offset': offset,
+                'results': [entry.to_dict() for entry in page]}
+
+    def api_streamsearch(self, searchstring, offset=0, limit=None, cursor=None):
+        """Like a paginated search, but each result is sent as soon as it
+        is ready, in a chunked response."""
+        offset, limit = _page_bounds(offset, limit)
+        cursor, total, page = self.model.search_page(
+            searchstring.strip(), offset, limit, cursor)
+        _save_and_release_session()
+        cherrypy.response.headers['Content-Type'] = 'application/json'
+        cherrypy.response.stream = True
+
+        def chunks():
+            yield ('{"data": {"cursor": %s, "total": %d, "offset": %d, '
+                   '"results": [' % (json.dumps(cursor), total, offset)
+                   ).encode('utf-8')
+            for index, entry in enumerate(page):
+                self.model.count_subfolders([entry])
+                yield ((', ' if index else '') +
+                       json.dumps(entry.to_dict())).encode('utf-8')
+            yield ']}}'.encode('utf-8')
+        return chunks()
+    api_streamsearch.binary = True
+
+    def api_autocomplete(self, prefix, count=10):
+        try:
+            count = max(0, int(count))
+        except (TypeError, ValueError):
+            raise cherrypy.HTTPError(400, 'Bad Request')
+        return self.model.autocomplete(prefix, count)
 
     def api_rememberplaylist(self, playlist):
         cherrypy.session['playlist'] = playlist
@@ -712,9 +763,7 @@ class HTTPHandler(object):
     export_playlists.exposed = True
 
     def api_getsonginfo(self, path):
-        basedir = cherry.config['media.basedir']
-        abspath = os.path.join(basedir, path)
-        return json.dumps(metainfo.getSongInfo(abspath).dict())
+        return json.dumps(self.model.songInfo(path).dict())
 
     def api_getencoders(self):
         return json.dumps(audiotranscode.getEncoders())
@@ -725,9 +774,35 @@ class HTTPHandler(object):
     def api_transcodingenabled(self):
         return json.dumps(cherry.config['media.transcode'])
 
-    def api_updatedb(self):
-        self.model.updateLibrary()
-        return 'success'
+    def api_updatedb(self, paths=None):
+        """Start updating the media database in the background, for some
+        paths relative to basedir or all of it. Returns the status of the
+        update job; asking again while it runs returns the same job."""
+        paths = paths or ()
+        if not isinstance(paths, (list, tuple)):
+            raise cherrypy.HTTPError(400, _('paths must be a list'))
+        for path in paths:
+            if not isinstance(path, _stringtypes):
+                raise cherrypy.HTTPError(400, _('Invalid path: %r') % (path,))
+            if os.path.isabs(path) or '..' in path.replace('\\', '/').split('/'):
+                raise cherrypy.HTTPError(400, _('Invalid path: %r') % path)
+        return self.model.updateLibrary(paths).dict()
+
+    def api_updatestatus(self, jobid):
+        job = self.model.updateStatus(jobid)
+        if job is None:
+            raise cherrypy.HTTPError(404, _('No such update job'))
+        return job.dict()
+
+    def api_gettweaks(self):
+        if not cherrypy.session['admin']:
+            raise cherrypy.HTTPError(403, "Forbidden")
+        return tweak_values(cherry.tweaks.current())
+
+    def api_reloadtweaks(self):
+        if not cherrypy.session['admin']:
+            raise cherrypy.HTTPError(403, "Forbidden")
+        return tweak_values(cherry.tweaks.reload())
 
     def api_getconfiguration(self):
         clientconfigkeys = {
@@ -783,3 +858,27 @@ def _save_and_release_session():
     hooks[:] = [h for h in hooks if h.callback is not forbidden]
     # there's likely only one hook, since a 2nd call to save would always fail;
     # but let's be safe, and block all calls to save :)
+
+
+def _page_bounds(offset, limit):
+    """ offset and limit of a page of results as ints; limit can be None
+        for all remaining results. Raises a 400 error for bad values. """
+    try:
+        offset = int(offset or 0)
+        limit = None if limit is None else int(limit)
+    except (TypeError, ValueError):
+        raise cherrypy.HTTPError(400, 'Bad Request')
+    if offset < 0 or (limit is not None and limit < 0):
+        raise cherrypy.HTTPError(400, 'Bad Request')
+    return offset, limit
+
+
+def tweak_values(module):
+    """ Returns the values of the tweak classes in `module` as a dict of
+        dicts, e.g. ``{'SearchTweaks': {'normal_file_search_limit': 400}}``
+    """
+    return dict(
+        (name, dict((key, value) for key, value in vars(cls).items()
+                    if not key.startswith('_')))
+        for name, cls in vars(module).items()
+        if inspect.isclass(cls) and cls.__module__ == module.__name__)
@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# CherryMusic - a standalone music server
+# Copyright (c) 2012 - 2016 Tom Wallroth & Tilman Boerner
+#
+# Project page:
+#   http://fomori.org/cherrymusic/
+# Sources on github:
+#   http://github.com/devsnd/cherrymusic/
+#
+# CherryMusic is based on
+#   jPlayer (GPL/MIT license) http://www.jplayer.org/
+#   CherryPy (BSD license) http://www.cherrypy.org/
+#
+# licensed under GNU GPL version 3 (or later)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+#
+""" Watches the media library for changes and keeps the file database up to
+    date by starting update jobs for the changed paths.
+
+    Changes are picked up with inotify where it is available (Linux), and by
+    periodically comparing directory mtimes everywhere else.
+"""
+
+#python 2.6+ backward compability
+from __future__ import unicode_literals
+
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+import cherrymusicserver as cherry
+from cherrymusicserver import log
+from cherrymusicserver import service
+
+try:
+    import ctypes
+    import ctypes.util
+    _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                        use_errno=True)
+    _libc.inotify_init
+    INOTIFY_AVAILABLE = True
+except (ImportError, OSError, AttributeError):
+    INOTIFY_AVAILABLE = False
+
+_scandir = getattr(os, 'scandir', None)
+
+# seconds without new changes before an update is run
+DEBOUNCE_SECONDS = 2
+# never delay an update longer than this while changes keep coming in
+MAX_DELAY_SECONDS = 30
+# seconds between directory checks when inotify is not available
+POLL_INTERVAL_SECONDS = 60
+
+
+@service.user(cache='filecache', updates='updatejobs')
+class MediaWatcher(object):
+    """ Collects changed paths below ``media.basedir`` and starts an update
+        job for them (see :mod:`~cherrymusicserver.updatejobs`) once things
+        have calmed down.
+
+        Paths can be reported by hand with :meth:`notify`; :meth:`start`
+        also starts a backend that reports filesystem changes on its own.
+        Backends take their first look at the library on their own thread,
+        so starting does not wait for it.
+    """
+    def __init__(self, debounce=DEBOUNCE_SECONDS, max_delay=MAX_DELAY_SECONDS,
+                 poll_interval=POLL_INTERVAL_SECONDS, use_inotify=True):
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify and INOTIFY_AVAILABLE
+        self.basedir = None
+        self.backend = None
+        self.pending = set()
+        self.first_change = None
+        self.last_change = None
+        self.condition = threading.Condition()
+        self.running = False
+        self.dispatcher = None
+
+    def start(self):
+        self.cache      # its creation normalizes media.basedir
+        self.basedir = cherry.config['media.basedir']
+        self.running = True
+        self.dispatcher = threading.Thread(name='MediaWatcher',
+                                           target=self._dispatch)
+        self.dispatcher.daemon = True
+        self.dispatcher.start()
+        if self.use_inotify:
+            try:
+                self.backend = _InotifyBackend(self.basedir, self.notify,
+                                               self._inotify_failed)
+            except OSError as error:
+                self._log_inotify_error(error)
+        if self.backend is None:
+            self.backend = _PollingBackend(self.basedir, self.notify,
+                                           self.poll_interval)
+        self.backend.start()
+        log.i(_('watching %r for changes'), self.basedir)
+
+    def _log_inotify_error(self, error):
+        log.e(_('cannot watch media library with inotify (%s); '
+                'checking for changes every %s seconds instead.'),
+              error, self.poll_interval)
+
+    def _inotify_failed(self, error):
+        '''Fall back to polling if the library can't be watched with
+        inotify after all'''
+        self._log_inotify_error(error)
+        with self.condition:
+            if not self.running:
+                return
+            self.backend = _PollingBackend(self.basedir, self.notify,
+                                           self.poll_interval)
+            self.backend.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+            backend, self.backend = self.backend, None
+        if backend is not None:
+            backend.stop()
+        if self.dispatcher is not None:
+            self.dispatcher.join()
+            self.dispatcher = None
+
+    def notify(self, path):
+        '''Report a changed path; it will be updated after a short delay.'''
+        now = time.time()
+        with self.condition:
+            if not self.pending:
+                self.first_change = now
+            self.pending.add(os.path.normpath(path))
+            self.last_change = now
+            self.condition.notify_all()
+
+    def _takepending(self):
+        '''Wait until changes have settled and return them, or None if
+        stopped'''
+        with self.condition:
+            while self.running:
+                if self.pending:
+                    now = time.time()
+                    due = min(self.last_change + self.debounce,
+                              self.first_change + self.max_delay)
+                    if now >= due:
+                        paths = self.pending
+                        self.pending = set()
+                        return paths
+                    self.condition.wait(due - now)
+                else:
+                    self.condition.wait()
+        return None
+
+    def _dispatch(self):
+        while True:
+            paths = self._takepending()
+            if paths is None:
+                return
+            paths = collapse_paths(paths)
+            if self.basedir in paths:
+                self.updates.start()
+            else:
+                self.updates.start(
+                    os.path.relpath(path, self.basedir) for path in paths)
+
+
+def collapse_paths(paths):
+    '''Return the sorted paths from a collection, leaving out those that are
+    inside of another one of the paths.'''
+    pathset = set(paths)
+
+    def covered(path):
+        parent = os.path.dirname(path)
+        while parent != path:
+            if parent in pathset:
+                return True
+            path, parent = parent, os.path.dirname(parent)
+        return False
+    return sorted(path for path in pathset if not covered(path))
+
+
+def _subdirs(path, follow):
+    '''The paths of the directories in a directory, including symlinks to
+    directories if `follow` is true. Uses ``os.scandir`` where available, so
+    only links need a stat call.'''
+    if _scandir is None:
+        children = (os.path.join(path, name) for name in os.listdir(path))
+        return [child for child in children if os.path.isdir(child)
+                and (follow or not os.path.islink(child))]
+    subdirs = []
+    for entry in _scandir(path):
+        try:
+            if entry.is_dir() and (follow or not entry.is_symlink()):
+                subdirs.append(entry.path)
+        except OSError:
+            continue
+    return subdirs
+
+
+class _PollingBackend(object):
+    """Reports directories whose mtime has changed since the last check."""
+
+    def __init__(self, basedir, notify, interval):
+        self.basedir = basedir
+        self.notify = notify
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.ready = threading.Event()
+        self.snapshot = None
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(name='MediaWatcher-poll',
+                                       target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _run(self):
+        self.check()
+        self.ready.set()
+        while not self.stopped.wait(self.interval):
+            self.check()
+
+    def check(self):
+        '''Report the directories changed since the last check; the first
+        check only takes note of them.'''
+        snapshot = self._scan()
+        if self.snapshot is None:
+            self.snapshot = snapshot
+            return
+        for path, mtime in snapshot.items():
+            if self.snapshot.get(path) != mtime:
+                self.notify(path)
+        for path in self.snapshot:
+            if path not in snapshot:
+                self.notify(path)
+        self.snapshot = snapshot
+
+    def _scan(self):
+        '''map of all directory paths to their mtimes. Like a library scan,
+        only follows symlinks directly in basedir.'''
+        snapshot = {}
+        stack = [(self.basedir, True)]
+        while stack and not self.stopped.is_set():
+            path, follow = stack.pop()
+            try:
+                snapshot[path] = os.stat(path).st_mtime
+                subdirs = _subdirs(path, follow)
+            except OSError:
+                continue
+            stack.extend((child, False) for child in subdirs)
+        return snapshot
+
+
+# from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+_WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+               IN_DELETE | IN_ONLYDIR)
+_EVENT_HEADER = struct.Struct(str('iIII'))
+
+
+class _InotifyBackend(object):
+    """Reports paths below basedir as inotify sees them change. If the
+    library can't be watched, ``failed`` is called with the error."""
+
+    def __init__(self, basedir, notify, failed):
+        self.basedir = basedir
+        self.notify = notify
+        self.failed = failed
+        self.encoding = sys.getfilesystemencoding()
+        self.fd = _libc.inotify_init()
+        if self.fd < 0:
+            raise _oserror()
+        self.watches = {}
+        self.stopped = threading.Event()
+        self.ready = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(name='MediaWatcher-inotify',
+                                       target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        if self.fd >= 0:
+            os.close(self.fd)
+
+    def _watch(self, path):
+        encoded = path.encode(self.encoding) if not isinstance(path, bytes) else path
+        wd = _libc.inotify_add_watch(self.fd, encoded, _WATCH_MASK)
+        if wd < 0:
+            error = _oserror(path)
+            if error.errno == 28:   # ENOSPC: out of watches
+                raise error
+            log.w(_('cannot watch %r: %s'), path, error)
+            return
+        self.watches[wd] = path
+
+    def _watch_tree(self, path, follow=False):
+        '''watch a directory and all subdirectories. Symlinks are only
+        followed in basedir, as in library scans.'''
+        stack = [(path, follow)]
+        while stack and not self.stopped.is_set():
+            path, follow = stack.pop()
+            self._watch(path)
+            try:
+                subdirs = _subdirs(path, follow)
+            except OSError:
+                continue
+            stack.extend((child, False) for child in subdirs)
+
+    def _unwatch_tree(self, path):
+        prefix = path + os.path.sep
+        for wd, watched in list(self.watches.items()):
+            if watched == path or watched.startswith(prefix):
+                _libc.inotify_rm_watch(self.fd, wd)
+                self.watches.pop(wd, None)
+
+    def _run(self):
+        try:
+            self._watch_tree(self.basedir, follow=True)
+        except OSError as error:
+            os.close(self.fd)
+            self.fd = -1
+            self.failed(error)
+            return
+        self.ready.set()
+        while not self.stopped.is_set():
+            ready, _w, _x = select.select([self.fd], [], [], 0.5)
+            if not ready:
+                continue
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except OSError as error:
+                log.e(_('error reading inotify events: %s'), error)
+                return
+            self._handle(data)
+
+    def _handle(self, data):
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].split(b'\0', 1)[0]
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                log.w(_('too many changes at once; updating the whole library'))
+                self.notify(self.basedir)
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            parent = self.watches.get(wd)
+            if parent is None or not name:
+                continue
+            try:
+                name = name.decode(self.encoding)
+            except UnicodeError:
+                log.e(_('unable to decode filename %r in %r; skipping.'),
+                      name, parent)
+                continue
+            path = os.path.join(parent, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        self._watch_tree(path, follow=(parent == self.basedir))
+                    except OSError as error:
+                        log.e(_('cannot watch %r: %s. Raise the inotify '
+                                'watch limit to keep watching new folders.'),
+                              path, error)
+                elif mask & IN_MOVED_FROM:
+                    self._unwatch_tree(path)
+            self.notify(path)
+
+
+def _oserror(filename=None):
+    errno = ctypes.get_errno()
+    return OSError(errno, os.strerror(errno), filename)
@@ -34,6 +34,10 @@ import sys
 
 from tinytag import TinyTag
 
+# file types TinyTag can read tags from
+TAG_FILETYPES = ('.mp3', '.oga', '.ogg', '.opus', '.wav', '.flac', '.wma',
+                 '.m4a', '.mp4')
+
 
 class Metainfo():
     def __init__(self, artist='', album='', title='', track='', length=0):
@@ -64,3 +68,25 @@ def getSongInfo(filepath):
             setattr(tag, attribute, '')
     return Metainfo(tag.artist, tag.album, tag.title, str(tag.track), tag.duration)
 
+
+def readTags(files):
+    """ Read the tags of ``(fileid, path)`` pairs.
+
+        Returns a list of ``(fileid, artist, album, title, track, length)``
+        rows and a list of ``(path, error message)`` pairs for the files whose
+        tags could not be read. Those files still get a row, with empty tags.
+
+        Runs in tag reader processes during library scans, so it must not
+        depend on anything set up by the server.
+    """
+    rows = []
+    errors = []
+    for fileid, path in files:
+        try:
+            info = getSongInfo(path)
+        except Exception as error:
+            errors.append((path, '%s: %s' % (error.__class__.__name__, error)))
+            info = Metainfo()
+        rows.append((fileid, info.artist, info.album, info.title, info.track,
+                     info.length))
+    return rows, errors
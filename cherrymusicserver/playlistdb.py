@@ -31,6 +31,7 @@
 
 from cherrymusicserver import database
 from cherrymusicserver import log
+from cherrymusicserver import service
 from cherrymusicserver.cherrymodel import MusicEntry
 from cherrymusicserver.database.connect import BoundConnector
 try:
@@ -40,6 +41,7 @@ except ImportError:
 
 DBNAME = 'playlist'
 
+@service.user(cache='filecache')
 class PlaylistDB:
     def __init__(self, connector=None):
         database.require(DBNAME, version='1')
@@ -167,11 +169,13 @@ class PlaylistDB:
             plsstr = '''[playlist]
     NumberOfEntries={}
     '''.format(len(pl))
+            songinfo = self.cache.songinfo([track.path for track in pl])
             for i,track in enumerate(pl):
+                info = songinfo.get(track.path)
                 trinfo = {  'idx':i+1,
                             'url':addrstr+'/serve/'+track.path,
                             'name':track.repr,
-                            'length':-1,
+                            'length':int(round(info.length)) if info and info.length else -1,
                         }
                 plsstr += '''
     File{idx}={url}
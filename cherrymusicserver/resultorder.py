@@ -33,14 +33,10 @@
 fetched from the database by some mystic-voodoo-
 hocuspocus heuristics"""
 
-try:
-    from imp import reload
-except ModuleNotFoundError:
-    from importlib import reload
+import os
 
-from cherrymusicserver import pathprovider
 from cherrymusicserver import log
-import cherrymusicserver.tweak
+import cherrymusicserver as cherry
 from cherrymusicserver.util import Performance
 
 class ResultOrder:
@@ -49,71 +45,96 @@ class ResultOrder:
         self.fullsearchterm = searchword.lower()
         self.searchwords = searchword.lower().split(' ')
 
-        reload(cherrymusicserver.tweak)
-        self.perfect_match_bonus = cherrymusicserver.tweak.ResultOrderTweaks.perfect_match_bonus
-        self.partial_perfect_match_bonus = cherrymusicserver.tweak.ResultOrderTweaks.partial_perfect_match_bonus
-        self.starts_with_bonus = cherrymusicserver.tweak.ResultOrderTweaks.starts_with_bonus
-        self.folder_bonus = cherrymusicserver.tweak.ResultOrderTweaks.folder_bonus
-        self.word_in_file_name_bonus = cherrymusicserver.tweak.ResultOrderTweaks.word_in_file_name_bonus
-        self.word_not_in_file_name_penalty = cherrymusicserver.tweak.ResultOrderTweaks.word_not_in_file_name_penalty
-        self.word_in_file_path_bonus = cherrymusicserver.tweak.ResultOrderTweaks.word_in_file_path_bonus
-        self.word_not_in_file_path_penalty = cherrymusicserver.tweak.ResultOrderTweaks.word_not_in_file_path_penalty
+        tweaks = cherry.tweaks.current().ResultOrderTweaks
+        self.perfect_match_bonus = tweaks.perfect_match_bonus
+        self.partial_perfect_match_bonus = tweaks.partial_perfect_match_bonus
+        self.starts_with_bonus = tweaks.starts_with_bonus
+        self.folder_bonus = tweaks.folder_bonus
+        self.word_in_file_name_bonus = tweaks.word_in_file_name_bonus
+        self.word_not_in_file_name_penalty = tweaks.word_not_in_file_name_penalty
+        self.word_in_file_path_bonus = tweaks.word_in_file_path_bonus
+        self.word_not_in_file_path_penalty = tweaks.word_not_in_file_path_penalty
+
     def __call__(self,element):
-        file = element.path
-        isdir = element.dir
-        fullpath = file.lower()
-        filename = pathprovider.filename(file).lower()
-        filename_words = filename.split(' ')
-
-        bias = 0
-        occurences_bias = 0
-        perfect_match_bias = 0
-        partial_perfect_match_bias = 0
-        folder_bias = 0
-        starts_with_bias = 0
-        starts_with_no_track_number_bias = 0
-
-        #count occurences of searchwords
-        occurences=0
-        for searchword in self.searchwords:
-            if searchword in fullpath:
-                occurences_bias += self.word_in_file_path_bonus
-            else:
-                occurences_bias += self.word_not_in_file_path_penalty
-            if searchword in filename:
-                occurences_bias += self.word_in_file_name_bonus
-            else:
-                occurences_bias += self.word_not_in_file_name_penalty
-
-        #perfect match?
-        if filename == self.fullsearchterm or self.noThe(filename) == self.fullsearchterm:
-            perfect_match_bias += self.perfect_match_bonus
-
-        filename = pathprovider.stripext(filename)
-        #partial perfect match?
-        for searchword in self.searchwords:
-            if searchword in filename_words:
-                partial_perfect_match_bias += self.partial_perfect_match_bonus
-        if isdir:
-            folder_bias += self.folder_bonus
-
-        #file starts with match?
-        for searchword in self.searchwords:
-            if filename.startswith(searchword):
-                starts_with_bias += self.starts_with_bonus
-
-        #remove possible track number
-        while len(filename)>0 and '0' <= filename[0] <= '9':
-            filename = filename[1:]
-        filename = filename.strip()
-        for searchword in self.searchwords:
-            if filename == searchword:
-                starts_with_no_track_number_bias += self.starts_with_bonus
-
-        bias = occurences_bias + perfect_match_bias + partial_perfect_match_bias + folder_bias + starts_with_bias + starts_with_no_track_number_bias
-
-        if self.debug:
-            element.debugOutputSort = '''
+        return self.scores([element])[0]
+
+    def sort(self, elements):
+        """returns the elements sorted by bias, highest first; elements with
+        the same bias keep their order"""
+        elements = list(elements)
+        scores = self.scores(elements)
+        order = sorted(range(len(elements)), key=lambda i: -scores[i])
+        return [elements[i] for i in order]
+
+    def scores(self, elements):
+        """returns the bias of each element. Everything that only depends on
+        the search term is worked out once for all elements."""
+        searchwords = self.searchwords
+        wordcount = len(searchwords)
+        fullsearchterm = self.fullsearchterm
+        # the bonus for a searchword found in path or name, relative to
+        # the penalty for not finding it
+        path_bonus = self.word_in_file_path_bonus - self.word_not_in_file_path_penalty
+        name_bonus = self.word_in_file_name_bonus - self.word_not_in_file_name_penalty
+        no_occurences_bias = wordcount * (self.word_not_in_file_path_penalty +
+                                          self.word_not_in_file_name_penalty)
+        partial_perfect_match_bonus = self.partial_perfect_match_bonus
+        starts_with_bonus = self.starts_with_bonus
+        searchword_counts = {}
+        for searchword in searchwords:
+            searchword_counts[searchword] = searchword_counts.get(searchword, 0) + 1
+        # each distinct searchword with its count, and padded with spaces to
+        # look for it as a whole word in a space-padded name
+        distinct_searchwords = [(searchword, ' %s ' % searchword, count)
+                                for searchword, count in searchword_counts.items()]
+        debug = self.debug
+        sep, altsep = os.path.sep, os.path.altsep
+
+        scores = []
+        for element in elements:
+            fullpath = element.path.lower()
+            filename = fullpath.rpartition(sep)[2]
+            if altsep:
+                filename = filename.rpartition(altsep)[2]
+            padded_filename = ' %s ' % filename
+            name = filename
+            if '.' in name:
+                name = name[:name.rindex('.')]
+
+            # a searchword can only be in the file name if it is in the path,
+            # and only start the name without extension if it is in the name
+            occurences_bias = no_occurences_bias
+            partial_perfect_match_bias = 0
+            starts_with_bias = 0
+            for searchword, padded_searchword, count in distinct_searchwords:
+                if searchword in fullpath:
+                    occurences_bias += count * path_bonus
+                    if searchword in filename:
+                        occurences_bias += count * name_bonus
+                        if padded_searchword in padded_filename:
+                            partial_perfect_match_bias += count * partial_perfect_match_bonus
+                        if name.startswith(searchword):
+                            starts_with_bias += count * starts_with_bonus
+
+            #perfect match?
+            perfect_match_bias = 0
+            if filename.startswith(fullsearchterm) and (
+                    filename == fullsearchterm or
+                    self.noThe(filename) == fullsearchterm):
+                perfect_match_bias = self.perfect_match_bonus
+
+            folder_bias = self.folder_bonus if element.dir else 0
+
+            #remove possible track number
+            filename = name.lstrip('0123456789').strip()
+            starts_with_no_track_number_bias = (
+                searchword_counts.get(filename, 0) * starts_with_bonus)
+
+            bias = occurences_bias + perfect_match_bias + partial_perfect_match_bias + folder_bias + starts_with_bias + starts_with_no_track_number_bias
+            scores.append(bias)
+
+            if debug:
+                element.debugOutputSort = '''
 fullsearchterm: %s
 searchwords: %s
 filename: %s
@@ -127,8 +148,8 @@ starts_with_no_track_number_bias %d
 ------------------------------------
 total bias                       %d
             ''' % (
-        self.fullsearchterm,
-        self.searchwords,
+        fullsearchterm,
+        searchwords,
         filename,
         fullpath,
         occurences_bias,
@@ -139,7 +160,7 @@ total bias                       %d
         starts_with_no_track_number_bias,
         bias)
 
-        return bias
+        return scores
 
     def noThe(self,a):
         if a.lower().endswith((', the',', die')):
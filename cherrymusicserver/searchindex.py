@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# CherryMusic - a standalone music server
+# Copyright (c) 2012 - 2016 Tom Wallroth & Tilman Boerner
+#
+# Project page:
+#   http://fomori.org/cherrymusic/
+# Sources on github:
+#   http://github.com/devsnd/cherrymusic/
+#
+# CherryMusic is based on
+#   jPlayer (GPL/MIT license) http://www.jplayer.org/
+#   CherryPy (BSD license) http://www.cherrypy.org/
+#
+# licensed under GNU GPL version 3 (or later)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+#
+
+""" In-memory indexes of the search words in the file database.
+
+    :class:`InvertedIndex` is used by the ``memory`` search engine. Its words
+    are kept in a sorted list, so all words starting with a search term can
+    be found by bisection. Each word has a posting list of the ids of the
+    files it occurs in, stored as a sorted ``array('I')``.
+
+    :class:`SortedWords` finds words similar to misspelled search terms, and
+    :class:`PrefixTable` completes the beginnings of words.
+"""
+
+#python 2.6+ backward compability
+from __future__ import unicode_literals
+
+import heapq
+import sys
+import threading
+
+from array import array
+from bisect import bisect_left
+from operator import itemgetter
+from contextlib import closing
+
+from backport import unichr
+
+from cherrymusicserver import log
+
+
+class InvertedIndex(object):
+    """ Maps words to the ids of the files whose names contain them.
+
+        New words are collected separately and merged into the sorted list
+        before the next lookup, so scans do not pay for keeping it sorted
+        after every file. Posting lists, those of new words included, are
+        always sorted and hold each file id once.
+    """
+    def __init__(self):
+        self.words = []
+        self.postings = []
+        self.pending = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_db(cls, conn):
+        '''Build an index from the dictionary and search tables'''
+        index = cls()
+        with closing(conn.execute(
+                'SELECT dictionary.word, search.frowid'
+                ' FROM dictionary JOIN search ON search.drowid = dictionary._id'
+                ' ORDER BY dictionary.word, search.frowid')) as cursor:
+            word = postings = None
+            for rowword, fileid in cursor:
+                if rowword != word:
+                    word, postings = rowword, array(str('I'))
+                    index.words.append(word)
+                    index.postings.append(postings)
+                if not postings or postings[-1] != fileid:
+                    postings.append(fileid)
+        return index
+
+    def __len__(self):
+        '''number of (word, file id) entries'''
+        with self._lock:
+            self._merge()
+            return sum(len(postings) for postings in self.postings)
+
+    def add(self, fileid, words):
+        with self._lock:
+            for word in set(words):
+                postings = self._postings(word)
+                if postings is None:
+                    postings = self.pending[word] = array(str('I'))
+                pos = bisect_left(postings, fileid)
+                if pos == len(postings) or postings[pos] != fileid:
+                    postings.insert(pos, fileid)
+
+    def remove(self, fileid, words):
+        with self._lock:
+            for word in set(words):
+                postings = self._postings(word)
+                if postings is None:
+                    continue
+                pos = bisect_left(postings, fileid)
+                if pos < len(postings) and postings[pos] == fileid:
+                    del postings[pos]
+
+    def _postings(self, word):
+        pos = bisect_left(self.words, word)
+        if pos < len(self.words) and self.words[pos] == word:
+            return self.postings[pos]
+        return self.pending.get(word)
+
+    def _merge(self):
+        '''merge pending words into the sorted list, and drop words that no
+        longer occur anywhere'''
+        if not self.pending and all(self.postings):
+            return
+        merged = sorted(
+            [item for item in zip(self.words, self.postings) if item[1]]
+            + [item for item in self.pending.items() if item[1]],
+            key=lambda item: item[0])
+        self.words = [word for word, postings in merged]
+        self.postings = [postings for word, postings in merged]
+        self.pending = {}
+
+    def has_prefix(self, term):
+        '''True if any word starts with term'''
+        with self._lock:
+            self._merge()
+            start, end = self._prefixrange(term)
+            return start < end
+
+    def _prefixrange(self, term):
+        '''(start, end) of the words starting with term'''
+        start = bisect_left(self.words, term)
+        tprefix, tlast = term[:-1], term[-1]
+        if sys.maxunicode <= ord(tlast):
+            end = start
+            while end < len(self.words) and self.words[end].startswith(term):
+                end += 1
+        else:
+            end = bisect_left(self.words, tprefix + unichr(1 + ord(tlast)), start)
+        return start, end
+
+    def matching_any(self, terms, maxFileIdsPerTerm):
+        '''ids of files with a word starting with any of the terms, once for
+        every term they match. Like
+        :meth:`~cherrymusicserver.sqlitecache.SQLiteCache.fetchFileIds`,
+        files with the most frequent words come first for each term.'''
+        result = []
+        with self._lock:
+            self._merge()
+            for term in terms:
+                start, end = self._prefixrange(term)
+                found = []
+                for postings in sorted(self.postings[start:end], key=len,
+                                       reverse=True):
+                    found.extend(postings[:maxFileIdsPerTerm - len(found)])
+                    if len(found) >= maxFileIdsPerTerm:
+                        break
+                result += found
+        return result
+
+    def matching_all(self, terms, maxFileIds):
+        '''ids of files with a word starting with each one of the terms,
+        checking the rarest term first'''
+        with self._lock:
+            self._merge()
+            ranges = sorted(
+                (sum(len(p) for p in self.postings[start:end]), start, end)
+                for start, end in set(self._prefixrange(term) for term in terms))
+            found = None
+            for count, start, end in ranges:
+                postinglists = self.postings[start:end]
+                if found is None:
+                    found = set()
+                    for postings in postinglists:
+                        found.update(postings)
+                elif count <= len(found) * len(postinglists):
+                    found = set(i for postings in postinglists
+                                for i in postings if i in found)
+                else:   # few candidates left: look them up
+                    found = set(i for i in found
+                                if any(_contains(postings, i)
+                                       for postings in postinglists))
+                if not found:
+                    return []
+            return sorted(found)[:maxFileIds]
+
+    def memory_footprint(self):
+        '''approximate number of bytes used by the index'''
+        with self._lock:
+            self._merge()
+            return (sys.getsizeof(self.words) + sys.getsizeof(self.postings)
+                    + sum(sys.getsizeof(word) for word in self.words)
+                    + sum(sys.getsizeof(p) for p in self.postings))
+
+    def log_footprint(self):
+        size = self.memory_footprint()
+        log.i(_('in-memory search index: %(words)d words, %(entries)d '
+                'entries, %(size).1f MB'),
+              {'words': len(self.words), 'entries': len(self),
+               'size': size / 1024.0 / 1024.0})
+
+
+def _contains(postings, fileid):
+    pos = bisect_left(postings, fileid)
+    return pos < len(postings) and postings[pos] == fileid
+
+
+class SortedWords(object):
+    """ A sorted list of words that can be searched for the words within a
+        given edit distance of a misspelled one.
+
+        Words can be added, but not removed. Like in :class:`InvertedIndex`,
+        new words are merged into the sorted list before the next lookup.
+    """
+    def __init__(self, words=()):
+        self.words = sorted(set(words))
+        self.pending = set()
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return len(self.words) + len(self.pending)
+
+    def add(self, word):
+        with self._lock:
+            pos = bisect_left(self.words, word)
+            if pos == len(self.words) or self.words[pos] != word:
+                self.pending.add(word)
+
+    def similar(self, term, maxdist, maxsteps=None):
+        '''sorted list of (distance, word) for the words within maxdist of
+        term. With maxsteps, gives up after looking at that many prefixes
+        and returns what has been found so far.'''
+        with self._lock:
+            if self.pending:
+                self.words = sorted(self.pending.union(self.words))
+                self.pending = set()
+            words = self.words
+        return similar_words(words, term, maxdist, maxsteps)
+
+
+class PrefixTable(object):
+    """ Finds the highest ranked values whose keys start with a prefix.
+
+        Entries are ``(key, rank, value)`` tuples; a value can have several
+        keys. The top values for all prefixes of up to `precomputed`
+        characters are worked out in advance, since those prefixes match
+        the most keys. Longer prefixes match few enough keys to rank them
+        when asked. Values of equal rank are returned in sorted order.
+    """
+    def __init__(self, entries, size=10, precomputed=3):
+        self.size = size
+        self.precomputed = precomputed
+        entries = sorted(entries, key=itemgetter(0))
+        self.keys = [key for key, rank, value in entries]
+        self.entries = [(rank, value) for key, rank, value in entries]
+        self.top = {}
+        for length in range(1, precomputed + 1):
+            groupkey, group = None, []
+            for key, entry in zip(self.keys, self.entries):
+                if key[:length] != groupkey:
+                    self._settop(groupkey, group)
+                    groupkey, group = key[:length], []
+                group.append(entry)
+            self._settop(groupkey, group)
+
+    def _settop(self, prefix, entries):
+        if entries:
+            self.top[prefix] = self._best(entries, self.size)
+
+    @classmethod
+    def _best(cls, entries, count):
+        '''the values of the `count` highest ranked entries, each once'''
+        ranks = {}
+        for rank, value in entries:
+            if ranks.get(value, rank) <= rank:
+                ranks[value] = rank
+        best = heapq.nsmallest(count, ranks.items(),
+                               key=lambda item: (-item[1], item[0]))
+        return [value for value, rank in best]
+
+    def complete(self, prefix, count=None):
+        '''the highest ranked values with a key starting with prefix'''
+        count = self.size if count is None else min(count, self.size)
+        if not prefix:
+            return []
+        if len(prefix) <= self.precomputed:
+            return self.top.get(prefix, [])[:count]
+        start = bisect_left(self.keys, prefix)
+        end = start
+        while end < len(self.keys) and self.keys[end].startswith(prefix):
+            end += 1
+        return self._best(self.entries[start:end], count)
+
+
+def similar_words(words, term, maxdist, maxsteps=None):
+    '''Find the words within edit distance maxdist of term in a sorted list.
+
+    The list is walked like a trie, one prefix at a time, keeping the row of
+    edit distances between the prefix and all beginnings of term. Prefixes
+    whose row is all above maxdist are not followed any further, so only a
+    small part of the list is ever looked at.'''
+    found = []
+    stack = [('', list(range(len(term) + 1)), 0, len(words))]
+    steps = 0
+    while stack:
+        if maxsteps is not None and steps >= maxsteps:
+            log.d('gave up looking for words similar to %r', term)
+            break
+        steps += 1
+        prefix, row, start, end = stack.pop()
+        depth = len(prefix)
+        while start < end:
+            word = words[start]
+            if len(word) == depth:
+                if row[-1] <= maxdist:
+                    found.append((row[-1], word))
+                start += 1
+                continue
+            char = word[depth]
+            if sys.maxunicode <= ord(char):
+                childend = start + 1
+                while childend < end and words[childend][depth] == char:
+                    childend += 1
+            else:
+                childend = bisect_left(words, prefix + unichr(ord(char) + 1),
+                                       start, end)
+            childrow = [row[0] + 1]
+            for i, termchar in enumerate(term):
+                childrow.append(min(row[i + 1] + 1,
+                                    childrow[i] + 1,
+                                    row[i] + (termchar != char)))
+            if min(childrow) <= maxdist:
+                stack.append((prefix + char, childrow, start, childend))
+            start = childend
+    return sorted(found)
@@ -36,27 +36,36 @@ import os
 import re
 import sqlite3
 import sys
+import threading
+import time
 import traceback
 
 from backport.collections import deque, Counter
-from contextlib import closing
+from contextlib import closing, contextmanager
+from functools import wraps
 from operator import itemgetter
 
 try:
-    from imp import reload
-except ModuleNotFoundError:
-    from importlib import reload
+    from queue import LifoQueue
+except ImportError:
+    from Queue import LifoQueue
+
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    ProcessPoolExecutor = None
 
 import cherrymusicserver as cherry
 from cherrymusicserver import database
 from cherrymusicserver import log
+from cherrymusicserver import metainfo
 from cherrymusicserver import service
 from cherrymusicserver import util
 from cherrymusicserver.cherrymodel import MusicEntry
 from cherrymusicserver.database.connect import BoundConnector
 from cherrymusicserver.util import Performance
 from cherrymusicserver.progress import ProgressTree, ProgressReporter
-import cherrymusicserver.tweak
+from cherrymusicserver.searchindex import InvertedIndex, SortedWords, PrefixTable
 import random
 
 from backport import unichr
@@ -69,6 +78,20 @@ except ImportError:
 
 scanreportinterval = 1
 AUTOSAVEINTERVAL = 100
+# seconds between commits of a scan that finds few new files; each commit
+# saves a checkpoint to resume an interrupted scan from
+CHECKPOINTINTERVAL = 30
+# lowest limit of '?' parameters per statement among SQLite versions
+SQLITE_MAX_VARS = 999
+# completions kept for each prefix by autocomplete
+AUTOCOMPLETE_SIZE = 10
+# file types numbered in the playables table to pick random tracks from:
+# those browsers can play or audiotranscode can decode. The insert trigger
+# of the table lists them as well.
+PLAYABLE_FILETYPES = ('.aac', '.flac', '.m4a', '.mp3', '.mp4', '.oga', '.ogg',
+                      '.opus', '.wav', '.wma')
+# files per job handed to a tag reader process
+TAG_CHUNK_SIZE = 50
 debug = True
 keepInRam = False
 
@@ -86,38 +109,502 @@ SPECIAL_LETTER_TRANSFORMS = {
     'ü': 'ue',
 }
 
+class ScanStatus(object):
+    '''Numbers of a running library scan, kept up to date by the scan so
+    other threads can watch it.
+
+    :attr:`progress` is the root :class:`~cherrymusicserver.progress.ProgressTree`
+    of the path being scanned; :attr:`error` describes the exception that
+    stopped the last scan, if any. A scan of several paths sets
+    :attr:`paths`, so :attr:`percent` and :attr:`eta` cover all of them.
+    '''
+    def __init__(self):
+        self.progress = None
+        self.scanned = 0
+        self.added = 0
+        self.removed = 0
+        self.error = None
+        self.paths = 1
+        self.paths_done = 0
+        self.started = None
+
+    @property
+    def completeness(self):
+        current = self.progress.completeness if self.progress is not None else 0
+        return min(1.0, (self.paths_done + min(1.0, current)) / self.paths)
+
+    @property
+    def percent(self):
+        return self.completeness * 100
+
+    @property
+    def eta(self):
+        '''estimated seconds until all paths are scanned'''
+        completeness = self.completeness
+        if self.started is None or completeness == 0:
+            return 0
+        runtime = time.time() - self.started
+        return (1 - completeness) * runtime / completeness
+
+
+def _writer(method):
+    '''Run an SQLiteCache method as the single writer of the database.'''
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.writing():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class SQLiteCache(object):
 
     def __init__(self, connector=None):
-        database.require(DBNAME, version='1')
+        database.require(DBNAME, version='8')
         self.normalize_basedir()
-        connector = BoundConnector(DBNAME, connector)
-        self.DBFILENAME = connector.dblocation
-        self.conn = connector.connection()
-        self.db = self.conn.cursor()
+        self.connector = BoundConnector(DBNAME, connector)
+        self.DBFILENAME = self.connector.dblocation
+        self.conn = self.connector.connection()
+        self.scanbuffer = None
+        self.generation = 0
+        self.write_lock = threading.RLock()
+        self.writer = None
+        self.readers = threading.local()
+        self.wal = (cherry.config['media.db_wal'] and
+                    self.DBFILENAME != ':memory:')
+        if self.wal:
+            self.version_conn = self.connector.connection()
+        else:
+            # without WAL, reading data_version needs a shared lock and
+            # would wait for (or fail on) a running writer
+            self.version_conn = None
+        self.version_lock = threading.Lock()
+
+        if self.wal:
+            with closing(self.conn.execute('PRAGMA journal_mode = WAL')):
+                pass
+            with closing(self.conn.execute('PRAGMA synchronous = NORMAL')):
+                pass
+        else:
+            #I don't care about journaling!
+            with closing(self.conn.execute('PRAGMA synchronous = OFF')):
+                pass
+            with closing(self.conn.execute('PRAGMA journal_mode = MEMORY')):
+                pass
+        self.setup_connection(self.conn)
+        self.fts_index = self.setup_fts_index()
+        self.substring_index = self.setup_substring_index()
+        self.memory_index = self.setup_memory_index()
+        self.typo_index = self.setup_typo_index()
+        self.autocomplete_tables = None
+        self.autocomplete_lock = threading.Lock()
+        self.autocomplete_builder = None
+        self.file_db_mem = None
+        self.load_db_to_memory()
 
-        #I don't care about journaling!
-        with closing(self.conn.execute('PRAGMA synchronous = OFF')):
+    def setup_connection(self, conn):
+        '''apply the memory-mapping and cache settings to a connection'''
+        with closing(conn.execute('PRAGMA mmap_size = %d'
+                                  % int(cherry.config['media.db_mmap_size']))):
             pass
-        with closing(self.conn.execute('PRAGMA journal_mode = MEMORY')):
+        with closing(conn.execute('PRAGMA cache_size = -%d'
+                                  % int(cherry.config['media.db_cache_size']))):
             pass
-        self.load_db_to_memory()
+
+    @contextmanager
+    def writing(self):
+        '''Context for changing the database; only one thread at a time can
+        be in it. Yields the connection to write with.'''
+        with self.write_lock:
+            writer, self.writer = self.writer, threading.current_thread()
+            try:
+                yield self.conn
+            finally:
+                self.writer = writer
+
+    def reader(self):
+        '''The connection to read from in the current thread. In WAL mode,
+        each thread other than the writer gets its own connection, so reads
+        can run in parallel and never see uncommitted changes. Otherwise,
+        all threads share one connection.'''
+        if not self.wal or self.writer is threading.current_thread():
+            return self.conn
+        conn = getattr(self.readers, 'conn', None)
+        if conn is None:
+            conn = self.readers.conn = self.connector.connection()
+            self.setup_connection(conn)
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        '''Context for a transaction on the writer connection, like
+        ``with self.conn``. Its commit starts a new library generation.'''
+        with self.conn:
+            yield self.conn
+        self.generation += 1
+
+    @contextmanager
+    def savepoint(self, name):
+        '''Context for an atomic change inside the open transaction of a
+        scan: it is rolled back on errors, but neither commits nor rolls
+        back the work around it. Outside of a scan, it is a transaction.'''
+        if self.scanbuffer is None:
+            with self.transaction() as conn:
+                yield conn
+            return
+        if sys.version_info < (3, 6):
+            # older sqlite3 modules commit before a SAVEPOINT statement
+            # and lose track of the transaction it opens
+            self.commit()
+            with self.transaction() as conn:
+                yield conn
+            return
+        with closing(self.conn.execute('SAVEPOINT ' + name)):
+            pass
+        try:
+            yield self.conn
+        except:
+            with closing(self.conn.execute('ROLLBACK TO ' + name)):
+                pass
+            raise
+        finally:
+            with closing(self.conn.execute('RELEASE ' + name)):
+                pass
+
+    def commit(self):
+        '''Commit on the writer connection and start a new library
+        generation, so cached search results don't outlive the commit.'''
+        self.conn.commit()
+        self.generation += 1
+
+    def library_generation(self):
+        '''Changes whenever the media database has been updated, by this
+        cache or by another connection, e.g. a ``cherrymusic --update``.
+        Reads from a connection of its own, so it never waits for the
+        writer connection. Changes made by other connections are only
+        seen in WAL mode; otherwise, or if the database happens to be
+        locked, only this cache's own updates count.'''
+        if self.version_conn is None:
+            return (self.generation, 0)
+        with self.version_lock:
+            try:
+                with closing(self.version_conn.execute(
+                        'PRAGMA data_version')) as cursor:
+                    return (self.generation, cursor.fetchone()[0])
+            except sqlite3.OperationalError as err:
+                log.d('cannot read database version: %s', err)
+                return (self.generation, 0)
 
     def file_db_in_memory(self):
         return not self.DBFILENAME == ':memory:' and cherry.config['search.load_file_db_into_memory']
 
     def load_db_to_memory(self):
-        if self.file_db_in_memory():
-            self.file_db_mem = MemoryDB(self.DBFILENAME, 'files')
-            self.file_db_mem.db.execute('CREATE INDEX IF NOT EXISTS idx_files_parent'
-                          ' ON files(parent)')
+        if not self.file_db_in_memory():
+            return
+        if self.file_db_mem is not None:
+            with Performance(_('refreshing files database in memory')):
+                self.file_db_mem.refresh(self.changed_file_ids())
+            with self.conn:
+                with closing(self.conn.execute('DELETE FROM changed_files')):
+                    pass
+            return
+        self.track_file_changes()
+        self.file_db_mem = MemoryDB(self.DBFILENAME, 'files')
+        self.file_db_mem.db.execute('CREATE INDEX IF NOT EXISTS idx_files_parent'
+                      ' ON files(parent)')
+
+    def track_file_changes(self):
+        '''Record the ids of files that are updated or deleted through this
+        connection in the temporary table changed_files, to refresh the
+        in-memory copy of the files table with.'''
+        for statement in (
+                'CREATE TEMP TABLE IF NOT EXISTS changed_files ('
+                ' _id INTEGER PRIMARY KEY NOT NULL)',
+                'CREATE TEMP TRIGGER IF NOT EXISTS track_updated_files'
+                ' AFTER UPDATE ON main.files BEGIN'
+                '  INSERT OR IGNORE INTO changed_files VALUES (old._id);'
+                ' END',
+                'CREATE TEMP TRIGGER IF NOT EXISTS track_deleted_files'
+                ' AFTER DELETE ON main.files BEGIN'
+                '  INSERT OR IGNORE INTO changed_files VALUES (old._id);'
+                ' END'):
+            with closing(self.conn.execute(statement)):
+                pass
+
+    def changed_file_ids(self):
+        with closing(self.conn.execute('SELECT _id FROM changed_files')) as cursor:
+            return [row[0] for row in cursor]
+
+    def setup_fts_index(self):
+        '''Create the FTS5 search index if ``search.engine`` asks for it, or
+        drop it if not: it is only kept up to date while in use. Returns
+        True if the index is to be used.'''
+        use_fts = cherry.config['search.engine'] == 'fts5'
+        with closing(self.conn.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE name='search_fts'"
+                )) as cursor:
+            exists = cursor.fetchone()[0]
+        if exists:
+            if not use_fts:
+                log.i(_('dropping unused fts5 search index'))
+                with self.conn:
+                    self.conn.execute('DROP TABLE search_fts')
+            return use_fts
+        if not use_fts:
+            return False
+        try:
+            with self.conn:
+                self.conn.execute('CREATE VIRTUAL TABLE search_fts'
+                                  ' USING fts5(words,'
+                                  ' tokenize="unicode61 remove_diacritics 0")')
+                self.rebuild_fts_index()
+        except sqlite3.OperationalError as error:
+            log.e(_('cannot use the fts5 search engine: %s. '
+                    'Falling back to dictionary search.'), error)
+            return False
+        return True
+
+    def setup_substring_index(self):
+        '''Fill the trigram table for substring search if
+        ``search.substring_index`` is on and the table is empty, or empty it
+        if the option is off: it is only kept up to date while in use.
+        Returns True if the index is to be used.'''
+        use_index = cherry.config['search.substring_index']
+        with closing(self.conn.execute(
+                'SELECT EXISTS (SELECT * FROM trigrams)')) as cursor:
+            filled = cursor.fetchone()[0]
+        if filled and not use_index:
+            log.i(_('clearing unused substring search index'))
+            with self.conn:
+                self.conn.execute('DELETE FROM trigrams')
+        elif use_index and not filled:
+            with self.conn:
+                self.rebuild_substring_index()
+        return use_index
+
+    def setup_memory_index(self):
+        '''Build the in-memory search index if ``search.engine`` asks for it.
+        Returns the index, or None.'''
+        if cherry.config['search.engine'] != 'memory':
+            return None
+        log.i(_('building in-memory search index...'))
+        index = InvertedIndex.from_db(self.conn)
+        index.log_footprint()
+        return index
+
+    def setup_typo_index(self):
+        '''Build the sorted list of dictionary words used to correct typos
+        in search terms, if ``search.typo_tolerance`` is on. Returns the
+        list, or None.'''
+        if not cherry.config['search.typo_tolerance']:
+            return None
+        log.i(_('building typo correction index...'))
+        self.typo_index = SortedWords()
+        self.typo_index_lastid = 0
+        self.refresh_typo_index()
+        return self.typo_index
+
+    def refresh_typo_index(self):
+        '''Add the words that are new to the dictionary to the typo index.
+        Words can't be removed from it, so it is rebuilt once it holds twice
+        as many words as the dictionary.'''
+        with closing(self.conn.execute(
+                'SELECT COUNT(*) FROM dictionary')) as cursor:
+            if self.typo_index.size > 2 * cursor.fetchone()[0]:
+                return self.setup_typo_index()
+        with closing(self.conn.execute(
+                'SELECT _id, word FROM dictionary WHERE _id > ? ORDER BY _id',
+                (self.typo_index_lastid,))) as cursor:
+            rows = cursor.fetchall()
+        for wordid, word in rows:
+            self.typo_index.add(word)
+        if rows:
+            self.typo_index_lastid = rows[-1][0]
+        return self.typo_index
+
+    def has_prefix(self, term):
+        '''True if any word in the dictionary starts with term'''
+        if self.memory_index is not None:
+            return self.memory_index.has_prefix(term)
+        where, params = SQLiteCache.prefixcondition('word', term)
+        with closing(self.reader().execute(
+                'SELECT EXISTS (SELECT 1 FROM dictionary WHERE' + where + ')',
+                params)) as cursor:
+            return cursor.fetchone()[0]
+
+    def correct_typos(self, terms):
+        '''Returns a list of alternatives for each term: the term itself if
+        any word starts with it, or else the most similar words from the
+        dictionary, the most frequent first among equally similar ones.'''
+        tweaks = cherry.tweaks.current().SearchTweaks
+        alternatives = []
+        for term in terms:
+            if len(term) < tweaks.min_typo_term_length or self.has_prefix(term):
+                alternatives.append([term])
+                continue
+            maxdist = 1 if len(term) < tweaks.two_typo_term_length else 2
+            similar = dict((word, distance) for distance, word in
+                           self.typo_index.similar(term, maxdist,
+                                                   tweaks.max_typo_lookup_steps)
+                           [:SQLITE_MAX_VARS])
+            if not similar:
+                alternatives.append([term])
+                continue
+            # the index keeps words that have been removed since
+            with closing(self.reader().execute(
+                    'SELECT word, occurrences FROM dictionary WHERE word IN (%s)'
+                    % ', '.join('?' * len(similar)), list(similar))) as cursor:
+                found = sorted((similar[word], -occurrences, word)
+                               for word, occurrences in cursor)
+            corrections = [word for distance, occurrences, word in
+                           found[:tweaks.max_typo_corrections]]
+            if debug:
+                log.d('corrections for %r: %r', term, corrections)
+            alternatives.append(corrections or [term])
+        return alternatives
+
+    def setup_autocomplete_tables(self):
+        '''Build the prefix tables for autocomplete: dictionary words ranked
+        by occurrences, and directories ranked by number of entries and
+        keyed by the words in their names.'''
+        generation = self.library_generation()
+        with closing(self.reader().execute(
+                'SELECT word, occurrences FROM dictionary')) as cursor:
+            words = PrefixTable(((word, occurrences, word)
+                                 for word, occurrences in cursor),
+                                size=AUTOCOMPLETE_SIZE)
+        with closing(self.reader().execute('''
+                SELECT dirs.filename, dirs.path, COUNT(entries._id)
+                FROM files AS dirs LEFT JOIN files AS entries
+                    ON entries.parent = dirs._id
+                WHERE dirs.isdir = 1 AND dirs.path IS NOT NULL
+                GROUP BY dirs._id''')) as cursor:
+            dirs = cursor.fetchall()
+        directories = PrefixTable(
+            ((term, entries, path.replace('/', os.path.sep))
+             for name, path, entries in dirs
+             for term in SQLiteCache.searchterms(name)),
+            size=AUTOCOMPLETE_SIZE)
+        return generation, words, directories
+
+    def autocomplete(self, text, count=AUTOCOMPLETE_SIZE):
+        '''Complete the last word of a search text. Returns a dict with the
+        most frequent ``words`` and the biggest ``directories`` that have a
+        word starting with it.'''
+        completions = {'words': [], 'directories': []}
+        words = re.findall(r'(\w+|[^\s\w]+)',
+                           text.replace('_', ' ').replace('%', ' '), re.UNICODE)
+        if not words:
+            return completions
+        with self.autocomplete_lock:
+            if self.autocomplete_tables is None:
+                with Performance(_('building autocomplete tables')):
+                    self.autocomplete_tables = self.setup_autocomplete_tables()
+            generation, wordtable, dirtable = self.autocomplete_tables
+        if (generation != self.library_generation()
+                and self.scanbuffer is None):
+            # e.g. changed by another process; a scan of our own
+            # refreshes the tables once it is done
+            self.refresh_autocomplete()
+        prefix = words[-1].lower()
+        prefixes = [prefix] + sorted(SQLiteCache.searchterms(prefix) - set([prefix]))
+        for key, table in (('words', wordtable), ('directories', dirtable)):
+            found = completions[key]
+            for prefix in prefixes:
+                for value in table.complete(prefix, count):
+                    if value not in found and len(found) < count:
+                        found.append(value)
+        return completions
+
+    def refresh_autocomplete(self):
+        '''Rebuild the autocomplete tables in a background thread, if they
+        have been built before and no rebuild is running yet. Until the new
+        tables are swapped in, autocomplete keeps using the old ones.'''
+        with self.autocomplete_lock:
+            if (self.autocomplete_tables is None or
+                    self.autocomplete_builder is not None):
+                return
+            if self.DBFILENAME == ':memory:':
+                # only readable by the thread that opened it
+                self.autocomplete_tables = self.setup_autocomplete_tables()
+                return
+            builder = self.autocomplete_builder = threading.Thread(
+                name='AutocompleteBuilder', target=self._rebuild_autocomplete)
+            builder.daemon = True
+        builder.start()
+
+    def _rebuild_autocomplete(self):
+        try:
+            with Performance(_('building autocomplete tables')):
+                self.autocomplete_tables = self.setup_autocomplete_tables()
+        except Exception as exc:
+            log.e(_('error while building autocomplete tables: %s'), exc)
+        finally:
+            with self.autocomplete_lock:
+                self.autocomplete_builder = None
+
+    def indexed_words(self, where, params=()):
+        '''(word, fileid) pairs from the search table, for the files
+        matching the SQL condition on search.frowid'''
+        with closing(self.conn.execute(
+                'SELECT dictionary.word, search.frowid FROM search JOIN'
+                ' dictionary ON dictionary._id = search.drowid'
+                ' WHERE search.frowid ' + where, params)) as cursor:
+            return cursor.fetchall()
+
+    def remove_from_memory_index(self, rows):
+        '''remove (word, fileid) pairs from the in-memory search index'''
+        byfile = {}
+        for word, fileid in rows:
+            byfile.setdefault(fileid, []).append(word)
+        for fileid, words in byfile.items():
+            self.memory_index.remove(fileid, words)
+
+    def rebuild_substring_index(self):
+        '''Fill the trigram table from the names in the files table'''
+        log.i(_('building substring search index...'))
+        with closing(self.conn.execute('DELETE FROM trigrams')):
+            pass
+        with closing(self.conn.execute('SELECT _id, filename FROM files')) as cursor:
+            rows = cursor.fetchall()
+        for fileid, filename in rows:
+            self.add_to_trigram_table(fileid, filename)
+
+    def rebuild_fts_index(self):
+        '''Fill the FTS5 search index from the dictionary and search tables'''
+        log.i(_('building fts5 search index...'))
+        with closing(self.conn.execute('DELETE FROM search_fts')):
+            pass
+        with closing(self.conn.execute('''
+                INSERT INTO search_fts(rowid, words)
+                    SELECT search.frowid, group_concat(dictionary.word, ' ')
+                    FROM search JOIN dictionary ON search.drowid = dictionary._id
+                    GROUP BY search.frowid''')):
+            pass
+
+    @classmethod
+    def substringtexts(cls, name):
+        '''The lowercase variants of a name that substring search looks for
+        search terms in'''
+        text = name.replace('_', ' ').replace('%', ' ').lower()
+        texts = set((text,))
+        if UNIDECODE_AVAILABLE:
+            texts.add(unidecode.unidecode(text))
+        return texts
+
+    @classmethod
+    def trigrams(cls, name):
+        '''The set of all three-character substrings in the substringtexts
+        of a name'''
+        return set(text[i:i + 3]
+                   for text in SQLiteCache.substringtexts(name)
+                   for i in range(len(text) - 2))
 
     @classmethod
     def searchterms(cls, searchterm):
         searchterm = searchterm.replace('_', ' ').replace('%',' ')
         words = [
             word.lower() for word in
-            re.findall('(\w+|[^\s\w]+)', searchterm, re.UNICODE)
+            re.findall(r'(\w+|[^\s\w]+)', searchterm, re.UNICODE)
         ]
         if UNIDECODE_AVAILABLE:
             unidecoded = [unidecode.unidecode(word) for word in words]
@@ -138,15 +625,8 @@ class SQLiteCache(object):
         resultlist = []
 
         for term in terms:
-            tprefix, tlast = term[:-1], term[-1]
             query = '''SELECT search.frowid FROM dictionary JOIN search ON search.drowid = dictionary.rowid WHERE '''
-            if sys.maxunicode <= ord(tlast):
-                where = ''' dictionary.word LIKE ? '''
-                params = (term + '%',)
-            else:
-                where = ''' (dictionary.word >= ? AND dictionary.word < ?) '''
-                nextchr = unichr(1 + ord(tlast))
-                params = (term, tprefix + nextchr)
+            where, params = SQLiteCache.prefixcondition('dictionary.word', term)
             order = ' ORDER BY dictionary.occurrences DESC '
             limit = ' LIMIT 0, ' + str(maxFileIdsPerTerm) #TODO add maximum db results as configuration parameter
             sql = query + where + order +limit
@@ -154,10 +634,94 @@ class SQLiteCache(object):
                 log.d('Search term: %r', term)
                 log.d('Query used: %r, %r', sql, params)
             #print(self.conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall())
-            self.db.execute(sql, params)
-            resultlist += [t[0] for t in self.db.fetchall()]
+            with closing(self.reader().execute(sql, params)) as cursor:
+                resultlist += [t[0] for t in cursor.fetchall()]
+        return resultlist
+
+    @classmethod
+    def prefixcondition(cls, column, term):
+        '''returns an SQL condition and its parameters that match all words
+        in `column` starting with `term`'''
+        tprefix, tlast = term[:-1], term[-1]
+        if sys.maxunicode <= ord(tlast):
+            return ''' {0} LIKE ? '''.format(column), (term + '%',)
+        nextchr = unichr(1 + ord(tlast))
+        return ''' ({0} >= ? AND {0} < ?) '''.format(column), (term, tprefix + nextchr)
+
+    def fetchFileIdsMatchingAll(self, terms, maxFileIds):
+        '''returns a list of ids of files that have a word starting with
+        each one of the terms.
+
+        Only the search entries for the rarest term are fetched; each of
+        these files is then checked for the other terms by looking at its
+        own words, so adding a common term to a query costs next to
+        nothing.'''
+        assert '' not in terms, _("terms must not contain ''")
+        conditions = []
+        for term in set(terms):
+            where, params = SQLiteCache.prefixcondition('dictionary.word', term)
+            with closing(self.reader().execute(
+                    'SELECT total(occurrences) FROM dictionary WHERE' + where,
+                    params)) as cursor:
+                occurrences = cursor.fetchone()[0]
+            if not occurrences:
+                return []
+            conditions.append((occurrences, term))
+        conditions.sort()
+        rarest = conditions[0][1]
+        where, params = SQLiteCache.prefixcondition('dictionary.word', rarest)
+        sql = '''SELECT DISTINCT search.frowid FROM dictionary JOIN search ON search.drowid = dictionary._id WHERE ''' + where
+        for occurrences, term in conditions[1:]:
+            otherwhere, otherparams = SQLiteCache.prefixcondition('other.word', term)
+            sql += ''' AND EXISTS (SELECT 1 FROM search AS others JOIN dictionary AS other ON other._id = others.drowid WHERE others.frowid = search.frowid AND ''' + otherwhere + ')'
+            params += otherparams
+        sql += ' LIMIT 0, ?'
+        params += (maxFileIds,)
+        if debug:
+            log.d('Query used: %r, %r', sql, params)
+        with closing(self.reader().execute(sql, params)) as cursor:
+            return [t[0] for t in cursor.fetchall()]
+
+    def fetchFileIdsBySubstring(self, terms, maxFileIdsPerTerm):
+        '''returns a list of ids of files whose names contain one of the
+        terms anywhere, not just at the start of a word. Terms shorter than a
+        trigram are ignored.'''
+        resultlist = []
+        for term in terms:
+            grams = sorted(set(term[i:i + 3] for i in range(len(term) - 2)))
+            if not grams:
+                continue
+            # files that have all trigrams of the term; most of them will
+            # also contain the term itself, but that needs to be checked
+            sql = '''SELECT _id, filename FROM files WHERE _id IN (
+                         {intersection} LIMIT 0, ?)'''.format(
+                intersection=' INTERSECT '.join(
+                    ['SELECT frowid FROM trigrams WHERE trigram = ?'] * len(grams)))
+            params = tuple(grams) + (maxFileIdsPerTerm,)
+            if debug:
+                log.d('Query used: %r, %r', sql, params)
+            with closing(self.reader().execute(sql, params)) as cursor:
+                candidates = cursor.fetchall()
+            resultlist += [fileid for fileid, filename in candidates
+                           if any(term in text for text in
+                                  SQLiteCache.substringtexts(filename))]
         return resultlist
 
+    def fetchFileIdsFTS(self, terms, maxFileIds):
+        '''returns a list of up to maxFileIds file ids, best matches first,
+        for files that have a word starting with any of the terms'''
+        phrases = ['"%s"*' % term.replace('"', '""')
+                   for term in sorted(terms) if re.search(r'\w', term, re.UNICODE)]
+        if not phrases:
+            return []
+        sql = '''SELECT rowid FROM search_fts WHERE search_fts MATCH ?
+                 ORDER BY rank LIMIT 0, ?'''
+        params = (' OR '.join(phrases), maxFileIds)
+        if debug:
+            log.d('Query used: %r, %r', sql, params)
+        with closing(self.reader().execute(sql, params)) as cursor:
+            return [t[0] for t in cursor.fetchall()]
+
     def searchfor(self, value, maxresults=10):
         mode = 'normal'
         if value.startswith('!f '):
@@ -173,19 +737,47 @@ class SQLiteCache(object):
             mode = 'dironly'
             value = value[:-3]
 
-        reload(cherrymusicserver.tweak)
-        file_search_limit = cherrymusicserver.tweak.SearchTweaks.normal_file_search_limit
+        file_search_limit = cherry.tweaks.current().SearchTweaks.normal_file_search_limit
 
-        terms = SQLiteCache.searchterms(value)
+        terms = typed_terms = SQLiteCache.searchterms(value)
+        any_terms = terms
+        if self.typo_index is not None and terms:
+            with Performance(_('correcting typos')):
+                alternatives = self.correct_typos(terms)
+            terms = [alts[0] for alts in alternatives]
+            any_terms = [alt for alts in alternatives for alt in alts]
         with Performance(_('searching for a maximum of %s files') % str(file_search_limit * len(terms))):
             if debug:
                 log.d('searchterms')
                 log.d(terms)
             results = []
 
-            maxFileIdsPerTerm = file_search_limit
-            with Performance(_('file id fetching')):
-                fileids = self.fetchFileIds(terms, maxFileIdsPerTerm, mode)
+            if self.fts_index:
+                with Performance(_('file id fetching (fts5)')):
+                    fileids = self.fetchFileIdsFTS(any_terms, file_search_limit)
+            elif self.memory_index is not None:
+                index = self.memory_index
+                fileids = []
+                if len(terms) > 1:
+                    with Performance(_('file id fetching for all terms (memory)')):
+                        fileids = index.matching_all(terms, file_search_limit)
+                if len(fileids) < maxresults:
+                    with Performance(_('file id fetching (memory)')):
+                        fileids += index.matching_any(any_terms, file_search_limit)
+            else:
+                fileids = []
+                if len(terms) > 1:
+                    with Performance(_('file id fetching for all terms')):
+                        fileids = self.fetchFileIdsMatchingAll(terms, file_search_limit)
+                # too few files match all terms: add those matching any
+                if len(fileids) < maxresults:
+                    maxFileIdsPerTerm = file_search_limit
+                    with Performance(_('file id fetching')):
+                        fileids += self.fetchFileIds(any_terms, maxFileIdsPerTerm, mode)
+
+            if self.substring_index:
+                with Performance(_('file id fetching by substring')):
+                    fileids += self.fetchFileIdsBySubstring(typed_terms, file_search_limit)
 
             if len(fileids) > file_search_limit:
                 with Performance(_('sorting results by fileid occurrences')):
@@ -216,40 +808,76 @@ class SQLiteCache(object):
             return []
         return [f.basename for f in self.fetch_child_files(targetdir)]
 
-    def randomFileEntries(self, count):
-        ''' Return a number of random entries from the file cache.
-
-            The actual number returned may be less than ``count`` if the
-            database does not contain enough entries or if randomization hits
-            directory entries or entries that have been deleted.
+    def songinfo(self, paths):
+        '''Map paths relative to basedir to the
+        :class:`~cherrymusicserver.metainfo.Metainfo` stored for them.
+        Paths without stored tags are left out.'''
+        stored = dict((path.replace(os.path.sep, '/'), path) for path in paths)
+        storedpaths = list(stored)
+        found = {}
+        conn = self.reader()
+        for start in range(0, len(storedpaths), SQLITE_MAX_VARS):
+            chunk = storedpaths[start:start + SQLITE_MAX_VARS]
+            with closing(conn.execute(
+                    'SELECT files.path, artist, album, title, track, duration'
+                    ' FROM files JOIN tags ON tags.frowid = files._id'
+                    ' WHERE files.path IN (%s)' % ', '.join('?' * len(chunk)),
+                    chunk)) as cursor:
+                for row in cursor:
+                    found[stored[row[0]]] = metainfo.Metainfo(*row[1:])
+        return found
+
+    def randomFileEntries(self, count, formats=None):
+        ''' Return a number of random file entries from the file cache.
+
+            Files are picked by their number in the playables table, which
+            numbers the playable files of each type without gaps. If
+            ``formats`` is given, only files with one of these extensions
+            are picked. The actual number returned is less than ``count``
+            only if there are not enough such files.
         '''
         assert count >= 0
-        cursor = self.conn.cursor()
-        minId = cursor.execute('''SELECT _id FROM files ORDER BY _id ASC LIMIT 1;''').fetchone()
-        if minId is None:
-            return ()     # database is empty
-        minId = minId[0]
-        maxId = cursor.execute('''SELECT _id FROM files ORDER BY _id DESC LIMIT 1;''').fetchone()[0]
-
-        if sys.version_info < (3,):
-            genrange = xrange                   # use generator, not a large list
-        else:
-            genrange = range
-
-        if maxId - minId < count:
-            file_ids = genrange(minId, maxId + 1)
+        if formats is None:
+            filetypes = PLAYABLE_FILETYPES
         else:
-            # range generator pays off:
-            file_ids = random.sample(genrange(minId, maxId + 1), count)
-
-        entries = self.musicEntryFromFileIds(file_ids, mode='fileonly')
+            filetypes = sorted(set('.' + ext.lower() for ext in formats))
+        reader = self.reader()
+        sizes = []
+        for filetype in filetypes:
+            with closing(reader.execute(
+                    'SELECT MAX(number) FROM playables WHERE filetype = ?',
+                    (filetype,))) as cursor:
+                size = cursor.fetchone()[0]
+            if size:
+                sizes.append((filetype, size))
+        total = sum(size for filetype, size in sizes)
+        picks = sorted(random.sample(range(total), min(count, total)))
+
+        # (filetype, number) of each pick, counting through the types in turn
+        numbers = []
+        offset, typeindex = 0, 0
+        for pick in picks:
+            while pick >= offset + sizes[typeindex][1]:
+                offset += sizes[typeindex][1]
+                typeindex += 1
+            numbers.append((sizes[typeindex][0], pick - offset + 1))
+
+        fileids = []
+        for i in range(0, len(numbers), SQLITE_MAX_VARS // 2):
+            chunk = numbers[i:i + SQLITE_MAX_VARS // 2]
+            with closing(reader.execute(
+                    'SELECT frowid FROM playables WHERE '
+                    + ' OR '.join(['(filetype = ? AND number = ?)'] * len(chunk)),
+                    [value for pick in chunk for value in pick])) as cursor:
+                fileids += [row[0] for row in cursor]
+
+        entries = self.musicEntryFromFileIds(fileids, mode='fileonly')
         random.shuffle(entries)
         return entries
 
 
     def musicEntryFromFileIds(self, filerowids, incompleteMusicEntries=None, mode='normal'):
-        reload(cherrymusicserver.tweak)
-        file_search_limit = cherrymusicserver.tweak.SearchTweaks.normal_file_search_limit
+        file_search_limit = cherry.tweaks.current().SearchTweaks.normal_file_search_limit
 
         #incompleteMusicEntries maps db parentid to incomplete musicEntry
         assert mode in ('normal', 'dironly', 'fileonly'), mode
@@ -257,13 +885,7 @@ class SQLiteCache(object):
             incompleteMusicEntries = {}
         musicEntries = [] #result list
 
-        if self.file_db_in_memory():
-            db = self.file_db_mem.db
-        else:
-            db = self.conn
-
-        cursor = db.cursor()
-        sqlquery = '''  SELECT rowid, parent, filename, filetype, isdir
+        sqlquery = '''  SELECT rowid, parent, filename, filetype, isdir, path
                         FROM files WHERE rowid IN ({ids})'''.format(
                             ids=', '.join('?' * len(filerowids)))
         sqlparams = tuple(filerowids)
@@ -276,8 +898,23 @@ class SQLiteCache(object):
             sqlquery += ' LIMIT 0, ?'
             sqlparams += (file_search_limit,)
 
-        cursor.execute(sqlquery, sqlparams)
-        for id, parent_id, filename, fileext, isdir in cursor.fetchall():
+        if self.file_db_in_memory():
+            rows = self.file_db_mem.query(sqlquery, sqlparams)
+        else:
+            with closing(self.reader().execute(sqlquery, sqlparams)) as cursor:
+                rows = cursor.fetchall()
+        for id, parent_id, filename, fileext, isdir, fullpath in rows:
+            if fullpath is not None:
+                # path is known: no need to look up the parents
+                fullpath = fullpath.replace('/', os.path.sep)
+                if id in incompleteMusicEntries:
+                    entries = incompleteMusicEntries.pop(id)
+                    for entry in entries:
+                        entry.path = os.path.join(fullpath, entry.path)
+                else:
+                    entries = [MusicEntry(fullpath, dir=bool(isdir))]
+                musicEntries += entries
+                continue
             path = filename + fileext
             #check if fetched row is parent of existing entry
             if id in incompleteMusicEntries:
@@ -311,25 +948,49 @@ class SQLiteCache(object):
             self.add_to_file_table(fileobj)
             word_ids = self.add_to_dictionary_table(fileobj.name)
             self.add_to_search_table(fileobj.uid, word_ids)
+            if self.fts_index:
+                self.add_to_fts_index(fileobj.uid, fileobj.name)
+            if self.substring_index:
+                self.add_to_trigram_table(fileobj.uid, fileobj.name)
+            if self.memory_index is not None:
+                self.memory_index.add(fileobj.uid,
+                                      SQLiteCache.searchterms(fileobj.name))
+            if _hastags(fileobj):
+                self.add_to_tags_table(fileobj)
             return fileobj
         except UnicodeEncodeError as e:
             log.e(_("wrong encoding for filename '%s' (%s)"), fileobj.relpath, e.__class__.__name__)
 
 
     def add_to_file_table(self, fileobj):
-        with closing(self.conn.execute('INSERT INTO files (parent, filename, filetype, isdir) VALUES (?,?,?,?)', (fileobj.parent.uid if fileobj.parent else -1, fileobj.name, fileobj.ext, 1 if fileobj.isdir else 0))) as cursor:
+        if self.scanbuffer is not None:
+            return self.scanbuffer.add_file(fileobj)
+        with closing(self.conn.execute('INSERT INTO files (parent, filename, filetype, isdir, mtime, size, inode, path) VALUES (?,?,?,?,?,?,?,?)', (fileobj.parent.uid if fileobj.parent else -1, fileobj.name, fileobj.ext, 1 if fileobj.isdir else 0) + _storedstat(fileobj) + (_storedpath(fileobj),))) as cursor:
             rowid = cursor.lastrowid
         fileobj.uid = rowid
         return fileobj
 
 
+    def add_to_tags_table(self, fileobj):
+        '''read the tags of an audio file and store them, replacing any tags
+        stored before'''
+        if self.scanbuffer is not None:
+            return self.scanbuffer.read_tags(fileobj.uid, fileobj.fullpath)
+        rows, errors = metainfo.readTags([(fileobj.uid, fileobj.fullpath)])
+        _log_tag_errors(errors)
+        _store_tags(self.conn, rows)
+
+
     def add_to_dictionary_table(self, filename):
+        if self.scanbuffer is not None:
+            return [self.scanbuffer.word_id(word)
+                    for word in SQLiteCache.searchterms(filename)]
         word_ids = []
         for word in set(SQLiteCache.searchterms(filename)):
             with closing(self.conn.execute('''SELECT rowid FROM dictionary WHERE word = ? LIMIT 0,1''', (word,))) as cursor:
                 wordrowid = cursor.fetchone()
             if wordrowid is None:
-                with closing(self.conn.execute('''INSERT INTO dictionary (word) VALUES (?)''', (word,))) as cursor:
+                with closing(self.conn.execute('''INSERT INTO dictionary (word, occurrences) VALUES (?, 0)''', (word,))) as cursor:
                     wordrowid = cursor.lastrowid
             else:
                 wordrowid = wordrowid[0]
@@ -338,43 +999,128 @@ class SQLiteCache(object):
 
 
     def add_to_search_table(self, file_id, word_id_seq):
+        if self.scanbuffer is not None:
+            self.scanbuffer.add_search(file_id, word_id_seq)
+            return
         with closing(
             self.conn.executemany('INSERT INTO search (drowid, frowid) VALUES (?,?)',
                                   ((wid, file_id) for wid in word_id_seq))):
             pass
+        _count_occurrences(self.conn, word_id_seq)
 
 
-    def remove_recursive(self, fileobj, progress=None):
-        '''recursively remove fileobj and all its children from the media db.'''
+    def add_to_fts_index(self, file_id, filename):
+        words = ' '.join(sorted(SQLiteCache.searchterms(filename)))
+        if self.scanbuffer is not None:
+            self.scanbuffer.add_fts(file_id, words)
+            return
+        with closing(self.conn.execute(
+                'INSERT INTO search_fts (rowid, words) VALUES (?,?)',
+                (file_id, words))):
+            pass
+
+
+    def add_to_trigram_table(self, file_id, name):
+        rows = [(gram, file_id) for gram in SQLiteCache.trigrams(name)]
+        if self.scanbuffer is not None:
+            self.scanbuffer.add_trigrams(rows)
+            return
+        with closing(self.conn.executemany(
+                'INSERT INTO trigrams (trigram, frowid) VALUES (?,?)', rows)):
+            pass
+
 
+    def remove_recursive(self, fileobj, progress=None):
+        '''recursively remove fileobj and all its children from the media db.
 
+        The subtree is collected into a temporary table with one recursive
+        query, and then removed from each table with a single statement.'''
         if progress is None:
             log.i(
                   _('removing dead reference(s): %s "%s"'),
                   'directory' if fileobj.isdir else 'file',
                   fileobj.relpath,
                   )
-            factory = None
-            remove = lambda item: self.remove_file(item)
-        else:
-            def factory(new, pnt):
-                if pnt is None:
-                    return (new, None, progress)
-                return (new, pnt, pnt[2].spawnchild('[-] ' + new.relpath))
-            remove = lambda item: (self.remove_file(item[0]), item[2].tick())
+        statements = self._remove_collected_statements()
+        if progress is not None:
+            progress.extend(len(statements))
+        tick = progress.tick if progress is not None else lambda: None
 
         deld = 0
+        indexed = ()
         try:
-            with self.conn:
-                for item in self.db_recursive_filelister(fileobj, factory):
-                    remove(item)
-                    deld += 1
+            with self.savepoint('remove_recursive'):
+                if self.scanbuffer is not None:
+                    # pending search rows still count as word references
+                    self.scanbuffer.flush()
+                deld = self.collect_subtree(fileobj.uid)
+                tick()
+                if self.memory_index is not None:
+                    indexed = self.indexed_words(
+                        'IN (SELECT _id FROM removed_files)')
+                for statement in statements:
+                    with closing(self.conn.execute(statement)):
+                        pass
+                    tick()
         except Exception as e:
             log.e(_('error while removing dead reference(s): %s'), e)
             log.e(_('rolled back to safe state.'))
             return 0
         else:
+            if indexed:
+                self.remove_from_memory_index(indexed)
             return deld
+        finally:
+            if self.scanbuffer is not None:
+                self.scanbuffer.forget_words()
+
+
+    def collect_subtree(self, fileid):
+        '''fills the temporary table removed_files with the ids of a file and
+        all its descendants, and returns their number.'''
+        for statement in (
+                'CREATE TEMP TABLE IF NOT EXISTS removed_files ('
+                ' _id INTEGER PRIMARY KEY NOT NULL)',
+                'CREATE TEMP TABLE IF NOT EXISTS removed_words ('
+                ' _id INTEGER PRIMARY KEY NOT NULL, count INTEGER NOT NULL)',
+                'DELETE FROM removed_files',
+                'DELETE FROM removed_words'):
+            with closing(self.conn.execute(statement)):
+                pass
+        with closing(self.conn.execute(
+                'INSERT INTO removed_files (_id)'
+                ' WITH RECURSIVE subtree(_id) AS ('
+                '  SELECT ?'
+                '  UNION ALL'
+                '  SELECT files._id FROM files JOIN subtree'
+                '   ON files.parent = subtree._id'
+                ' ) SELECT _id FROM subtree', (fileid,))) as cursor:
+            return cursor.rowcount
+
+
+    def _remove_collected_statements(self):
+        '''statements that remove the files in removed_files from all tables,
+        along with the dictionary words that only they referenced'''
+        statements = [
+            'INSERT INTO removed_words (_id, count)'
+            ' SELECT drowid, count(*) FROM search'
+            ' WHERE frowid IN (SELECT _id FROM removed_files) GROUP BY drowid',
+            'DELETE FROM search WHERE frowid IN (SELECT _id FROM removed_files)',
+            'UPDATE dictionary SET occurrences = occurrences - ('
+            ' SELECT count FROM removed_words WHERE removed_words._id = dictionary._id)'
+            ' WHERE _id IN (SELECT _id FROM removed_words)',
+            'DELETE FROM dictionary WHERE _id IN (SELECT _id FROM removed_words)'
+            ' AND NOT EXISTS (SELECT 1 FROM search WHERE drowid = dictionary._id)',
+        ]
+        if self.fts_index:
+            statements.append('DELETE FROM search_fts'
+                              ' WHERE rowid IN (SELECT _id FROM removed_files)')
+        if self.substring_index:
+            statements.append('DELETE FROM trigrams'
+                              ' WHERE frowid IN (SELECT _id FROM removed_files)')
+        statements.append('DELETE FROM files'
+                          ' WHERE _id IN (SELECT _id FROM removed_files)')
+        return statements
 
 
     def remove_file(self, fileobj):
@@ -383,8 +1129,15 @@ class SQLiteCache(object):
             - all dictionary words which were orphaned by this,
             - the reference in the files table.'''
         try:
+            if self.memory_index is not None:
+                self.remove_from_memory_index(
+                    self.indexed_words('= ?', (fileobj.uid,)))
             dead_wordids = self.remove_from_search(fileobj.uid)
             self.remove_all_from_dictionary(dead_wordids)
+            if self.fts_index:
+                self.remove_from_fts_index(fileobj.uid)
+            if self.substring_index:
+                self.remove_from_trigram_table(fileobj.uid)
             self.remove_from_files(fileobj.uid)
         except Exception as exception:
             log.ex(exception)
@@ -404,12 +1157,13 @@ class SQLiteCache(object):
 
         with closing(self.conn.execute('DELETE FROM search WHERE frowid=?', (fileid,))):
             pass
+        _count_occurrences(self.conn, (t[0] for t in foundlist), -1)
 
         for wid in set(wordset):
-            with closing(self.conn.execute('SELECT count(*) FROM search'
-                                      ' WHERE drowid=?', (wid,))) as cursor:
-                count = cursor.fetchone()[0]
-            if count:
+            with closing(self.conn.execute('SELECT EXISTS(SELECT 1 FROM search'
+                                      ' WHERE drowid=?)', (wid,))) as cursor:
+                found = cursor.fetchone()[0]
+            if found:
                 wordset.remove(wid)
         return wordset
 
@@ -423,6 +1177,16 @@ class SQLiteCache(object):
             pass
 
 
+    def remove_from_fts_index(self, fileid):
+        with closing(self.conn.execute('DELETE FROM search_fts WHERE rowid=?', (fileid,))):
+            pass
+
+
+    def remove_from_trigram_table(self, fileid):
+        with closing(self.conn.execute('DELETE FROM trigrams WHERE frowid=?', (fileid,))):
+            pass
+
+
     def remove_from_files(self, fileid):
         '''deletes the given file id from the files table'''
         with closing(self.conn.execute('DELETE FROM files WHERE rowid=?', (fileid,))):
@@ -451,8 +1215,9 @@ class SQLiteCache(object):
     def fetch_child_files(self, fileobj, sort=True, reverse=False):
         '''fetches from files table a list of all File objects that have the
         argument fileobj as their parent.'''
-        with closing(self.conn.execute(
-                                    'SELECT rowid, filename, filetype, isdir' \
+        with closing(self.reader().execute(
+                                    'SELECT rowid, filename, filetype, isdir,' \
+                                    ' mtime, size, inode' \
                                     ' FROM files where parent=?', (fileobj.uid,))) as cursor:
             id_tuples = cursor.fetchall()
         if sort:
@@ -460,7 +1225,9 @@ class SQLiteCache(object):
         return (File(name + ext,
                      parent=fileobj,
                      isdir=False if isdir == 0 else True,
-                     uid=uid) for uid, name, ext, isdir in id_tuples)
+                     uid=uid,
+                     stat=(mtime, size, inode))
+                for uid, name, ext, isdir, mtime, size, inode in id_tuples)
 
 
     def normalize_basedir(self):
@@ -473,23 +1240,29 @@ class SQLiteCache(object):
 
 
     @util.timed
-    def full_update(self):
+    def full_update(self, status=None):
         '''verify complete media database against the filesystem and make
-        necesary changes.'''
+        necesary changes. A :class:`ScanStatus` can be passed to follow
+        along.'''
 
         log.i(_('running full update...'))
         try:
-            self.update_db_recursive(cherry.config['media.basedir'], skipfirst=True)
+            self.update_db_recursive(cherry.config['media.basedir'],
+                                     skipfirst=True, status=status)
+            self.fill_missing_tags()
         except:
             log.e(_('error during media update. database update incomplete.'))
         finally:
-            self.update_word_occurrences()
             log.i(_('media database update complete.'))
 
 
-    def partial_update(self, path, *paths):
+    def partial_update(self, path, *paths, **kwargs):
+        '''update the media database for paths in basedir. A
+        :class:`ScanStatus` can be passed as `status` to follow along.'''
+        status = kwargs.pop('status', None) or ScanStatus()
         basedir = cherry.config['media.basedir']
         paths = (path,) + paths
+        status.paths = len(paths)
         log.i(_('updating paths: %s') % (paths,))
         for path in paths:
             path = os.path.normcase(path)
@@ -497,19 +1270,29 @@ class SQLiteCache(object):
             normpath = os.path.normpath(abspath)
             if not normpath.startswith(basedir):
                 log.e(_('path is not in basedir. skipping %r') % abspath)
+                status.paths_done += 1
                 continue
             log.i(_('updating %r...') % path)
             try:
-                self.update_db_recursive(normpath, skipfirst=False)
+                self.update_db_recursive(normpath, skipfirst=False,
+                                         status=status)
             except Exception as exception:
                 log.e(_('update incomplete: %r'), exception)
-        self.update_word_occurrences()
+            # the next path's scan starts a new progress tree
+            status.paths_done += 1
+            status.progress = None
         log.i(_('done updating paths.'))
 
 
-    def update_db_recursive(self, fullpath, skipfirst=False):
-        '''recursively update the media database for a path in basedir'''
+    @_writer
+    def update_db_recursive(self, fullpath, skipfirst=False, status=None):
+        '''recursively update the media database for a path in basedir,
+        keeping `status` (a :class:`ScanStatus`) up to date if given'''
 
+        if status is None:
+            status = ScanStatus()
+        if status.started is None:
+            status.started = time.time()
         from collections import namedtuple
         Item = namedtuple('Item', 'infs indb parent progress')
         def factory(fs, db, parent):
@@ -519,63 +1302,220 @@ class SQLiteCache(object):
                 progress = ProgressTree(name=name)
                 maxlen = lambda s: util.trim_to_maxlen(50, s)
                 progress.reporter = ProgressReporter(lvl=1, namefmt=maxlen)
+                status.progress = progress
             else:
                 progress = parent.progress.spawnchild(name)
             return Item(fs, db, parent, progress)
 
         log.d(_('recursive update for %s'), fullpath)
-        generator = self.enumerate_fs_with_db(fullpath, itemfactory=factory)
-        skipfirst and generator.send(None)
+        # directories changed this close to the scan might change again
+        # within the same mtime tick; don't trust their mtime next time
+        trusted_mtime = time.time() - 1
+        startpath = _scanpath(fullpath)
+        checkpoint = self.scan_checkpoint(startpath)
+        if checkpoint is None:
+            resume_after = None
+            partly_listed = ()
+            add, deld, started = 0, 0, time.time()
+        else:
+            resume_after, add, deld, started = checkpoint
+            log.i(_('resuming interrupted update of %r after %r'),
+                  startpath or fullpath, resume_after)
+            # the parents of the checkpoint are listed again, but their
+            # children before it are left out: if something was added there
+            # in the meantime, only the next full listing will find it
+            parts = resume_after.split('/')
+            partly_listed = set('/'.join(parts[:i]) for i in range(len(parts)))
+        open_dirs = []      # directories still being enumerated
+        done_dirs = []      # directories enumerated since the last commit
+        last_done = resume_after
+        last_commit = time.time()
+        tagreader = TagReader(cherry.config['media.tag_workers'])
+        self.scanbuffer = ScanBuffer(self.conn, tagreader)
+        scan_threads = cherry.config['media.scan_threads']
+        lister = DirectoryLister(scan_threads) if scan_threads > 1 else None
+        generator = self.enumerate_fs_with_db(fullpath, itemfactory=factory,
+                                              lister=lister,
+                                              resume_after=resume_after)
         adds_without_commit = 0
-        add = 0
-        deld = 0
         try:
-            with self.conn:
+            with self.transaction():
+                skipfirst and generator.send(None)
                 for item in generator:
+                    status.scanned += 1
+                    while open_dirs and open_dirs[-1] is not item.parent:
+                        done_dirs.append(open_dirs.pop())
                     infs, indb, progress = (item.infs, item.indb, item.progress)
+                    if infs and infs.isdir:
+                        open_dirs.append(item)
+                    elif infs:
+                        # even if its directory was not listed again,
+                        # a file may have been rewritten in place
+                        infs.readstat()
                     if infs and indb:
                         if infs.isdir != indb.isdir:
                             progress.name = '[±] ' + progress.name
-                            deld += self.remove_recursive(indb, progress)
+                            removed = self.remove_recursive(indb, progress)
+                            deld += removed
+                            status.removed += removed
                             self.register_file_with_db(infs)
+                            status.added += 1
                             adds_without_commit = 1
                         else:
                             infs.uid = indb.uid
+                            if not infs.isdir and infs.stat is not None \
+                                    and infs.stat != indb.stat:
+                                self.update_stat(infs)
+                                if _hastags(infs):
+                                    self.add_to_tags_table(infs)
                             progress.name = '[=] ' + progress.name
                     elif indb:
                         progress.name = '[-] ' + progress.name
-                        deld += self.remove_recursive(indb, progress)
+                        removed = self.remove_recursive(indb, progress)
+                        deld += removed
+                        status.removed += removed
                         adds_without_commit = 0
                         continue    # progress ticked by remove; don't tick again
                     elif infs:
                         self.register_file_with_db(item.infs)
+                        status.added += 1
                         adds_without_commit += 1
                         progress.name = '[+] ' + progress.name
                     else:
                         progress.name = '[?] ' + progress.name
-                    if adds_without_commit == AUTOSAVEINTERVAL:
-                        self.conn.commit()
+                    if adds_without_commit == AUTOSAVEINTERVAL or \
+                            time.time() - last_commit > CHECKPOINTINTERVAL:
+                        self.scanbuffer.flush()
                         add += adds_without_commit
                         adds_without_commit = 0
+                        if done_dirs:
+                            # only now are these listings known to be stored
+                            self.store_listed_stats(done_dirs, trusted_mtime,
+                                                    partly_listed)
+                            last_done = _scanpath(done_dirs[-1].infs.fullpath)
+                            done_dirs = []
+                        if last_done is not None:
+                            self.save_scan_checkpoint(startpath, last_done,
+                                                      add, deld, started)
+                        self.commit()
+                        last_commit = time.time()
                     progress.tick()
+                self.scanbuffer.finish()
+                done_dirs.extend(reversed(open_dirs))
+                self.store_listed_stats(done_dirs, trusted_mtime,
+                                        partly_listed)
+                with closing(self.conn.execute(
+                        'DELETE FROM scan_checkpoints WHERE startpath = ?',
+                        (startpath,))):
+                    pass
         except Exception as exc:
+            status.error = '%s: %s' % (exc.__class__.__name__, exc)
             log.e(_("error while updating media: %s %s"), exc.__class__.__name__, exc)
             log.e(_("rollback to previous commit."))
             traceback.print_exc()
+            if self.memory_index is not None:
+                # it may hold files that have just been rolled back
+                self.memory_index = self.setup_memory_index()
             raise exc
         finally:
+            if lister is not None:
+                lister.close()
+            tagreader.close()
+            self.scanbuffer = None
             add += adds_without_commit
             log.i(_('items added %d, removed %d'), add, deld)
             self.load_db_to_memory()
+            if self.memory_index is not None:
+                self.memory_index.log_footprint()
+            if self.typo_index is not None:
+                self.refresh_typo_index()
+            # the in-memory copies above are up to date only now
+            self.generation += 1
+            self.refresh_autocomplete()
+
+    def store_listed_stats(self, items, trusted_mtime, partly_listed=()):
+        '''store the stat of directories whose contents have been stored
+        completely, so they won't have to be listed again while unchanged.
+        Directories in `partly_listed`, as paths like :func:`_scanpath`,
+        keep the stat they had.'''
+        for item in items:
+            infs, indb = item.infs, item.indb
+            if infs.uid < 0 or infs.stat == (indb and indb.stat):
+                continue
+            if partly_listed and _scanpath(infs.fullpath) in partly_listed:
+                continue
+            if infs.mtime is not None and infs.mtime < trusted_mtime:
+                self.update_stat(infs)
 
-    def update_word_occurrences(self):
-        log.i(_('updating word occurrences...'))
-        with closing(self.conn.execute('''UPDATE dictionary SET occurrences = (
-                select count(*) from search WHERE search.drowid = dictionary.rowid
-            )''')):
+    def scan_checkpoint(self, startpath):
+        '''``(lastpath, added, removed, started)`` of an interrupted scan of
+        `startpath` (see :func:`_scanpath`), or None'''
+        with closing(self.conn.execute(
+                'SELECT lastpath, added, removed, started'
+                ' FROM scan_checkpoints WHERE startpath = ?',
+                (startpath,))) as cursor:
+            return cursor.fetchone()
+
+    def save_scan_checkpoint(self, startpath, lastpath, added, removed, started):
+        '''Remember that a scan of `startpath` has stored everything up to
+        and including the directory `lastpath`, in traversal order.'''
+        with closing(self.conn.execute(
+                'INSERT OR REPLACE INTO scan_checkpoints (startpath, lastpath,'
+                ' added, removed, started, updated) VALUES (?,?,?,?,?,?)',
+                (startpath, lastpath, added, removed, started, time.time()))):
+            pass
+
+    def update_stat(self, fileobj):
+        '''store the mtime, size and inode of a file object in the database'''
+        with closing(self.conn.execute(
+                'UPDATE files SET mtime=?, size=?, inode=? WHERE _id=?',
+                fileobj.stat + (fileobj.uid,))):
             pass
 
-    def enumerate_fs_with_db(self, startpath, itemfactory=None):
+    @_writer
+    def fill_missing_tags(self):
+        '''Read and store the tags of all audio files that have none stored,
+        e.g. because they were scanned before tags were kept in the database.
+        '''
+        filetypes = metainfo.TAG_FILETYPES
+        with closing(self.conn.execute(
+                'SELECT files._id, files.path FROM files'
+                ' LEFT JOIN tags ON tags.frowid = files._id'
+                ' WHERE files.isdir = 0 AND tags.frowid IS NULL'
+                ' AND files.path IS NOT NULL'
+                ' AND lower(files.filetype) IN (%s)'
+                % ', '.join('?' * len(filetypes)), filetypes)) as cursor:
+            missing = cursor.fetchall()
+        if not missing:
+            return
+        log.i(_('reading tags of %d files...'), len(missing))
+        basedir = cherry.config['media.basedir']
+        tagreader = TagReader(cherry.config['media.tag_workers'])
+        try:
+            for fileid, path in missing:
+                tagreader.add(fileid, os.path.join(basedir, *path.split('/')))
+            with self.transaction():
+                for rows in tagreader.remaining():
+                    _store_tags(self.conn, rows)
+                    self.commit()
+        finally:
+            tagreader.close()
+
+    @_writer
+    def update_word_occurrences(self):
+        '''Recount the occurrences of all words in the dictionary.
+
+        Counts are kept up to date as files are added and removed, so this is
+        only needed to repair them, e.g. after an update was interrupted.'''
+        log.i(_('updating word occurrences...'))
+        with self.transaction():
+            with closing(self.conn.execute('''UPDATE dictionary SET occurrences = (
+                    select count(*) from search WHERE search.drowid = dictionary.rowid
+                )''')):
+                pass
+
+    def enumerate_fs_with_db(self, startpath, itemfactory=None, lister=None,
+                             resume_after=None):
         '''
         Starting at `startpath`, enumerates path items containing representations
         for each path as it exists in the filesystem and the database,
@@ -606,6 +1546,21 @@ class SQLiteCache(object):
             itemfactory(infs, indb, parent [, optional arguments])
 
         and must return an object satisfying the above requirements for an item.
+
+        Directory contents are listed by the calling thread, unless a
+        :class:`DirectoryLister` is given as `lister`: then they will be listed
+        ahead of time by its worker threads.
+
+        Directories whose mtime still matches the one stored in the database
+        are not listed: their filesystem children are assumed to be the ones
+        in the database. Their subdirectories still get checked, since changes
+        further down do not touch the mtime of a parent directory.
+
+        To resume an interrupted enumeration, `resume_after` can name the
+        last directory that was completely taken care of, as a path relative
+        to basedir separated by '/'. Paths up to and including it, in
+        traversal order, are left out; only its parent directories are
+        returned again.
         '''
         from backport.collections import OrderedDict
         basedir = cherry.config['media.basedir']
@@ -631,6 +1586,12 @@ class SQLiteCache(object):
             assert False, _("shouldn't get here! (argument path not in basedir)")
 
         dbobj = self.db_find_file_by_path(startpath)
+        if resume_after is None:
+            pending = lambda fileobj: True
+        else:
+            resume_parts = resume_after.split('/')
+            pending = lambda fileobj: not _done_before(
+                fileobj.relpath.split(os.path.sep), resume_parts)
         stack = deque()
         stack.append(Item(fsobj, dbobj, None))
         while stack:
@@ -643,11 +1604,26 @@ class SQLiteCache(object):
                                    for f in self.fetch_child_files(item.indb)
                                    ))
             if item.infs and item.infs.isdir:
-                for fs_child in File.inputfilter(item.infs.children()):
+                known_mtime = item.indb.mtime if item.indb else None
+                if lister is None:
+                    fs_children = item.infs.listchildren(unless_mtime=known_mtime)
+                else:
+                    fs_children = lister.children(item.infs, known_mtime)
+                if fs_children is None:     # unchanged since last time
+                    fs_children = [File(db_child.basename, parent=item.infs,
+                                        isdir=db_child.isdir)
+                                   for db_child in reversed(dbchildren.values())]
+                for fs_child in fs_children:
                     db_child = dbchildren.pop(fs_child.basename, None)
+                    if not pending(fs_child):
+                        continue
                     stack.append(Item(fs_child, db_child, item))
+                    if lister is not None and fs_child.isdir:
+                        lister.prefetch(fs_child,
+                                        db_child.mtime if db_child else None)
             for db_child in dbchildren.values():
-                stack.append(Item(None, db_child, item))
+                if pending(db_child):
+                    stack.append(Item(None, db_child, item))
             del dbchildren
 
 
@@ -671,14 +1647,22 @@ class SQLiteCache(object):
         if not relpath:
             return root
 
-        file = root
-        for part in relpath.split(os.path.sep):
+        parts = relpath.split(os.path.sep)
+        file, depth = self._find_by_stored_path(root, parts)
+        if depth == len(parts):
+            return file
+        # only files without stored path can hide from the lookup by path
+        with closing(self.reader().execute(
+                'SELECT EXISTS (SELECT * FROM files WHERE path IS NULL)')) as cursor:
+            walk = cursor.fetchone()[0]
+        for part in parts[depth:]:
             found = False
-            for child in self.fetch_child_files(file):  # gotta be ugly: don't know if name/ext split in db
-                if part == child.basename:
-                    found = True
-                    file = child
-                    break
+            if walk:
+                for child in self.fetch_child_files(file):  # gotta be ugly: don't know if name/ext split in db
+                    if part == child.basename:
+                        found = True
+                        file = child
+                        break
             if not found:
                 if create:
                     file = File(part, parent=file)
@@ -688,6 +1672,26 @@ class SQLiteCache(object):
                     return None
         return file
 
+    def _find_by_stored_path(self, root, parts):
+        '''Look up a path and all its parents at once, by the path stored
+        with each record. Returns the File object for the deepest path found
+        and its number of path components.'''
+        paths = ['/'.join(parts[:i + 1]) for i in range(len(parts))]
+        with closing(self.reader().execute(
+                'SELECT path, _id, filename, filetype, isdir, mtime, size, inode'
+                ' FROM files WHERE path IN ({0})'.format(', '.join('?' * len(paths))),
+                paths)) as cursor:
+            rows = dict((row[0], row[1:]) for row in cursor.fetchall())
+        file = root
+        for depth, path in enumerate(paths):
+            try:
+                uid, name, ext, isdir, mtime, size, inode = rows[path]
+            except KeyError:
+                return file, depth
+            file = File(name + ext, parent=file, isdir=bool(isdir), uid=uid,
+                        stat=(mtime, size, inode))
+        return file, len(paths)
+
 
 if sys.version_info < (3,):
     from codecs import decode
@@ -704,9 +1708,70 @@ if sys.version_info < (3,):
 else:
     _unicode_listdir = os.listdir
 
+_scandir = getattr(os, 'scandir', None)
+
+
+def _storedstat(fileobj):
+    '''The (mtime, size, inode) to store with a new file record. Directories
+    start out without: their mtime only gets stored once the scan has seen
+    all of their contents.'''
+    stat = getattr(fileobj, 'stat', None)
+    if fileobj.isdir or stat is None:
+        return (None, None, None)
+    return stat
+
+
+def _storedpath(fileobj):
+    '''The path to store with a new file record: relative to basedir and
+    separated by '/', regardless of OS.'''
+    relpath = getattr(fileobj, 'relpath', None)
+    if not relpath:
+        return None
+    return relpath.replace(os.path.sep, '/')
+
+
+def _hastags(fileobj):
+    '''True if tags should be read from a file'''
+    return not fileobj.isdir and fileobj.ext.lower() in metainfo.TAG_FILETYPES
+
+
+def _store_tags(conn, rows):
+    '''store rows from :func:`~cherrymusicserver.metainfo.readTags`, replacing
+    the tags stored before. Files whose tags can't be read get an empty row,
+    so they are not read again until they change.'''
+    if not rows:
+        return
+    with closing(conn.executemany(
+            'INSERT OR REPLACE INTO tags'
+            ' (frowid, artist, album, title, track, duration)'
+            ' VALUES (?,?,?,?,?,?)', rows)):
+        pass
+
+
+def _log_tag_errors(errors):
+    for path, error in errors:
+        log.w(_('cannot read tags of %r: %s'), path, error)
+
+
+def _scanpath(fullpath):
+    '''A path in basedir as stored with scan checkpoints: relative to basedir,
+    separated by '/', and empty for basedir itself.'''
+    basedir = cherry.config['media.basedir']
+    relpath = os.path.normpath(fullpath)[len(basedir):].strip(os.path.sep)
+    return relpath.replace(os.path.sep, '/')
+
+
+def _done_before(parts, resume_parts):
+    '''True if the path with components `parts` comes before the one with
+    `resume_parts` in scan order, or is the same, but is not one of its
+    parent directories'''
+    if parts == resume_parts:
+        return True
+    return parts < resume_parts and parts != resume_parts[:len(parts)]
+
 
 class File():
-    def __init__(self, path, parent=None, isdir=None, uid= -1):
+    def __init__(self, path, parent=None, isdir=None, uid= -1, stat=None):
         assert isinstance(path, type('')), _('expecting unicode path, got %s') % type(path)
 
         if len(path) > 1:
@@ -726,6 +1791,10 @@ class File():
             self.isdir = os.path.isdir(os.path.abspath(self.fullpath))
         else:
             self.isdir = isdir
+        if stat is None or stat[0] is None:
+            self.stat = None
+        else:
+            self.stat = tuple(stat)
 
     def __str__(self):
         return self.fullpath
@@ -778,6 +1847,23 @@ class File():
             ext = os.path.splitext(self.basename)[1]
         return ext
 
+    @property
+    def mtime(self):
+        '''modification time as of the last :meth:`readstat`, or None'''
+        return self.stat[0] if self.stat else None
+
+    def readstat(self):
+        '''Set :attr:`stat` to ``(mtime, size, inode)`` as currently found in
+        the filesystem, or to None if the file cannot be stat'ed.'''
+        try:
+            st = os.stat(self.fullpath)
+        except OSError as error:
+            log.e(_('cannot stat file: %s'), error)
+            self.stat = None
+        else:
+            self.stat = (st.st_mtime, st.st_size, st.st_ino)
+        return self.stat
+
     @property
     def exists(self):
         '''True if this file's fullpath exists in the filesystem'''
@@ -803,6 +1889,45 @@ class File():
             return ()
 
 
+    def listchildren(self, sort=True, reverse=True, unless_mtime=None):
+        '''Return a list of the fileobjects that :meth:`children` would
+        produce and :meth:`inputfilter` would let pass.
+
+        Uses ``os.scandir`` where available, which tells directories and
+        links apart without a separate stat call per child; only links will
+        need closer inspection.
+
+        The directory itself gets stat'ed before it is listed. If its mtime
+        then equals `unless_mtime`, it is considered unchanged and None is
+        returned instead of a list.
+        '''
+        self.readstat()
+        if unless_mtime is not None and self.mtime == unless_mtime:
+            return None
+        if _scandir is None:
+            return list(File.inputfilter(self.children(sort, reverse)))
+        try:
+            entries = list(_scandir(self.fullpath))
+        except OSError as error:
+            log.e(_('cannot list directory: %s'), error)
+            return []
+        if sort:
+            entries.sort(key=lambda entry: entry.name, reverse=reverse)
+        children = []
+        for entry in entries:
+            try:
+                islink = entry.is_symlink()
+                isdir = entry.is_dir()
+            except OSError:
+                islink, isdir = True, False
+            fileobj = File(entry.name, parent=self, isdir=isdir)
+            if islink:
+                # check links the long way: they might be dangling or cyclic
+                children.extend(File.inputfilter((fileobj,)))
+            else:
+                children.append(fileobj)
+        return children
+
     @classmethod
     def inputfilter(cls, files_iter):
         basedir = cherry.config['media.basedir']
@@ -831,9 +1956,323 @@ class File():
                     continue
             yield f
 
+class DirectoryLister(object):
+    '''Lists directories ahead of time on a pool of worker threads, so a
+    library scan does not have to wait for the filesystem one directory at a
+    time.
+
+    Directories are handed to :meth:`prefetch` as the scan discovers them and
+    collected with :meth:`children` when the scan gets there. Workers take the
+    most recently discovered directory first, which matches the depth-first
+    order of the scan; a directory that no worker has picked up yet is listed
+    by the calling thread instead of waiting in line.
+    '''
+    def __init__(self, threads):
+        assert threads > 0
+        self.queue = LifoQueue()
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.workers = []
+        for i in range(threads):
+            worker = threading.Thread(name='DirectoryLister-%d' % i,
+                                      target=self._work)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def prefetch(self, fileobj, unless_mtime=None):
+        job = _ListingJob(fileobj, unless_mtime)
+        with self.lock:
+            self.jobs[fileobj] = job
+        self.queue.put(job)
+
+    def children(self, fileobj, unless_mtime=None):
+        '''The result of ``fileobj.listchildren(unless_mtime=unless_mtime)``'''
+        with self.lock:
+            job = self.jobs.pop(fileobj, None)
+        if job is None:
+            return fileobj.listchildren(unless_mtime=unless_mtime)
+        return job.result()
+
+    def close(self):
+        '''Stop all workers; unclaimed listings are dropped.'''
+        with self.lock:
+            self.jobs.clear()
+        for worker in self.workers:
+            self.queue.put(None)    # LIFO: stop signals come out first
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            job.run()
+
+
+class _ListingJob(object):
+    def __init__(self, fileobj, unless_mtime):
+        self.fileobj = fileobj
+        self.unless_mtime = unless_mtime
+        self.claimed = False
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.children = None
+        self.error = None
+
+    def run(self):
+        '''List the directory, unless someone else already does it'''
+        with self.lock:
+            if self.claimed:
+                return
+            self.claimed = True
+        try:
+            self.children = self.fileobj.listchildren(
+                unless_mtime=self.unless_mtime)
+        except Exception as error:
+            self.error = error
+        finally:
+            self.done.set()
+
+    def result(self):
+        self.run()
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.children
+
+
+def _count_occurrences(conn, word_ids, sign=1):
+    '''add (or, with sign=-1, subtract) one to the occurrences of a word
+    for every time its id appears in word_ids'''
+    counts = Counter(word_ids)
+    if not counts:
+        return
+    with closing(conn.executemany(
+            'UPDATE dictionary SET occurrences = occurrences + ? WHERE _id=?',
+            ((sign * count, wid) for wid, count in counts.items()))):
+        pass
+
+
+class ScanBuffer(object):
+    '''Collects new rows for the files, dictionary and search tables while a
+    library scan is running, and writes them with one ``executemany`` per
+    table on :meth:`flush`.
+
+    Rows for the FTS5 and substring search indexes are collected alongside,
+    if they are in use. Tags of new and changed audio files are read by a
+    :class:`TagReader` and written as they come in.
+
+    Record ids are handed out in advance, so children can reference their
+    parents before anything has reached the database. Words are looked up in
+    the database at most once per scan and then kept in a word -> rowid map.
+    '''
+    def __init__(self, conn, tagreader=None):
+        self.conn = conn
+        self.tagreader = tagreader if tagreader is not None else TagReader(1)
+        self.words = {}
+        self.files = []
+        self.newwords = []
+        self.search = []
+        self.fts = []
+        self.trigrams = []
+        self.next_file_id = self._next_id('files')
+        self.next_word_id = self._next_id('dictionary')
+
+    def _next_id(self, table):
+        with closing(self.conn.execute(
+                'SELECT MAX(_id) FROM ' + table)) as cursor:
+            maxid = cursor.fetchone()[0] or 0
+        with closing(self.conn.execute(
+                'SELECT seq FROM sqlite_sequence WHERE name=?', (table,))) as cursor:
+            seq = cursor.fetchone()
+        return max(maxid, seq[0] if seq else 0) + 1
+
+    def add_file(self, fileobj):
+        row = (fileobj.parent.uid if fileobj.parent else -1,
+               fileobj.name, fileobj.ext, 1 if fileobj.isdir else 0
+               ) + _storedstat(fileobj) + (_storedpath(fileobj),)
+        # catch bad encodings now, or they would spoil the whole batch later
+        (fileobj.name + fileobj.ext).encode('utf-8')
+        fileobj.uid = self.next_file_id
+        self.next_file_id += 1
+        self.files.append((fileobj.uid,) + row)
+        return fileobj
+
+    def word_id(self, word):
+        try:
+            return self.words[word]
+        except KeyError:
+            pass
+        with closing(self.conn.execute(
+                'SELECT rowid FROM dictionary WHERE word = ? LIMIT 0,1',
+                (word,))) as cursor:
+            wordrowid = cursor.fetchone()
+        if wordrowid is None:
+            wordrowid = self.next_word_id
+            self.next_word_id += 1
+            self.newwords.append((wordrowid, word))
+        else:
+            wordrowid = wordrowid[0]
+        self.words[word] = wordrowid
+        return wordrowid
+
+    def add_search(self, file_id, word_id_seq):
+        self.search.extend((wid, file_id) for wid in word_id_seq)
+
+    def add_fts(self, file_id, words):
+        self.fts.append((file_id, words))
+
+    def add_trigrams(self, rows):
+        self.trigrams.extend(rows)
+
+    def read_tags(self, file_id, fullpath):
+        self.tagreader.add(file_id, fullpath)
+
+    def forget_words(self):
+        '''Drop the word map, e.g. because orphaned words have been deleted'''
+        self.words.clear()
+
+    def flush(self):
+        '''Write all collected rows to the database'''
+        if self.files:
+            with closing(self.conn.executemany(
+                    'INSERT INTO files (_id, parent, filename, filetype, isdir,'
+                    ' mtime, size, inode, path) VALUES (?,?,?,?,?,?,?,?,?)',
+                    self.files)):
+                pass
+            self.files = []
+        if self.newwords:
+            with closing(self.conn.executemany(
+                    'INSERT INTO dictionary (_id, word, occurrences)'
+                    ' VALUES (?,?,0)',
+                    self.newwords)):
+                pass
+            self.newwords = []
+        if self.search:
+            with closing(self.conn.executemany(
+                    'INSERT INTO search (drowid, frowid) VALUES (?,?)',
+                    self.search)):
+                pass
+            _count_occurrences(self.conn, (row[0] for row in self.search))
+            self.search = []
+        if self.fts:
+            with closing(self.conn.executemany(
+                    'INSERT INTO search_fts (rowid, words) VALUES (?,?)',
+                    self.fts)):
+                pass
+            self.fts = []
+        if self.trigrams:
+            with closing(self.conn.executemany(
+                    'INSERT INTO trigrams (trigram, frowid) VALUES (?,?)',
+                    self.trigrams)):
+                pass
+            self.trigrams = []
+        for rows in self.tagreader.finished():
+            _store_tags(self.conn, rows)
+
+    def finish(self):
+        '''Write all collected rows, including the tags that are still being
+        read'''
+        self.flush()
+        for rows in self.tagreader.remaining():
+            _store_tags(self.conn, rows)
+
+
+class TagReader(object):
+    '''Reads the tags of audio files for a library scan.
+
+    With more than one worker, files are handed to a pool of processes in
+    chunks of :data:`TAG_CHUNK_SIZE`, since parsing tags is pure Python and
+    would not run in parallel on threads. Otherwise, tags are read by the
+    calling thread when their rows are collected. Rows come back in the order
+    their files were added.
+
+    A file whose tags can't be read still gets an empty row; a failing worker
+    process only costs its chunk, which is then read in-process.
+    '''
+    def __init__(self, workers):
+        self.pool = None
+        if workers > 1:
+            if ProcessPoolExecutor is None:
+                log.w(_('cannot read tags in parallel: concurrent.futures is'
+                        ' not available. Reading them one by one instead.'))
+            else:
+                self.pool = ProcessPoolExecutor(workers)
+        self.files = []
+        self.jobs = deque()
+
+    def add(self, fileid, fullpath):
+        self.files.append((fileid, fullpath))
+        if len(self.files) >= TAG_CHUNK_SIZE:
+            self._submit()
+
+    def _submit(self):
+        if not self.files:
+            return
+        chunk, self.files = self.files, []
+        future = None
+        if self.pool is not None:
+            future = self.pool.submit(metainfo.readTags, chunk)
+        self.jobs.append((chunk, future))
+
+    def finished(self):
+        '''generator: row lists of the chunks that are done, without waiting
+        for the others'''
+        if self.pool is None:
+            self._submit()
+        while self.jobs:
+            future = self.jobs[0][1]
+            if future is not None and not future.done():
+                return
+            yield self._rows(*self.jobs.popleft())
+
+    def remaining(self):
+        '''generator: row lists of all chunks, waiting for each'''
+        self._submit()
+        while self.jobs:
+            yield self._rows(*self.jobs.popleft())
+
+    def _rows(self, chunk, future):
+        if future is None:
+            rows, errors = metainfo.readTags(chunk)
+        else:
+            try:
+                rows, errors = future.result()
+            except Exception as error:
+                log.e(_('tag reader process failed (%s %s); reading its %d'
+                        ' files here instead.'),
+                      error.__class__.__name__, error, len(chunk))
+                rows, errors = metainfo.readTags(chunk)
+        _log_tag_errors(errors)
+        return rows
+
+    def close(self):
+        '''Stop the worker processes; unclaimed rows are dropped.'''
+        for chunk, future in self.jobs:
+            if future is not None:
+                future.cancel()
+        self.jobs.clear()
+        self.files = []
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+
 class MemoryDB:
+    """ A copy of a table in an in-memory database.
+
+        After the first full copy, :meth:`refresh` only copies the rows that
+        are new or have changed. Queries go through :meth:`query`, which
+        waits for a running refresh, so they never see a half-copied table.
+    """
     def __init__(self, db_file, table_to_dump):
         log.i(_("Loading files database into memory..."))
+        self.db_file = db_file
+        self.table = table_to_dump
+        self.lock = threading.Lock()
         self.db = sqlite3.connect(':memory:', check_same_thread=False)
         cu = self.db.cursor()
         cu.execute('attach database "%s" as attached_db' % db_file)
@@ -845,5 +2284,39 @@ class MemoryDB:
                    " select * from attached_db." + table_to_dump)
         self.db.commit()
         cu.execute("detach database attached_db")
-
-
+        self.lastid = self._maxid()
+
+    def _maxid(self):
+        with closing(self.db.execute(
+                'SELECT MAX(_id) FROM ' + self.table)) as cursor:
+            return cursor.fetchone()[0] or 0
+
+    def query(self, sql, params=()):
+        with self.lock:
+            with closing(self.db.execute(sql, params)) as cursor:
+                return cursor.fetchall()
+
+    def refresh(self, changed_ids):
+        """ Bring the copy up to date with the rows that were added to the
+            table since the last copy and the rows with the given ids, which
+            may have been updated or deleted. Row ids must never be reused
+            without being passed in here. """
+        with self.lock:
+            cu = self.db.cursor()
+            cu.execute('attach database "%s" as attached_db' % self.db_file)
+            try:
+                with self.db:
+                    cu.execute('CREATE TEMP TABLE IF NOT EXISTS changed'
+                               ' (_id INTEGER PRIMARY KEY NOT NULL)')
+                    cu.execute('DELETE FROM changed')
+                    cu.executemany('INSERT OR IGNORE INTO changed VALUES (?)',
+                                   ((rowid,) for rowid in changed_ids))
+                    cu.execute('DELETE FROM main.' + self.table +
+                               ' WHERE _id IN (SELECT _id FROM changed)')
+                    cu.execute('INSERT INTO main.' + self.table +
+                               ' SELECT * FROM attached_db.' + self.table +
+                               ' WHERE _id > ? OR _id IN (SELECT _id FROM changed)',
+                               (self.lastid,))
+                self.lastid = self._maxid()
+            finally:
+                cu.execute("detach database attached_db")
@@ -74,13 +74,62 @@ def test_listdir_in_filesystem_must_be_inside_basedir():
 def test_hidden_names_search(cherrypy, cache):
     model = cherrymodel.CherryModel()
 
+    cache.library_generation.return_value = 1
     cache.searchfor.return_value = [cherrymodel.MusicEntry('.hidden.mp3', dir=False)]
     assert not model.search('something')
 
+    cache.library_generation.return_value = 2
     cache.searchfor.return_value = [cherrymodel.MusicEntry('not_hidden.mp3', dir=False)]
     assert model.search('something')
 
 
+@cherrytest(config({'search.cache_size': 10}))
+@patch('cherrymusicserver.cherrymodel.CherryModel.cache')
+@patch('cherrymusicserver.cherrymodel.cherrypy')
+def test_search_results_are_cached_until_library_changes(cherrypy, cache):
+    model = cherrymodel.CherryModel()
+    cache.library_generation.return_value = 1
+    cache.searchfor.return_value = [cherrymodel.MusicEntry('not_hidden.mp3', dir=False)]
+
+    first = model.search('Some  Thing')
+    eq_(first, model.search('some thing'))
+    eq_(1, cache.searchfor.call_count)
+    eq_((1, 1), (model.search_results.hits, model.search_results.misses))
+
+    cache.library_generation.return_value = 2
+    model.search('some thing')
+    eq_(2, cache.searchfor.call_count)
+
+
+@cherrytest(config({'search.cache_size': 0, 'search.maxresults': 3}))
+@patch('cherrymusicserver.cherrymodel.CherryModel.cache')
+@patch('cherrymusicserver.cherrymodel.cherrypy')
+def test_search_pages_come_from_the_same_results(cherrypy, cache):
+    model = cherrymodel.CherryModel()
+    cache.library_generation.return_value = 1
+    found = [cherrymodel.MusicEntry(name) for name in
+             ('not_hidden.mp3', 'gone.mp3', 'a.mp3', 'b.mp3', 'c.mp3', 'd.mp3')]
+    cache.searchfor.side_effect = lambda term, maxresults: found[:maxresults]
+    paths = lambda entries: sorted(entry.path for entry in entries)
+
+    cursor, total, first = model.search_page('mp3', 0, 2)
+    eq_((2, ['not_hidden.mp3']), (total, paths(first)),
+        'missing files are left out of the page')
+    ranked = paths(model.search_cursors.get(cursor)[1])
+
+    cache.library_generation.return_value = 2
+    found.reverse()
+    cursor, total, rest = model.search_page('mp3', 2, None, cursor)
+    eq_((5, []), (total, paths(rest)), 'ranked up to one page further')
+    eq_(5, cache.searchfor.call_args[1]['maxresults'])
+    eq_(ranked, paths(model.search_cursors.get(cursor)[1][:2]),
+        'earlier pages unchanged')
+
+    model.search_page('mp3', 0, 2, cursor)
+    eq_(2, cache.searchfor.call_count)
+    ok_(cursor != model.search_page('mp3', 0, 2, 'expired')[0])
+
+
 @cherrytest(config({'browser.pure_database_lookup': True}))
 @patch('cherrymusicserver.cherrymodel.CherryModel.cache')
 def test_listdir_deleted_files(cache):
@@ -123,18 +172,35 @@ def test_listdir_unreadable():
 def test_randomMusicEntries():
     model = cherrymodel.CherryModel()
 
-    def makeMusicEntries(n):
+    def makeMusicEntries(n, formats):
         return [cherrymodel.MusicEntry(str(i)) for i in range(n)]
 
     with patch('cherrymusicserver.cherrymodel.CherryModel.cache') as mock_cache:
         with patch('cherrymusicserver.cherrymodel.CherryModel.isplayable') as mock_playable:
             mock_cache.randomFileEntries.side_effect = makeMusicEntries
 
-            mock_playable.return_value = True
             eq_(2, len(model.randomMusicEntries(2)))
+            mock_cache.randomFileEntries.assert_called_with(
+                2, cherrymodel.CherryModel.supportedFormats)
+            ok_(not mock_playable.called, 'files must not be checked')
+
 
-            mock_playable.return_value = False
-            eq_(0, len(model.randomMusicEntries(2)))
+@cherrytest(config())
+def test_songInfo_reads_file_only_without_stored_tags():
+    import cherrymusicserver as cherry
+    model = cherrymodel.CherryModel()
+    stored = cherrymodel.metainfo.Metainfo(title='stored')
+
+    with patch('cherrymusicserver.cherrymodel.CherryModel.cache') as mock_cache:
+        with patch('cherrymusicserver.metainfo.getSongInfo') as mock_read:
+            mock_cache.songinfo.return_value = {'a.mp3': stored}
+            eq_(stored, model.songInfo('a.mp3'))
+            ok_(not mock_read.called)
+
+            mock_cache.songinfo.return_value = {}
+            eq_(mock_read.return_value, model.songInfo('b.mp3'))
+            mock_read.assert_called_with(
+                os.path.join(cherry.config['media.basedir'], 'b.mp3'))
 
 
 @cherrytest({'media.transcode': False})
@@ -44,6 +44,8 @@ cherry.config = configuration.from_defaults()
 from cherrymusicserver import httphandler
 from cherrymusicserver import service
 from cherrymusicserver.cherrymodel import CherryModel, MusicEntry
+from cherrymusicserver.metainfo import Metainfo
+from cherrymusicserver.updatejobs import UpdateJob
 
 
 class MockAction(Exception):
@@ -57,10 +59,24 @@ class MockModel:
             return [MusicEntry('fast mock result','fast mock result')]
         else:
             return [MusicEntry('mock result','mock result')]
+    def search_page(self, term, offset=0, limit=None, cursor=None):
+        results = [MusicEntry('mock result %d' % i) for i in range(5)]
+        end = len(results) if limit is None else offset + limit
+        return cursor or 'new cursor', len(results), results[offset:end]
+    def count_subfolders(self, entries):
+        pass
     def motd(self):
         return "motd"
-    def updateLibrary(self):
-        raise MockAction('updateLibrary')
+    def autocomplete(self, text, count):
+        return {'words': [text] * count, 'directories': []}
+    def songInfo(self, path):
+        return Metainfo(artist='mock artist', title=path)
+    def updateLibrary(self, paths=()):
+        job = UpdateJob(paths)
+        self.updatejobs = {job.id: job}
+        return job
+    def updateStatus(self, jobid):
+        return getattr(self, 'updatejobs', {}).get(jobid)
 service.provide('cherrymodel', MockModel)
 
 
@@ -106,11 +122,44 @@ class TestHTTPHandler(unittest.TestCase):
         session is used to authenticate the http request."""
         self.assertRaises(AttributeError, self.http.api, 'search')
 
+    def test_api_search_pages(self):
+        page = json.loads(self.call_api('search', searchstring='mock',
+                                        offset=1, limit=2))['data']
+        self.assertEqual('new cursor', page['cursor'])
+        self.assertEqual(5, page['total'])
+        self.assertEqual(['mock result 1', 'mock result 2'],
+                         [entry['path'] for entry in page['results']])
+
+        page = json.loads(self.call_api('search', searchstring='mock',
+                                        offset=4, cursor='old cursor'))['data']
+        self.assertEqual('old cursor', page['cursor'])
+        self.assertEqual(['mock result 4'],
+                         [entry['path'] for entry in page['results']])
+
+        self.assertRaises(httphandler.cherrypy.HTTPError, self.call_api,
+                          'search', searchstring='mock', offset=-1)
+
+    def test_api_streamsearch(self):
+        with patch('cherrymusicserver.httphandler._save_and_release_session'):
+            chunks = list(self.call_api('streamsearch', searchstring='mock',
+                                        limit=2))
+        page = json.loads(b''.join(chunks).decode('utf-8'))['data']
+        self.assertEqual(5, page['total'])
+        self.assertEqual(['mock result 0', 'mock result 1'],
+                         [entry['path'] for entry in page['results']])
+
     def test_api_fastsearch(self):
         """when attribute error is raised, this means that cherrypy
         session is used to authenticate the http request."""
         self.assertRaises(AttributeError, self.http.api, 'search')
 
+    def test_api_autocomplete(self):
+        completions = json.loads(self.call_api('autocomplete', prefix='be',
+                                               count=2))['data']
+        self.assertEqual(['be', 'be'], completions['words'])
+        self.assertRaises(httphandler.cherrypy.HTTPError, self.call_api,
+                          'autocomplete', prefix='be', count='many')
+
     def test_api_rememberplaylist(self):
         """when attribute error is raised, this means that cherrypy
         session is used to authenticate the http request."""
@@ -220,6 +269,12 @@ class TestHTTPHandler(unittest.TestCase):
         session is used to authenticate the http request."""
         self.assertRaises(AttributeError, self.http.api, 'getsonginfo')
 
+    def test_api_getsonginfo_comes_from_model(self):
+        info = json.loads(json.loads(self.call_api(
+            'getsonginfo', path='a/b.mp3'))['data'])
+        self.assertEqual('mock artist', info['artist'])
+        self.assertEqual('a/b.mp3', info['title'])
+
     def test_api_getencoders(self):
         """when attribute error is raised, this means that cherrypy
         session is used to authenticate the http request."""
@@ -240,6 +295,43 @@ class TestHTTPHandler(unittest.TestCase):
         session is used to authenticate the http request."""
         self.assertRaises(AttributeError, self.http.api, 'updatedb')
 
+    def test_api_updatedb_starts_job(self):
+        job = json.loads(self.call_api('updatedb', paths=['a', 'b/c']))['data']
+        self.assertEqual(['a', 'b/c'], job['paths'])
+        self.assertEqual('queued', job['state'])
+        self.assertRaises(httphandler.cherrypy.HTTPError, self.call_api,
+                          'updatedb', paths=['../outside'])
+        self.assertRaises(httphandler.cherrypy.HTTPError, self.call_api,
+                          'updatedb', paths='rock/album')
+        self.assertRaises(httphandler.cherrypy.HTTPError, self.call_api,
+                          'updatedb', paths=[['a']])
+
+    def test_api_updatestatus(self):
+        job = json.loads(self.call_api('updatedb'))['data']
+        status = json.loads(self.call_api('updatestatus', jobid=job['id']))['data']
+        self.assertEqual(job, status)
+        self.assertRaises(httphandler.cherrypy.HTTPError, self.call_api,
+                          'updatestatus', jobid='unknown')
+
+    def test_api_gettweaks(self):
+        session = {'admin': False}
+        with patch('cherrypy.session', session, create=True):
+            self.assertRaises(httphandler.cherrypy.HTTPError,
+                              self.call_api, 'gettweaks')
+            session['admin'] = True
+            tweaks = json.loads(self.call_api('gettweaks'))['data']
+        self.assertEqual(cherry.tweak.SearchTweaks.normal_file_search_limit,
+                         tweaks['SearchTweaks']['normal_file_search_limit'])
+
+    def test_api_reloadtweaks(self):
+        session = {'admin': True}
+        with patch('cherrypy.session', session, create=True):
+            with patch.object(cherry.tweaks, 'reload') as reload:
+                reload.return_value = cherry.tweak
+                tweaks = json.loads(self.call_api('reloadtweaks'))['data']
+        reload.assert_called_once_with()
+        self.assertIn('ResultOrderTweaks', tweaks)
+
     def test_api_compactlistdir(self):
         """when attribute error is raised, this means that cherrypy
         session is used to authenticate the http request."""
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# CherryMusic - a standalone music server
+# Copyright (c) 2012 - 2016 Tom Wallroth & Tilman Boerner
+#
+# Project page:
+#   http://fomori.org/cherrymusic/
+# Sources on github:
+#   http://github.com/devsnd/cherrymusic/
+#
+# CherryMusic is based on
+#   jPlayer (GPL/MIT license) http://www.jplayer.org/
+#   CherryPy (BSD license) http://www.cherrypy.org/
+#
+# licensed under GNU GPL version 3 (or later)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+#
+
+#python 2.6+ backward compability
+from __future__ import unicode_literals
+
+import nose
+
+from mock import *
+from nose.tools import *
+
+import os
+import time
+
+from cherrymusicserver import log
+log.setTest()
+
+from cherrymusicserver import mediawatcher
+from cherrymusicserver.test.helpers import cherryconfig, tempdir, mkpath
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def watcher_for(basedir, **kwargs):
+    watcher = mediawatcher.MediaWatcher(debounce=0.05, **kwargs)
+    watcher.cache = Mock()
+    watcher.updates = Mock()
+    watcher.basedir = basedir
+    return watcher
+
+
+def test_collapse_paths_drops_paths_inside_other_paths():
+    eq_([os.path.join('m', 'a'), os.path.join('m', 'a b'), os.path.join('m', 'z')],
+        mediawatcher.collapse_paths([
+            os.path.join('m', 'a', 'x', 'y'),
+            os.path.join('m', 'a b'),
+            os.path.join('m', 'a'),
+            os.path.join('m', 'a', 'x'),
+            os.path.join('m', 'z'),
+        ]))
+
+
+def test_changes_are_debounced_into_one_update_job():
+    with tempdir('test_mediawatcher') as basedir:
+        watcher = watcher_for(basedir, poll_interval=3600, use_inotify=False)
+        with cherryconfig({'media.basedir': basedir}):
+            watcher.start()
+        try:
+            album = os.path.join(basedir, 'album')
+            watcher.notify(album)
+            watcher.notify(os.path.join(album, 'track'))
+            watcher.notify(os.path.join(basedir, 'other'))
+
+            ok_(wait_for(lambda: watcher.updates.start.called))
+        finally:
+            watcher.stop()
+
+        eq_(1, watcher.updates.start.call_count)
+        (paths,), _kwargs = watcher.updates.start.call_args
+        eq_(['album', 'other'], list(paths))
+        ok_(not watcher.cache.partial_update.called)
+
+
+def test_changed_basedir_starts_full_update_job():
+    with tempdir('test_mediawatcher') as basedir:
+        watcher = watcher_for(basedir, poll_interval=3600, use_inotify=False)
+        with cherryconfig({'media.basedir': basedir}):
+            watcher.start()
+        try:
+            watcher.notify(os.path.join(basedir, 'album'))
+            watcher.notify(basedir)
+
+            ok_(wait_for(lambda: watcher.updates.start.called))
+        finally:
+            watcher.stop()
+        watcher.updates.start.assert_called_once_with()
+
+
+def test_polling_reports_changed_directories():
+    with tempdir('test_mediawatcher') as basedir:
+        gone = mkpath('gone/', basedir)
+        kept = mkpath('kept/', basedir)
+        past = time.time() - 3600
+        for path in (basedir, gone, kept):
+            os.utime(path, (past, past))
+        notified = []
+        poller = mediawatcher._PollingBackend(basedir, notified.append, 3600)
+        poller.check()
+        eq_([], notified)
+
+        os.rmdir(gone)
+        new = mkpath('new/', basedir)
+        poller.check()
+
+        eq_(sorted([basedir, gone, new]), sorted(notified))
+
+
+def test_inotify_reports_new_files_and_folders():
+    if not mediawatcher.INOTIFY_AVAILABLE:
+        return
+    with tempdir('test_mediawatcher') as basedir:
+        watcher = watcher_for(basedir)
+        with cherryconfig({'media.basedir': basedir}):
+            watcher.start()
+        try:
+            ok_(watcher.backend.ready.wait(5))
+            album = mkpath('album/', basedir)
+            time.sleep(0.01)    # give the new watch a chance to see the track
+            mkpath('track.mp3', album)
+
+            ok_(wait_for(lambda: watcher.updates.start.called))
+        finally:
+            watcher.stop()
+        (paths,), _kwargs = watcher.updates.start.call_args
+        eq_(['album'], list(paths))
+
+
+if __name__ == '__main__':
+    nose.runmodule()
@@ -39,6 +39,7 @@ log.setTest()
 
 from cherrymusicserver import database
 from cherrymusicserver import service
+from cherrymusicserver.metainfo import Metainfo
 
 from cherrymusicserver.playlistdb import *
 
@@ -87,5 +88,21 @@ def test_set_public():
     assert not get_playlist('some_title')['public']
 
 
+def test_pls_has_lengths_of_tracks_with_stored_tags():
+    cache = Mock()
+    cache.songinfo.return_value = {'url(a)': Metainfo(length=61.6)}
+    service.provide('filecache', cache)
+    try:
+        pl = create_playlist('with_lengths', ['a', 'b'])
+
+        pls = PlaylistDB().createPLS(_DEFAULT_USERID, pl['plid'], 'host')
+    finally:
+        service.provide('filecache', None)
+
+    cache.songinfo.assert_called_once_with(['url(a)', 'url(b)'])
+    assert 'Length1=62' in pls
+    assert 'Length2=-1' in pls
+
+
 if __name__ == '__main__':
     nose.runmodule()
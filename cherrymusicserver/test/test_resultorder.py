@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# CherryMusic - a standalone music server
+# Copyright (c) 2012 - 2016 Tom Wallroth & Tilman Boerner
+#
+# Project page:
+#   http://fomori.org/cherrymusic/
+# Sources on github:
+#   http://github.com/devsnd/cherrymusic/
+#
+# CherryMusic is based on
+#   jPlayer (GPL/MIT license) http://www.jplayer.org/
+#   CherryPy (BSD license) http://www.cherrypy.org/
+#
+# licensed under GNU GPL version 3 (or later)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+#
+
+#python 2.6+ backward compability
+from __future__ import unicode_literals
+
+import nose
+
+from nose.tools import *
+
+from cherrymusicserver import log
+log.setTest()
+
+from cherrymusicserver.cherrymodel import MusicEntry
+from cherrymusicserver.resultorder import ResultOrder
+
+
+def test_sort_puts_best_matches_first():
+    entries = [MusicEntry('other/yellow submarine.mp3'),
+               MusicEntry('beatles/03 help.mp3'),
+               MusicEntry('beatles/help', dir=True),
+               MusicEntry('help/something.mp3')]
+    order = ResultOrder('help')
+
+    eq_(['beatles/help', 'beatles/03 help.mp3', 'help/something.mp3',
+         'other/yellow submarine.mp3'],
+        [entry.path for entry in order.sort(entries)])
+    eq_([order(entry) for entry in entries], order.scores(entries))
+
+
+def test_sort_keeps_order_of_equal_scores():
+    entries = [MusicEntry('b/x.mp3'), MusicEntry('a/x.mp3'), MusicEntry('c/x.mp3')]
+    eq_(entries, ResultOrder('x').sort(entries))
+
+
+def test_debug_output():
+    entry = MusicEntry('beatles/help.mp3')
+    ResultOrder('help', debug=True).scores([entry])
+    ok_('total bias' in entry.debugOutputSort)
+
+
+if __name__ == '__main__':
+    nose.runmodule()
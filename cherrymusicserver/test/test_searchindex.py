@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# CherryMusic - a standalone music server
+# Copyright (c) 2012 - 2016 Tom Wallroth & Tilman Boerner
+#
+# Project page:
+#   http://fomori.org/cherrymusic/
+# Sources on github:
+#   http://github.com/devsnd/cherrymusic/
+#
+# CherryMusic is based on
+#   jPlayer (GPL/MIT license) http://www.jplayer.org/
+#   CherryPy (BSD license) http://www.cherrypy.org/
+#
+# licensed under GNU GPL version 3 (or later)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+#
+
+#python 2.6+ backward compability
+from __future__ import unicode_literals
+
+import nose
+
+from nose.tools import *
+
+from cherrymusicserver import log
+log.setTest()
+
+from cherrymusicserver.searchindex import InvertedIndex, SortedWords, PrefixTable
+
+
+def make_index(files):
+    index = InvertedIndex()
+    for fileid, words in files.items():
+        index.add(fileid, words.split())
+    return index
+
+
+def test_prefix_lookup():
+    index = make_index({1: 'blue moon', 2: 'blues', 3: 'black', 4: 'moon'})
+
+    eq_([1, 2], sorted(index.matching_any(['blu'], 10)))
+    eq_([], index.matching_any(['blx'], 10))
+    eq_([1, 4], sorted(index.matching_any(['moon'], 10)))
+    eq_(1, len(index.matching_any(['b'], 1)))
+
+
+def test_matching_any_returns_files_once_per_term():
+    index = make_index({1: 'blue moon', 2: 'blue'})
+    eq_([1, 1, 2], sorted(index.matching_any(['blue', 'moon'], 10)))
+
+
+def test_matching_all():
+    index = make_index(dict((i, 'blue song') for i in range(10, 60)))
+    index.add(1, ['blue', 'moon'])
+    index.add(2, ['red', 'moon'])
+
+    eq_([1], index.matching_all(['blu', 'moo'], 10))
+    eq_([], index.matching_all(['blue', 'green'], 10))
+    eq_([1, 10, 11], index.matching_all(['b', 'blue'], 3))
+
+
+def test_remove_and_readd():
+    index = make_index({1: 'blue moon', 2: 'blue'})
+    index.remove(1, ['blue', 'moon'])
+
+    eq_([2], index.matching_any(['blue', 'moon'], 10))
+    eq_(1, len(index))
+    ok_('moon' not in index.words, 'unused words must be dropped')
+
+    index.add(1, ['moon'])
+    eq_([1], index.matching_any(['moon'], 10))
+
+
+def test_pending_words_can_be_removed_and_readded():
+    index = InvertedIndex()
+    for fileid in (3, 1, 2):
+        index.add(fileid, ['new'])
+    index.add(1, ['new', 'gone'])
+    index.remove(2, ['new'])
+    index.remove(1, ['gone'])
+
+    ok_(not index.has_prefix('gone'), 'unused new words must be dropped')
+    eq_([1, 3], index.matching_any(['new'], 10))
+
+
+def test_memory_footprint_grows_with_content():
+    index = make_index({1: 'a'})
+    small = index.memory_footprint()
+    index.add(2, ['word%d' % i for i in range(1000)])
+    ok_(index.memory_footprint() > small)
+
+
+def test_similar_words():
+    words = SortedWords(['beatles', 'beetles', 'battles', 'beat', 'rolling'])
+    words.add('stones')
+    words.add('beatles')
+
+    eq_(6, words.size)
+    eq_([(0, 'beatles'), (1, 'beetles')], words.similar('beatles', 1))
+    eq_([(1, 'beatles'), (2, 'beetles')], words.similar('beatlos', 2))
+    eq_([(2, 'battles'), (2, 'beatles'), (2, 'beetles')],
+        words.similar('bettlas', 2))
+    eq_([(1, 'beatles'), (2, 'beat')], words.similar('beatle', 2)[:2])
+    eq_([(1, 'stones')], words.similar('stone', 1))
+    eq_([], words.similar('xyz', 2))
+    eq_([], SortedWords().similar('beatles', 2))
+
+
+def test_similar_words_gives_up_after_maxsteps():
+    words = SortedWords(['beatles'])
+    eq_([], words.similar('beatles', 1, maxsteps=3))
+    eq_([(0, 'beatles')], words.similar('beatles', 1, maxsteps=8))
+
+
+def test_prefix_table_ranks_completions():
+    table = PrefixTable([('beat', 9, 'beat'), ('beatles', 5, 'beatles'),
+                         ('bob', 1, 'bob'), ('bill', 3, 'bob and bill'),
+                         ('bob', 3, 'bob and bill'), ('abc', 1, 'abc')],
+                        size=3, precomputed=2)
+
+    eq_(['beat', 'beatles', 'bob and bill'], table.complete('b'))
+    eq_(['bob and bill', 'bob'], table.complete('bo'))
+    eq_(['bob and bill'], table.complete('bo', 1))
+    eq_(['beatles'], table.complete('beatl'))
+    eq_([], table.complete('beatlesque'))
+    eq_([], table.complete(''))
+
+
+if __name__ == '__main__':
+    nose.runmodule()
@@ -34,15 +34,19 @@ from __future__ import unicode_literals
 
 import nose
 import unittest
+from mock import patch
 from nose.tools import *
 
 from cherrymusicserver.test.helpers import cherrytest, tempdir, symlinktest
+from cherrymusicserver.test.helpers import cherryconfig, dbconnector
 
 import os
 import re
 import shutil
 import sys
 import tempfile
+import threading
+import time
 
 import cherrymusicserver as cherry
 from cherrymusicserver import configuration
@@ -53,7 +57,7 @@ from cherrymusicserver import service
 
 sqlitecache.debug = True
 
-from cherrymusicserver.database.sql import MemConnector
+from cherrymusicserver.database.sql import MemConnector, SQLiteConnector
 log.setTest()
 
 
@@ -471,16 +475,19 @@ class RemoveFilesFromDatabaseTest(unittest.TestCase):
                     {'execute': self.__execute})
 
             def __execute(connector, stmt, *parameters):
-                '''triggers an Exception when the 'undeletable' item should be
-                removed. relies on way too much knowledge of Cache internals. :(
+                '''triggers an Exception when the 'undeletable' item has been
+                removed from the files table.
                 '''
+                execute = super(
+                    connector.Connection,
+                    connector.connection(sqlitecache.DBNAME)).execute
+                cursor = execute(stmt, *parameters)
                 if stmt.lower().startswith('delete from files') \
-                  and parameters[0][0] == undeletable.uid:
+                  and not execute('SELECT COUNT(*) FROM files WHERE _id=?',
+                                  (undeletable.uid,)).fetchone()[0]:
                     connector.exceptcount += 1
                     raise Exception("boom goes the dynamite")
-                return super(
-                    connector.Connection,
-                    connector.connection(sqlitecache.DBNAME)).execute(stmt, *parameters)
+                return cursor
 
         # SPECIAL SETUP
         connector = BoobytrappedConnector()
@@ -540,7 +547,7 @@ class RandomEntriesTest(unittest.TestCase):
         files = {}
         for path in paths:
             previous = ''
-            for element in re.findall('\w+/?', path):
+            for element in re.findall(r'[\w.]+/?', path):
                 fullpath = previous + element
                 if fullpath not in files:
                     parent = files.get(previous, None)
@@ -561,26 +568,26 @@ class RandomEntriesTest(unittest.TestCase):
         eq_(0, len(entries), entries)
 
     def test_should_return_all_entries_when_fewer_than_count(self):
-        self.register_files('a', 'b')
+        self.register_files('a.mp3', 'b.mp3')
 
         entries = self.Cache.randomFileEntries(10)
 
         eq_(2, len(entries), entries)
 
     def test_should_not_return_deleted_entries(self):
-        files = self.register_files('a', 'b', 'c')
-        self.Cache.remove_file(files['b'])
+        files = self.register_files('a.mp3', 'b.mp3', 'c.mp3')
+        self.Cache.remove_file(files['b.mp3'])
 
         entries = self.Cache.randomFileEntries(10)
 
         eq_(2, len(entries), entries)
 
     def test_should_not_return_more_than_count_entries(self):
-        self.register_files('a', 'b', 'c')
+        self.register_files('a.mp3', 'b.mp3', 'c.mp3')
 
         entries = self.Cache.randomFileEntries(2)
 
-        ok_(2 >= len(entries), entries)
+        eq_(2, len(entries), entries)
 
     def test_should_not_return_dir_entries(self):
         self.register_files('a_dir/a_subdir/')
@@ -590,12 +597,48 @@ class RandomEntriesTest(unittest.TestCase):
         eq_(0, len(entries), entries)
 
     def test_can_handle_entries_in_subdirs(self):
-        self.register_files('dir/subdir/file')
+        self.register_files('dir/subdir/file.mp3')
 
         entries = self.Cache.randomFileEntries(10)
 
         eq_(1, len(entries), entries)
-        eq_('dir/subdir/file', entries[0].path, entries[0])
+        eq_('dir/subdir/file.mp3', entries[0].path, entries[0])
+
+    def test_should_only_return_files_of_given_formats(self):
+        self.register_files('a.mp3', 'b.OGG', 'c.flac')
+
+        entries = self.Cache.randomFileEntries(10, ['MP3', 'ogg'])
+
+        eq_(['a.mp3', 'b.OGG'], sorted(entry.path for entry in entries))
+
+    def test_should_return_count_entries_of_given_formats(self):
+        self.register_files('a.mp3', 'b.mp3', 'c.flac', 'd.flac', 'e.m4a')
+
+        for i in range(10):
+            entries = self.Cache.randomFileEntries(2, ['mp3'])
+
+            eq_(['a.mp3', 'b.mp3'], sorted(entry.path for entry in entries))
+
+    def test_should_not_return_files_other_than_audio(self):
+        self.register_files('a.mp3', 'b.aac', 'cover.jpg', 'notes.txt',
+                            'album.cue')
+
+        entries = self.Cache.randomFileEntries(10)
+
+        eq_(['a.mp3', 'b.aac'], sorted(entry.path for entry in entries))
+
+    def test_playables_stay_numbered_without_gaps(self):
+        files = self.register_files('a.mp3', 'b.mp3', 'dir/c.mp3', 'dir/d.mp3',
+                                    'e.mp3')
+        self.Cache.remove_file(files['b.mp3'])
+        self.Cache.conn.execute('DELETE FROM files WHERE parent = ?',
+                                (files['dir/'].uid,))
+        playables = lambda: self.Cache.conn.execute(
+            'SELECT number, frowid FROM playables ORDER BY number').fetchall()
+
+        eq_([1, 2], [number for number, fileid in playables()])
+        eq_(sorted([files['a.mp3'].uid, files['e.mp3'].uid]),
+            sorted(fileid for number, fileid in playables()))
 
 
 class SymlinkTest(unittest.TestCase):
@@ -751,6 +794,101 @@ class UpdateTest(unittest.TestCase):
         self.assertNotEqual(None, self.Cache.db_find_file_by_path(getAbsPath(self.testdir, newfile)),
                             'file must have been added correctly to the database')
 
+    def test_full_update_writes_consistent_batches(self):
+        newfiles = (os.path.join('root_dir', 'batch_dir', ''),) + tuple(
+            os.path.join('root_dir', 'batch_dir', 'shared_word %d' % i)
+            for i in range(2 * sqlitecache.AUTOSAVEINTERVAL + 1))
+        setupTestfiles(self.testdir, newfiles)
+
+        self.Cache.full_update()
+
+        self.assertEqual(1, self.Cache.conn.execute(
+            'SELECT COUNT(*) FROM dictionary WHERE word=?', ('shared',)
+        ).fetchone()[0], 'each word must only be stored once')
+        self.assertEqual(0, self.Cache.conn.execute(
+            'SELECT COUNT(*) FROM search WHERE'
+            ' frowid NOT IN (SELECT _id FROM files) OR'
+            ' drowid NOT IN (SELECT _id FROM dictionary)'
+        ).fetchone()[0], 'search rows must reference existing files and words')
+        found = self.Cache.searchfor('shared', 1000)
+        self.assertEqual(len(newfiles) - 1, len([f for f in found if not f.dir]))
+        self.assertNotEqual(None, self.Cache.db_find_file_by_path(
+            getAbsPath(self.testdir, newfiles[-1])))
+
+    def test_full_update_with_scan_threads_matches_sequential_scan(self):
+        newfiles = tuple(
+            os.path.join('root_dir', 'dir_%d' % i, sub, '')
+            for i in range(5) for sub in ('', 'sub')) + tuple(
+            os.path.join('root_dir', 'dir_%d' % i, 'sub', 'file_%d' % j)
+            for i in range(5) for j in range(3))
+        setupTestfiles(self.testdir, newfiles)
+        def listing():
+            rows = self.Cache.conn.execute(
+                'SELECT _id, parent, filename || filetype, isdir FROM files')
+            files = dict((row[0], row[1:]) for row in rows)
+
+            def path(uid):
+                parent, name, _ = files[uid]
+                return name if parent == -1 else path(parent) + '/' + name
+            return sorted((path(uid), isdir) for uid, (_, _, isdir) in files.items())
+
+        self.Cache.full_update()
+        sequential = listing()
+        self.clearCache()
+        cherry.config = cherry.config.replace({'media.scan_threads': 4})
+        self.Cache.full_update()
+
+        self.assertEqual(sequential, listing())
+        self.assertNotEqual(None, self.Cache.db_find_file_by_path(
+            getAbsPath(self.testdir, newfiles[-1])))
+
+    def test_rescan_skips_listing_of_directories_with_unchanged_mtime(self):
+        newfiles = (
+            os.path.join('root_dir', 'old_dir', ''),
+            os.path.join('root_dir', 'old_dir', 'deep_dir', ''),
+            os.path.join('root_dir', 'old_dir', 'old_file'),
+        )
+        setupTestfiles(self.testdir, newfiles)
+        path_to = lambda x: getAbsPath(self.testdir, x)
+        past = os.stat(path_to(newfiles[0])).st_mtime - 3600
+        age = lambda path: os.utime(path_to(path), (past, past))
+        for path in newfiles[:2]:
+            age(path)
+
+        self.Cache.full_update()
+        stored_mtime = lambda path: self.Cache.conn.execute(
+            'SELECT mtime FROM files WHERE _id=?',
+            (self.Cache.db_find_file_by_path(path_to(path)).uid,)).fetchone()[0]
+        self.assertEqual(past, stored_mtime(newfiles[0]))
+        self.assertEqual(os.path.getsize(path_to(newfiles[2])),
+                         self.Cache.db_find_file_by_path(path_to(newfiles[2])).stat[1])
+
+        sneaky_file = os.path.join('root_dir', 'old_dir', 'sneaky_file')
+        deep_file = os.path.join('root_dir', 'old_dir', 'deep_dir', 'deep_file')
+        setupTestfiles(self.testdir, (sneaky_file, deep_file))
+        age(newfiles[0])
+        self.Cache.full_update()
+
+        self.assertEqual(None, self.Cache.db_find_file_by_path(path_to(sneaky_file)),
+                         'unchanged directories must not be listed again')
+        self.assertNotEqual(None, self.Cache.db_find_file_by_path(path_to(deep_file)),
+                            'subdirectories of unchanged directories must be checked')
+
+        with open(path_to(newfiles[2]), 'w') as rewritten:
+            rewritten.write('rewritten in place')
+        age(newfiles[0])
+        self.Cache.full_update()
+
+        self.assertEqual(len('rewritten in place'),
+                         self.Cache.db_find_file_by_path(path_to(newfiles[2])).stat[1],
+                         'files of unchanged directories must be checked')
+
+        os.utime(path_to(newfiles[0]), None)
+        self.Cache.full_update()
+
+        self.assertNotEqual(None, self.Cache.db_find_file_by_path(path_to(sneaky_file)),
+                            'changed directories must be listed again')
+
     def test_partial_update(self):
 
         newfiles = (
@@ -875,5 +1013,631 @@ def test_symlinks_to_files_are_indexed():
     assert cache.searchfor('link')
 
 
+@cachetest
+def test_word_occurrences_are_kept_up_to_date():
+    cache = setup_cache(['blue sky.mp3', 'blue moon/', 'blue moon/sky.mp3'])
+    basedir = cherry.config['media.basedir']
+
+    def occurrences():
+        return dict(cache.conn.execute('SELECT word, occurrences FROM dictionary'))
+
+    def recounted():
+        cache.update_word_occurrences()
+        return occurrences()
+
+    counted = occurrences()
+    assert {'blue': 2, 'sky': 2, 'moon': 1} == counted
+    assert recounted() == counted
+
+    setupTestfile(TestFile(os.path.join(basedir, 'blue moon', 'blue.mp3')))
+    removeTestfile(TestFile(os.path.join(basedir, 'blue sky.mp3')))
+    cache.partial_update('blue moon', 'blue sky.mp3')
+    counted = occurrences()
+    assert {'blue': 2, 'sky': 1, 'moon': 1} == counted
+    assert recounted() == counted
+
+
+@cachetest
+def test_remove_recursive_removes_whole_subtree_from_all_tables():
+    cherry.config = cherry.config.replace({'search.substring_index': True})
+    cache = setup_cache(['gone/', 'gone/deep/', 'gone/deep/blue.mp3',
+                         'gone/red.mp3', 'kept/', 'kept/blue.mp3'])
+    gone = cache.db_find_file_by_path(
+        os.path.join(cherry.config['media.basedir'], 'gone'))
+    progress = sqlitecache.ProgressTree().spawnchild()
+
+    eq_(4, cache.remove_recursive(gone, progress))
+
+    eq_(1.0, progress.completeness)
+    eq_(['blue.mp3', 'kept'], sorted(
+        name + ext for name, ext in cache.conn.execute(
+            'SELECT filename, filetype FROM files')))
+    eq_({'blue': 1, 'kept': 1},
+        dict(cache.conn.execute('SELECT word, occurrences FROM dictionary')))
+    for table in ('search', 'trigrams'):
+        eq_(0, cache.conn.execute(
+            'SELECT COUNT(*) FROM %s WHERE frowid NOT IN (SELECT _id FROM files)'
+            % table).fetchone()[0])
+
+
+@cachetest
+def test_remove_recursive_keeps_the_transaction_of_a_running_scan():
+    cache = setup_cache(['gone/', 'gone/red.mp3', 'failed/', 'kept.mp3'])
+    basedir = cherry.config['media.basedir']
+    gone = cache.db_find_file_by_path(os.path.join(basedir, 'gone'))
+    failed = cache.db_find_file_by_path(os.path.join(basedir, 'failed'))
+    def names():
+        return sorted(name + ext for name, ext in cache.conn.execute(
+            'SELECT filename, filetype FROM files'))
+    cache.scanbuffer = sqlitecache.ScanBuffer(cache.conn)
+    try:
+        cache.conn.execute("UPDATE files SET filename = 'scanned' "
+                           "WHERE filename = 'kept'")
+
+        eq_(2, cache.remove_recursive(gone))
+        statements = cache._remove_collected_statements() + ['NOT SQL']
+        with patch.object(cache, '_remove_collected_statements',
+                          return_value=statements):
+            eq_(0, cache.remove_recursive(failed))
+
+        eq_(['failed', 'scanned.mp3'], names(),
+            'failed removal rolled back, scan work kept')
+        cache.conn.rollback()
+        eq_(['failed', 'gone', 'kept.mp3', 'red.mp3'], names(),
+            'nothing committed behind the scan\'s back')
+    finally:
+        cache.scanbuffer = None
+
+
+@cachetest
+def test_library_generation_changes_with_every_update():
+    cache = setup_cache(['a.mp3'])
+    before = cache.library_generation()
+    eq_(before, cache.library_generation())
+
+    cache.partial_update('a.mp3')
+    ok_(before != cache.library_generation())
+
+
+@cachetest
+def test_library_generation_changes_with_every_commit_of_a_scan():
+    cache = setup_cache()
+    basedir = cherry.config['media.basedir']
+    for i in range(5):
+        setupTestfile(TestFile(os.path.join(basedir, 'f%d.mp3' % i)))
+
+    generations = []
+    commit = cache.commit
+    def recording_commit():
+        commit()
+        generations.append(cache.library_generation())
+    with patch.object(sqlitecache, 'AUTOSAVEINTERVAL', 2):
+        with patch.object(cache, 'commit', recording_commit):
+            cache.full_update()
+
+    ok_(len(generations) >= 2, generations)
+    eq_(len(generations), len(set(generations)), generations)
+
+
+@cachetest
+def test_search_prefers_files_matching_all_terms():
+    common = ['blue %d.mp3' % i for i in range(30)]
+    cache = setup_cache(common + ['blue moon.mp3', 'red moon.mp3', 'moonblue.mp3'])
+
+    eq_(['blue moon.mp3'], [f.path for f in cache.searchfor('moo blu', 1)])
+    eq_(set(['blue moon.mp3']), set(
+        cache.conn.execute('SELECT filename || filetype FROM files WHERE _id = ?',
+                           (fileid,)).fetchone()[0]
+        for fileid in cache.fetchFileIdsMatchingAll(['moo', 'blu', 'blu'], 10)))
+    eq_([], cache.fetchFileIdsMatchingAll(['blue', 'nowhere'], 10))
+
+    found = [f.path for f in cache.searchfor('blue moon', 3)]
+    ok_('red moon.mp3' in found, 'too few files match all terms: '
+                                 'files matching any term must be added')
+
+
+@cachetest
+def test_memory_engine_follows_updates():
+    cherry.config = cherry.config.replace({'search.engine': 'memory'})
+    cache = setup_cache(['blue moon/', 'blue moon/one.mp3', 'blue sky.mp3',
+                         'red moon.mp3'])
+    basedir = cherry.config['media.basedir']
+    found = lambda query, maxresults=10: sorted(
+        f.path for f in cache.searchfor(query, maxresults))
+
+    eq_(['blue moon', 'blue sky.mp3'], found('blu'))
+    eq_(['blue moon'], found('moon blue', 1))
+
+    shutil.rmtree(os.path.join(basedir, 'blue moon'))
+    setupTestfile(TestFile(os.path.join(basedir, 'green moon.mp3')))
+    cache.full_update()
+
+    eq_(['green moon.mp3', 'red moon.mp3'], found('moon'))
+    eq_(sorted(cache.indexed_words('IS NOT NULL')),
+        sorted((word, fileid) for word, postings in
+               zip(cache.memory_index.words, cache.memory_index.postings)
+               for fileid in postings))
+
+
+@cachetest
+def test_typo_tolerance():
+    cherry.config = cherry.config.replace({'search.typo_tolerance': True})
+    cache = setup_cache(['the beatles/', 'the beatles/help.mp3', 'beetles.mp3'])
+    basedir = cherry.config['media.basedir']
+    found = lambda query, maxresults=10: sorted(
+        f.path for f in cache.searchfor(query, maxresults))
+
+    eq_(['beetles.mp3', 'the beatles'], found('beatlos'))
+    eq_(['the beatles'], found('the beatls', 1))
+    eq_([os.path.join('the beatles', 'help.mp3')], found('help'),
+        'terms matching a word must not be corrected')
+
+    removeTestfile(TestFile(os.path.join(basedir, 'beetles.mp3')))
+    setupTestfile(TestFile(os.path.join(basedir, 'bestles.mp3')))
+    cache.full_update()
+    eq_(['bestles.mp3', 'the beatles'], found('beatlos'))
+
+
+def test_files_db_in_memory_is_refreshed_incrementally():
+    with tempdir('test_files_db_in_memory') as tmpdir:
+        basedir = os.path.join(tmpdir, 'media')
+        os.mkdir(basedir)
+        connector = SQLiteConnector(datadir=tmpdir, extension='db')
+        config = {'media.basedir': basedir,
+                  'search.load_file_db_into_memory': True}
+        with cherryconfig(config), dbconnector(connector):
+            cache = setup_cache(['a/', 'a/one.mp3', 'b/', 'b/two.mp3'])
+            memorydb = cache.file_db_mem
+            copied = lambda: sorted(memorydb.query('SELECT * FROM files'))
+            eq_(sorted(cache.conn.execute('SELECT * FROM files')), copied())
+
+            shutil.rmtree(os.path.join(basedir, 'a'))
+            setupTestfile(TestFile(os.path.join(basedir, 'b', 'three.mp3')))
+            cache.partial_update(os.path.join(basedir, 'a'),
+                                 os.path.join(basedir, 'b'))
+
+            ok_(memorydb is cache.file_db_mem)
+            eq_(sorted(cache.conn.execute('SELECT * FROM files')), copied())
+            eq_([os.path.join('b', 'three.mp3')],
+                [entry.path for entry in cache.searchfor('three')])
+            eq_([], cache.changed_file_ids())
+            cache.conn.close()
+
+
+def test_wal_mode_reads_in_parallel_with_single_writer():
+    with tempdir('test_wal_mode') as tmpdir:
+        basedir = os.path.join(tmpdir, 'media')
+        os.mkdir(basedir)
+        connector = SQLiteConnector(datadir=tmpdir, extension='db',
+                                    connargs={'check_same_thread': False})
+        config = {'media.basedir': basedir, 'media.db_wal': True,
+                  'media.db_mmap_size': 1048576}
+        with cherryconfig(config), dbconnector(connector):
+            cache = setup_cache(['a/', 'a/one.mp3'])
+            eq_('wal', cache.conn.execute('PRAGMA journal_mode').fetchone()[0])
+
+            readers = []
+            found = []
+            def search():
+                readers.append(cache.reader())
+                found.append([e.path for e in cache.searchfor('one')])
+            with cache.writing() as conn:
+                ok_(cache.reader() is conn)
+                conn.execute('DELETE FROM files')
+                thread = threading.Thread(target=search)
+                thread.start()
+                thread.join()
+                conn.rollback()
+
+            ok_(readers[0] is not cache.conn)
+            eq_([[os.path.join('a', 'one.mp3')]], found)
+            eq_(1048576, readers[0].execute('PRAGMA mmap_size').fetchone()[0])
+            cache.conn.close()
+
+
+def test_library_generation_does_not_wait_for_locks_without_wal():
+    with tempdir('test_generation_lock') as tmpdir:
+        basedir = os.path.join(tmpdir, 'media')
+        os.mkdir(basedir)
+        connector = SQLiteConnector(datadir=tmpdir, extension='db')
+        config = {'media.basedir': basedir, 'media.db_wal': False}
+        with cherryconfig(config), dbconnector(connector):
+            cache = setup_cache(['a/', 'a/one.mp3'])
+            before = cache.library_generation()
+            other = connector.bound(sqlitecache.DBNAME).connection()
+            other.execute('BEGIN EXCLUSIVE')
+            try:
+                eq_(before, cache.library_generation())
+            finally:
+                other.rollback()
+                other.close()
+            cache.conn.close()
+
+
+@cachetest
+def test_autocomplete():
+    cache = setup_cache(['the beatles/', 'the beatles/help.mp3',
+                         'the beatles/hey jude.mp3', 'beat it.mp3', 'help.mp3',
+                         'heat/', 'heat/helper.mp3', 'hits/'])
+    basedir = cherry.config['media.basedir']
+
+    eq_({'words': ['beat', 'beatles'], 'directories': ['the beatles']},
+        cache.autocomplete('bea'))
+    eq_(['help', 'heat', 'helper', 'hey'], cache.autocomplete('the He')['words'])
+    eq_(['help', 'helper'], cache.autocomplete('the hel')['words'],
+        'more frequent words first')
+    eq_(['heat', 'hits'], cache.autocomplete('the h')['directories'],
+        'bigger directories first')
+    eq_({'words': [], 'directories': []}, cache.autocomplete('  '))
+
+    setupTestfile(TestFile(os.path.join(basedir, 'beatnik.mp3')))
+    cache.full_update()
+    eq_(['beat', 'beatles', 'beatnik'], cache.autocomplete('beat')['words'])
+
+
+def test_autocomplete_answers_from_old_tables_while_rebuilding():
+    with tempdir('test_autocomplete_rebuild') as tmpdir:
+        basedir = os.path.join(tmpdir, 'media')
+        os.mkdir(basedir)
+        connector = SQLiteConnector(datadir=tmpdir, extension='db',
+                                    connargs={'check_same_thread': False})
+        config = {'media.basedir': basedir, 'media.db_wal': True}
+        with cherryconfig(config), dbconnector(connector):
+            cache = setup_cache(['beat it.mp3'])
+            eq_(['beat'], cache.autocomplete('bea')['words'])
+
+            building = threading.Event()
+            release = threading.Event()
+            setup = cache.setup_autocomplete_tables
+            def slow_setup():
+                building.set()
+                release.wait(5)
+                return setup()
+            with patch.object(cache, 'setup_autocomplete_tables', slow_setup):
+                setupTestfile(TestFile(os.path.join(basedir, 'beatnik.mp3')))
+                cache.full_update()
+                builder = cache.autocomplete_builder
+                ok_(building.wait(5), 'rebuilt after the update')
+                eq_(['beat'], cache.autocomplete('bea')['words'])
+                release.set()
+                builder.join()
+            eq_(['beat', 'beatnik'], cache.autocomplete('bea')['words'])
+            cache.conn.close()
+
+
+@cachetest
+def test_tags_are_read_for_new_and_changed_audio_files_only():
+    readcount = {}
+    def getSongInfo(fullpath):
+        name = os.path.basename(fullpath)
+        readcount[name] = readcount.get(name, 0) + 1
+        if name == 'broken.mp3':
+            raise ValueError('bad tags')
+        return sqlitecache.metainfo.Metainfo(title=name, length=readcount[name])
+
+    with patch('cherrymusicserver.metainfo.getSongInfo', getSongInfo):
+        cache = setup_cache(['album/', 'album/a.mp3', 'album/cover.jpg',
+                             'broken.mp3'])
+        basedir = cherry.config['media.basedir']
+        eq_({'a.mp3': 1, 'broken.mp3': 1}, readcount)
+
+        cache.full_update()
+        eq_({'a.mp3': 1, 'broken.mp3': 1}, readcount, 'unchanged files')
+
+        with open(os.path.join(basedir, 'album', 'a.mp3'), 'w') as changed:
+            changed.write('longer now')
+        cache.partial_update(os.path.join('album', 'a.mp3'))
+        eq_({'a.mp3': 2, 'broken.mp3': 1}, readcount)
+
+        info = cache.songinfo([os.path.join('album', 'a.mp3'), 'broken.mp3',
+                               os.path.join('album', 'cover.jpg')])
+        eq_([os.path.join('album', 'a.mp3'), 'broken.mp3'], sorted(info))
+        eq_('a.mp3', info[os.path.join('album', 'a.mp3')].title)
+        eq_(2, info[os.path.join('album', 'a.mp3')].length)
+        eq_('', info['broken.mp3'].title)
+
+        removeTestfile(TestFile(os.path.join(basedir, 'broken.mp3')))
+        cache.partial_update('broken.mp3')
+        eq_([('a.mp3',)], cache.conn.execute('SELECT title FROM tags').fetchall())
+
+        cache.conn.execute('DELETE FROM tags')
+        cache.full_update()
+        eq_({'a.mp3': 3, 'broken.mp3': 1}, readcount, 'missing tags are filled')
+
+
+def test_tag_reader_keeps_order_and_isolates_failures():
+    testdir = os.path.dirname(__file__)
+    files = [(i, os.path.join(testdir, 'test.mp3' if i % 2 else 'test.ogg'))
+             for i in range(2 * sqlitecache.TAG_CHUNK_SIZE + 10)]
+    files.append((len(files), os.path.join(testdir, 'missing.mp3')))
+
+    for workers in (1, 3):
+        reader = sqlitecache.TagReader(workers)
+        try:
+            for fileid, path in files:
+                reader.add(fileid, path)
+            rows = [row for rows in reader.remaining() for row in rows]
+        finally:
+            reader.close()
+
+        eq_([fileid for fileid, path in files], [row[0] for row in rows])
+        eq_(1.0, rows[0][5])
+        ok_(rows[1][5] > 1.0)
+        eq_((len(files) - 1, '', '', '', '', 0), rows[-1])
+
+
+@cachetest
+def test_tags_are_read_by_worker_processes():
+    cherry.config = cherry.config.replace({'media.tag_workers': 2})
+    basedir = cherry.config['media.basedir']
+    cache = setup_cache()
+    names = ['%d.mp3' % i for i in range(sqlitecache.TAG_CHUNK_SIZE + 1)]
+    for name in names:
+        shutil.copy(os.path.join(os.path.dirname(__file__), 'test.mp3'),
+                    os.path.join(basedir, name))
+    cache.full_update()
+
+    info = cache.songinfo(names)
+    eq_(sorted(names), sorted(info))
+    ok_(all(tags.length > 1 for tags in info.values()))
+
+
+@cachetest
+def test_interrupted_update_resumes_after_last_checkpoint():
+    cache = setup_cache()
+    basedir = cherry.config['media.basedir']
+    past = time.time() - 3600
+    for dirname in 'abc':
+        setupTestfile(TestFile(os.path.join(basedir, dirname, '')))
+        for i in range(3):
+            setupTestfile(TestFile(os.path.join(basedir, dirname, '%s%d.mp3'
+                                                % (dirname, i))))
+        os.utime(os.path.join(basedir, dirname), (past, past))
+
+    add_words = cache.add_to_dictionary_table
+    def add_to_dictionary_table(filename):
+        if filename == 'c0':
+            raise IOError('server shutdown')
+        return add_words(filename)
+    with patch.object(sqlitecache, 'AUTOSAVEINTERVAL', 2):
+        with patch.object(cache, 'add_to_dictionary_table',
+                          add_to_dictionary_table):
+            cache.full_update()
+
+    eq_(('a', 8, 0), cache.scan_checkpoint('')[:3])
+    ok_(cache.db_find_file_by_path(os.path.join(basedir, 'a')).mtime,
+        'mtimes of directories before a checkpoint are stored')
+
+    listed = []
+    listchildren = sqlitecache.File.listchildren
+    def listing(fileobj, *args, **kwargs):
+        listed.append(fileobj.relpath)
+        return listchildren(fileobj, *args, **kwargs)
+    with patch.object(sqlitecache.File, 'listchildren', listing):
+        cache.full_update()
+
+    eq_(['', 'b', 'c'], listed)
+    eq_(None, cache.scan_checkpoint(''))
+    eq_(12, cache.conn.execute('SELECT COUNT(*) FROM files').fetchone()[0])
+
+
+@cachetest
+def test_resumed_update_finds_files_added_before_the_checkpoint():
+    cache = setup_cache()
+    basedir = cherry.config['media.basedir']
+    top = os.path.join(basedir, 'top')
+    past = time.time() - 3600
+    for dirname in 'abc':
+        setupTestfile(TestFile(os.path.join(top, dirname, '')))
+        for i in range(3):
+            setupTestfile(TestFile(os.path.join(top, dirname, '%s%d.mp3'
+                                                % (dirname, i))))
+        os.utime(os.path.join(top, dirname), (past, past))
+    os.utime(top, (past, past))
+
+    add_words = cache.add_to_dictionary_table
+    def add_to_dictionary_table(filename):
+        if filename == 'c0':
+            raise IOError('server shutdown')
+        return add_words(filename)
+    with patch.object(sqlitecache, 'AUTOSAVEINTERVAL', 2):
+        with patch.object(cache, 'add_to_dictionary_table',
+                          add_to_dictionary_table):
+            cache.full_update()
+    eq_('top/b', cache.scan_checkpoint('')[0])
+
+    added = os.path.join('top', '0 added.mp3')
+    setupTestfile(TestFile(os.path.join(basedir, added)))
+    os.utime(top, (past + 60, past + 60))
+    cache.full_update()
+    eq_(None, cache.scan_checkpoint(''))
+    cache.full_update()
+
+    ok_(cache.db_find_file_by_path(os.path.join(basedir, added)),
+        'added while interrupted, before the checkpoint')
+
+
+@cachetest
+def test_scan_status_follows_update():
+    cache = setup_cache(['gone.mp3', 'kept.mp3'])
+    basedir = cherry.config['media.basedir']
+    removeTestfile(TestFile(os.path.join(basedir, 'gone.mp3')))
+    setupTestfile(TestFile(os.path.join(basedir, 'new/')))
+    setupTestfile(TestFile(os.path.join(basedir, 'new', 'new.mp3')))
+
+    status = sqlitecache.ScanStatus()
+    cache.full_update(status=status)
+
+    eq_((4, 2, 1, None), (status.scanned, status.added, status.removed,
+                          status.error))
+    ok_(status.progress.completeness > 0)
+
+
+@cachetest
+def test_scan_status_covers_all_paths_of_a_partial_update():
+    cache = setup_cache(['a/', 'a/x.mp3', 'b/', 'b/y.mp3'])
+    status = sqlitecache.ScanStatus()
+    completeness = []
+    update_db_recursive = cache.update_db_recursive
+    def recording_update(*args, **kwargs):
+        completeness.append(status.completeness)
+        return update_db_recursive(*args, **kwargs)
+
+    with patch.object(cache, 'update_db_recursive', recording_update):
+        cache.partial_update('a', 'b', status=status)
+
+    eq_([0, 0.5], completeness)
+    eq_((2, 100), (status.paths_done, status.percent))
+
+
+@cachetest
+def test_paths_are_stored_and_used_for_results():
+    cache = setup_cache(['a/', 'a/b/', 'a/b/c.mp3', 'd.mp3'])
+    stored = dict(cache.conn.execute('SELECT filename || filetype, path FROM files'))
+    assert {'a': 'a', 'b': 'a/b', 'c.mp3': 'a/b/c.mp3', 'd.mp3': 'd.mp3'} == stored
+
+    found = sorted(f.path for f in cache.searchfor('c'))
+    assert [os.path.join('a', 'b', 'c.mp3')] == found
+
+    cache.conn.execute("UPDATE files SET path = NULL WHERE filename IN ('b', 'c')")
+    assert found == sorted(f.path for f in cache.searchfor('c')), \
+        'files without stored path must be resolved through their parents'
+
+
+@cachetest
+def test_paths_follow_renamed_directories():
+    cache = setup_cache(['a/', 'a/b/', 'a/b/c.mp3', 'ab.mp3'])
+    cache.conn.execute("UPDATE files SET filename = 'x' WHERE filename = 'a'")
+    stored = dict(cache.conn.execute('SELECT filename || filetype, path FROM files'))
+    assert {'x': 'x', 'b': 'x/b', 'c.mp3': 'x/b/c.mp3', 'ab.mp3': 'ab.mp3'} == stored
+
+
+@cachetest
+def test_find_file_by_path_uses_path_index():
+    cache = setup_cache(['a/', 'a/b/', 'a/b/c.mp3'])
+    basedir = cherry.config['media.basedir']
+    plan = cache.conn.execute(
+        'EXPLAIN QUERY PLAN SELECT _id FROM files WHERE path IN (?, ?)',
+        ('a', 'a/b')).fetchall()
+    assert 'idx_files_path' in ' '.join(str(row) for row in plan)
+
+    found = cache.db_find_file_by_path(os.path.join(basedir, 'a', 'b', 'c.mp3'))
+    assert ['c.mp3', 'b', 'a'] == [found.basename, found.parent.basename,
+                                   found.parent.parent.basename]
+    assert found.parent.uid == cache.db_find_file_by_path(
+        os.path.join(basedir, 'a', 'b')).uid
+    assert None is cache.db_find_file_by_path(os.path.join(basedir, 'a', 'x'))
+
+    cache.conn.execute("UPDATE files SET path = NULL WHERE filename = 'c'")
+    assert found.uid == cache.db_find_file_by_path(
+        os.path.join(basedir, 'a', 'b', 'c.mp3')).uid, \
+        'files without stored path must still be found'
+
+
+def test_path_migration_fills_paths_of_existing_files():
+    import cherrymusicserver.database.defs as defs
+    dbdef = defs.get(sqlitecache.DBNAME)
+    conn = MemConnector().bound(None).connection()
+    conn.executescript(dbdef['3']['create.sql'])
+    conn.executemany('INSERT INTO files (_id, parent, filename, filetype, isdir)'
+                     ' VALUES (?, ?, ?, ?, ?)', [
+                         (1, -1, 'a', '', 1),
+                         (2, 1, 'b', '', 1),
+                         (3, 2, 'c', '.mp3', 0),
+                         (4, -1, 'd', '.mp3', 0),
+                         (5, 99, 'orphan', '', 0)])
+    conn.executescript(dbdef['4']['update.sql'])
+    assert [(1, 'a'), (2, 'a/b'), (3, 'a/b/c.mp3'), (4, 'd.mp3'), (5, None)] == \
+        conn.execute('SELECT _id, path FROM files ORDER BY _id').fetchall()
+
+
+@cachetest
+def test_substring_index_search():
+    cherry.config = cherry.config.replace({'search.substring_index': True})
+    cache = setup_cache(['thebeatles_live/', 'thebeatles_live/some track.mp3',
+                         'beat.mp3', 'abc_bcd.mp3'])
+    assert cache.substring_index
+
+    assert ['thebeatles_live'] == [f.path for f in cache.searchfor('beatles')]
+    assert ['beat.mp3', 'thebeatles_live'] == sorted(
+        f.path for f in cache.searchfor('eat'))
+    assert [] == cache.searchfor('abcd'), 'all trigrams, but not together'
+
+    os.remove(os.path.join(cherry.config['media.basedir'], 'beat.mp3'))
+    cache.full_update()
+
+    assert ['thebeatles_live'] == [f.path for f in cache.searchfor('eat')]
+    assert 0 == cache.conn.execute(
+        'SELECT COUNT(*) FROM trigrams WHERE frowid NOT IN (SELECT _id FROM files)'
+        ).fetchone()[0]
+
+
+@cachetest
+def test_substring_index_is_built_when_enabled_and_cleared_when_disabled():
+    cache = setup_cache(['thebeatles_live/'])
+    assert not cache.substring_index
+    assert [] == cache.searchfor('beatles')
+
+    cherry.config = cherry.config.replace({'search.substring_index': True})
+    cache = sqlitecache.SQLiteCache()
+    assert ['thebeatles_live'] == [f.path for f in cache.searchfor('beatles')]
+
+    cherry.config = cherry.config.replace({'search.substring_index': False})
+    cache = sqlitecache.SQLiteCache()
+    assert [] == cache.searchfor('beatles')
+    assert 0 == cache.conn.execute('SELECT COUNT(*) FROM trigrams').fetchone()[0]
+
+
+def fts5test(func):
+    ''' Decorator that returns a no-op function if SQLite lacks fts5 '''
+    import sqlite3
+    try:
+        sqlite3.connect(':memory:').execute(
+            'CREATE VIRTUAL TABLE test USING fts5(words)')
+    except sqlite3.OperationalError:
+        return lambda *a, **kw: None
+    return func
+
+
+@fts5test
+@cachetest
+def test_fts5_engine_search():
+    cherry.config = cherry.config.replace({'search.engine': 'fts5'})
+    cache = setup_cache(['band/', 'band/great song.mp3', 'band/other.mp3',
+                         'ärger.mp3'])
+    assert cache.fts_index
+
+    found = cache.searchfor('great son')
+    assert ['band/great song.mp3'] == [f.path for f in found]
+    assert ['band/great song.mp3', 'band/other.mp3'] == sorted(
+        f.path for f in cache.searchfor('other song'))
+    assert ['ärger.mp3'] == [f.path for f in cache.searchfor('ärg')]
+    assert [] == cache.searchfor('"-*')
+
+    os.remove(os.path.join(cherry.config['media.basedir'], 'band', 'other.mp3'))
+    cache.full_update()
+
+    assert [] == cache.searchfor('other')
+    assert 3 == cache.conn.execute('SELECT COUNT(*) FROM search_fts').fetchone()[0]
+
+
+@fts5test
+@cachetest
+def test_fts5_index_is_built_from_existing_tables_and_dropped_when_unused():
+    cache = setup_cache(['band/', 'band/great song.mp3'])
+    assert not cache.fts_index
+
+    cherry.config = cherry.config.replace({'search.engine': 'fts5'})
+    cache = sqlitecache.SQLiteCache()
+    assert cache.fts_index
+    assert ['band/great song.mp3'] == [f.path for f in cache.searchfor('song')]
+
+    cherry.config = cherry.config.replace({'search.engine': 'dictionary'})
+    cache = sqlitecache.SQLiteCache()
+    assert not cache.fts_index
+    assert not cache.conn.execute(
+        "SELECT * FROM sqlite_master WHERE name='search_fts'").fetchall()
+
+
 if __name__ == "__main__":
     nose.runmodule()
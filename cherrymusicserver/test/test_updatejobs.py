@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# CherryMusic - a standalone music server
+# Copyright (c) 2012 - 2016 Tom Wallroth & Tilman Boerner
+#
+# Project page:
+#   http://fomori.org/cherrymusic/
+# Sources on github:
+#   http://github.com/devsnd/cherrymusic/
+#
+# CherryMusic is based on
+#   jPlayer (GPL/MIT license) http://www.jplayer.org/
+#   CherryPy (BSD license) http://www.cherrypy.org/
+#
+# licensed under GNU GPL version 3 (or later)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+#
+
+
+#python 2.6+ backward compability
+from __future__ import unicode_literals
+
+import nose
+
+from mock import *
+from nose.tools import *
+
+import threading
+import time
+
+from cherrymusicserver import log
+log.setTest()
+
+from cherrymusicserver import updatejobs
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class BlockingCache(object):
+    '''Runs updates only when they are released'''
+    def __init__(self):
+        self.updates = []
+        self.release = threading.Event()
+
+    def full_update(self, status):
+        self._update((), status)
+
+    def partial_update(self, *paths, **kwargs):
+        self._update(paths, kwargs['status'])
+
+    def _update(self, paths, status):
+        self.updates.append(paths)
+        status.scanned, status.added, status.removed = 10, 3, 1
+        self.release.wait(5)
+
+
+def jobs_for(cache):
+    jobs = updatejobs.UpdateJobs()
+    jobs.cache = cache
+    return jobs
+
+
+def test_finished_job_reports_numbers():
+    cache = BlockingCache()
+    cache.release.set()
+    jobs = jobs_for(cache)
+
+    job = jobs.start()
+    ok_(wait_for(lambda: job.state == updatejobs.UpdateJob.DONE))
+
+    status = jobs.get(job.id).dict()
+    eq_((10, 3, 1, 100, 0), (status['scanned'], status['added'],
+                             status['removed'], status['percent'],
+                             status['eta']))
+    ok_(status['rate'] > 0)
+    eq_(None, jobs.get('unknown'))
+
+
+def test_requests_are_coalesced_while_a_job_runs():
+    cache = BlockingCache()
+    jobs = jobs_for(cache)
+
+    running = jobs.start()
+    ok_(wait_for(lambda: cache.updates))
+    eq_(running, jobs.start(), 'same update as the running one')
+
+    waiting = jobs.start(['b'])
+    eq_(waiting, jobs.start(['a']))
+    eq_(('a', 'b'), waiting.paths)
+    eq_(updatejobs.UpdateJob.QUEUED, waiting.state)
+
+    cache.release.set()
+    ok_(wait_for(lambda: waiting.state == updatejobs.UpdateJob.DONE))
+    eq_([(), ('a', 'b')], cache.updates)
+    eq_(updatejobs.UpdateJob.DONE, running.state)
+
+
+def test_failed_update_is_reported():
+    cache = Mock()
+    cache.full_update.side_effect = IOError('disk gone')
+    jobs = jobs_for(cache)
+
+    job = jobs.start()
+    ok_(wait_for(lambda: job.finished is not None))
+
+    eq_(updatejobs.UpdateJob.FAILED, job.state)
+    ok_('disk gone' in job.dict()['error'])
+
+
+if __name__ == '__main__':
+    nose.runmodule()
@@ -33,10 +33,16 @@ import nose
 
 from nose.tools import *
 
+import os
+import sys
+import time
+
 from cherrymusicserver import util
 from cherrymusicserver import log
 log.setTest()
 
+from cherrymusicserver.test.helpers import tempdir, mkpath
+
 def test_maxlen_trim():
     assert util.trim_to_maxlen(7, 'abcdefghi') == 'a ... i'
 
@@ -61,6 +67,43 @@ def test_moving_average():
     assert mov.min == 0
     assert mov.max == 2
 
+def test_lru_cache():
+    cache = util.LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None, 'least recently used item must be dropped'
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert (cache.hits, cache.misses) == (3, 1)
+
+    disabled = util.LRUCache(0)
+    disabled.put('a', 1)
+    assert disabled.get('a') is None
+
+def test_reloading_module():
+    with tempdir('test_reloading_module') as tmpdir:
+        source = mkpath('reloadme.py', tmpdir, 'value = 1')
+        sys.path.insert(0, tmpdir)
+        try:
+            import reloadme
+            module = util.ReloadingModule(reloadme, interval=3600)
+            with open(source, 'w') as f:
+                f.write('value = 2')
+            past = time.time() - 60
+            os.utime(source, (past, past))
+
+            assert module.current().value == 1, 'must not check before interval'
+            module.interval = 0
+            assert module.current().value == 2
+            with open(source, 'w') as f:
+                f.write('value = 3')
+            assert module.reload().value == 3
+        finally:
+            sys.path.remove(tmpdir)
+            sys.modules.pop('reloadme', None)
+
 def test_time2text():
     assert util.time2text(0) == 'just now'
     for mult in [60, 60*60, 60*60*24, 60*60*24*31, 60*60*24*365]:
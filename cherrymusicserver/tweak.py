@@ -31,18 +31,14 @@
 
 """This file contains all static values that can be used to tweak the
 program execution. All classes are static and only contain simple values.
-To use this class, please import it using the fully classified module name, e.g
+To use these values, fetch the module from ``cherrymusicserver.tweaks``:
 
-    import cherrymusicserver.tweak
+    import cherrymusicserver as cherry
+    limit = cherry.tweaks.current().SearchTweaks.normal_file_search_limit
 
-To account for changes while the server is running, reload the module
-before using it:
-
-    reload(cherrymusicserver.tweak)
-
-make sure to have reload imported as well:
-
-    from imp import reload
+This reloads the module when the file has changed, checking its mtime every
+few seconds, so changes take effect while the server is running. Admins can
+also reload it right away with the ``reloadtweaks`` API call.
 """
 
 class ResultOrderTweaks:
@@ -61,4 +57,11 @@ class CherryModelTweaks:
 
 class SearchTweaks:
     normal_file_search_limit = 400
+    # typo correction (search.typo_tolerance): terms shorter than this are
+    # left alone, longer ones may be two edits away from a correct word
+    min_typo_term_length = 3
+    two_typo_term_length = 6
+    max_typo_corrections = 5
+    # bounds the time spent looking for corrections of a single term
+    max_typo_lookup_steps = 20000
 
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# CherryMusic - a standalone music server
+# Copyright (c) 2012 - 2016 Tom Wallroth & Tilman Boerner
+#
+# Project page:
+#   http://fomori.org/cherrymusic/
+# Sources on github:
+#   http://github.com/devsnd/cherrymusic/
+#
+# CherryMusic is based on
+#   jPlayer (GPL/MIT license) http://www.jplayer.org/
+#   CherryPy (BSD license) http://www.cherrypy.org/
+#
+# licensed under GNU GPL version 3 (or later)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+#
+""" Runs media library updates as background jobs, one at a time, so the
+    caller does not have to wait for a scan to finish.
+
+    Each job gets an id which can be used to ask for its status while it
+    runs and for a while after it has finished.
+"""
+
+#python 2.6+ backward compability
+from __future__ import unicode_literals
+
+import os
+import threading
+import time
+import uuid
+
+from backport.collections import OrderedDict
+
+from cherrymusicserver import log
+from cherrymusicserver import service
+from cherrymusicserver.sqlitecache import ScanStatus
+
+# finished jobs whose status can still be asked for
+KEEP_FINISHED_JOBS = 20
+
+
+class UpdateJob(object):
+    """ A full update of the media library, or a partial update of some
+        paths in it. ``paths`` is empty for a full update.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, paths=()):
+        self.id = uuid.uuid4().hex
+        self.paths = tuple(paths)
+        self.state = UpdateJob.QUEUED
+        self.status = ScanStatus()
+        self.started = None
+        self.finished = None
+
+    def merge(self, paths):
+        '''Make this job update `paths` as well; no paths mean everything.'''
+        if not self.paths or not paths:
+            self.paths = ()
+        else:
+            self.paths = tuple(sorted(set(self.paths + tuple(paths))))
+
+    def run(self, cache):
+        self.state = UpdateJob.RUNNING
+        self.started = time.time()
+        try:
+            if self.paths:
+                cache.partial_update(*self.paths, status=self.status)
+            else:
+                cache.full_update(status=self.status)
+        except Exception as error:
+            self.status.error = '%s: %s' % (error.__class__.__name__, error)
+        self.finished = time.time()
+        if self.status.error is None:
+            self.state = UpdateJob.DONE
+        else:
+            log.e(_('update job %s failed: %s'), self.id, self.status.error)
+            self.state = UpdateJob.FAILED
+
+    @property
+    def rate(self):
+        '''items scanned per second'''
+        if self.started is None:
+            return 0
+        runtime = (self.finished or time.time()) - self.started
+        return self.status.scanned / runtime if runtime > 0 else 0
+
+    def dict(self):
+        if self.state == UpdateJob.RUNNING:
+            percent, eta = self.status.percent, self.status.eta
+        else:
+            percent = 100 if self.finished else 0
+            eta = 0
+        return {
+            'id': self.id,
+            'paths': list(self.paths),
+            'state': self.state,
+            'scanned': self.status.scanned,
+            'added': self.status.added,
+            'removed': self.status.removed,
+            'rate': self.rate,
+            'percent': percent,
+            'eta': eta,
+            'error': self.status.error,
+        }
+
+
+@service.user(cache='filecache')
+class UpdateJobs(object):
+    """ Runs :class:`UpdateJob` s one after the other on a background
+        thread.
+
+        Requests are coalesced: asking for the update that is running
+        returns the running job, and all other requests while a job runs are
+        merged into the single job that waits for it.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()
+        self.running = None
+        self.waiting = None
+        self.thread = None
+
+    def start(self, paths=()):
+        '''Return the job that will update `paths` (relative to basedir),
+        or the whole library if there are none.'''
+        paths = tuple(sorted(set(os.path.normpath(path) for path in paths)))
+        with self.lock:
+            running = self.running
+            if running is not None and running.paths == paths:
+                return running
+            if self.waiting is not None:
+                self.waiting.merge(paths)
+                return self.waiting
+            job = UpdateJob(paths)
+            self.jobs[job.id] = job
+            self._forget_finished()
+            if running is None:
+                self.running = job
+                self.thread = threading.Thread(name='UpdateJobs',
+                                               target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
+            else:
+                self.waiting = job
+        log.i(_('update job %s: %s'), job.id,
+              ', '.join(paths) if paths else _('full update'))
+        return job
+
+    def get(self, jobid):
+        '''The job with the given id, or None if there is no such job (any
+        more)'''
+        with self.lock:
+            return self.jobs.get(jobid)
+
+    def _forget_finished(self):
+        finished = [jobid for jobid, job in self.jobs.items()
+                    if job.finished is not None]
+        for jobid in finished[:max(0, len(finished) - KEEP_FINISHED_JOBS)]:
+            del self.jobs[jobid]
+
+    def _run(self):
+        while True:
+            with self.lock:
+                job = self.running
+            job.run(self.cache)
+            with self.lock:
+                self.running, self.waiting = self.waiting, None
+                if self.running is None:
+                    self.thread = None
+                    return
@@ -36,6 +36,12 @@ import os
 import sys
 import base64
 import codecs
+import threading
+try:
+    from importlib import reload
+except ImportError:
+    pass    # python 2: reload is a builtin
+from backport.collections import OrderedDict
 from cherrymusicserver import log
 from time import time
 
@@ -173,6 +179,92 @@ class MovingAverage(object):
         return self._avg
 
 
+class LRUCache(object):
+    '''A thread-safe mapping that holds at most `maxsize` items, dropping the
+    least recently used ones first. Counts hits and misses of :meth:`get`.'''
+    def __init__(self, maxsize):
+        assert maxsize >= 0
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._items[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            if self.maxsize:
+                self._items[key] = value
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+class ReloadingModule(object):
+    '''Gives access to a module that is reloaded when its source file
+    changes. The file's mtime is checked at most every `interval` seconds,
+    when the module is fetched with :meth:`current`.'''
+    def __init__(self, module, interval=5):
+        self.module = module
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._checked = time()
+        self._mtime = self._sourcemtime()
+
+    def _sourcemtime(self):
+        source = self.module.__file__
+        if source.endswith(('.pyc', '.pyo')):
+            source = source[:-1]
+        try:
+            return os.path.getmtime(source)
+        except OSError:
+            return None
+
+    def current(self):
+        if time() - self._checked >= self.interval:
+            with self._lock:
+                if time() - self._checked >= self.interval:
+                    self._checked = time()
+                    mtime = self._sourcemtime()
+                    if mtime != self._mtime:
+                        self._reload(mtime)
+        return self.module
+
+    def reload(self):
+        '''reload the module now, whether it has changed or not'''
+        with self._lock:
+            self._checked = time()
+            self._reload(self._sourcemtime())
+        return self.module
+
+    def _reload(self, mtime):
+        self._mtime = mtime
+        try:
+            reload(self.module)
+        except Exception as error:
+            log.e(_('error reloading %s, keeping the previous values: %s'),
+                  self.module.__name__, error)
+        else:
+            log.i(_('reloaded %s'), self.module.__name__)
+
+
 class Performance:
     indentation = 0
 
@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+"""
+Compare the search engines of the file database on the same library.
+
+Scans a media directory (or a generated fake library) into a temporary
+database once, then times the same queries against each engine.
+
+usage: search_benchmark.py [--basedir DIR] [--files N] [--queries N]
+                           [--repeat N] [--seed N]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import cherrymusicserver as cherry
+from cherrymusicserver import configuration
+from cherrymusicserver import database
+from cherrymusicserver import log
+from cherrymusicserver import service
+from cherrymusicserver import sqlitecache
+from cherrymusicserver import util
+from cherrymusicserver.database.sql import SQLiteConnector
+
+ENGINES = ('dictionary', 'memory', 'fts5')
+
+WORDS = '''alpha bravo charlie delta echo foxtrot golf hotel india juliet kilo
+lima mike november oscar papa quebec romeo sierra tango uniform victor whiskey
+xray yankee zulu live remastered acoustic demo remix edit version part intro
+outro love night day blue red black white song dance heart rain fire moon sun
+river road home dream time world light dark summer winter'''.split()
+
+
+def fake_library(basedir, filecount, rnd):
+    '''artist/album/track folders with random names, about 10 tracks each'''
+    name = lambda count: ' '.join(rnd.sample(WORDS, count))
+    made = 0
+    while made < filecount:
+        album = os.path.join(basedir, '%s %d' % (name(2), made),
+                             '%s %d' % (name(rnd.randint(1, 3)), made))
+        os.makedirs(album)
+        for track in range(min(10, filecount - made)):
+            filename = '%02d %s.mp3' % (track + 1, name(rnd.randint(1, 4)))
+            open(os.path.join(album, filename), 'w').close()
+            made += 1
+
+
+def sample_queries(cache, count, rnd):
+    '''single words, word prefixes and word pairs from the dictionary'''
+    words = [row[0] for row in cache.conn.execute(
+        "SELECT word FROM dictionary WHERE length(word) > 2")]
+    if not words:
+        sys.exit('library contains no searchable words')
+    queries = []
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            queries.append(rnd.choice(words))
+        elif kind == 1:
+            word = rnd.choice(words)
+            queries.append(word[:max(2, len(word) // 2)])
+        else:
+            queries.append('%s %s' % (rnd.choice(words), rnd.choice(words)))
+    return queries
+
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return time.time() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--basedir', help='media directory to scan; a fake '
+                        'library is generated if missing')
+    parser.add_argument('--files', type=int, default=20000,
+                        help='number of files in the fake library')
+    parser.add_argument('--queries', type=int, default=60)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    rnd = random.Random(args.seed)
+    log.level(log.ERROR)
+    sqlitecache.debug = False
+    util.PERFORMANCE_TEST = False
+
+    workdir = tempfile.mkdtemp(prefix='cherrymusic-benchmark.')
+    try:
+        basedir = args.basedir
+        if basedir is None:
+            basedir = os.path.join(workdir, 'library')
+            print('generating fake library with %d files...' % args.files)
+            fake_library(basedir, args.files, rnd)
+        cherry.config = configuration.from_defaults().replace({
+            'media.basedir': os.path.abspath(basedir),
+        })
+        service.provide('dbconnector', SQLiteConnector, kwargs={
+            'datadir': workdir, 'extension': 'db'})
+        database.ensure_current_version(sqlitecache.DBNAME, autoconsent=True)
+
+        cache = sqlitecache.SQLiteCache()
+        seconds = timed(cache.full_update)[0]
+        filecount = cache.conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+        print('scanned %d files in %.2fs' % (filecount, seconds))
+        queries = sample_queries(cache, args.queries, rnd)
+
+        print('%-12s %10s %12s %12s %10s' % (
+            'engine', 'setup', 'mean query', 'max query', 'results'))
+        for engine in ENGINES:
+            cherry.config = cherry.config.replace({'search.engine': engine})
+            cache.conn.close()
+            setup, cache = timed(sqlitecache.SQLiteCache)
+            if engine == 'fts5' and not cache.fts_index:
+                print('%-12s not available' % engine)
+                continue
+            if cache.memory_index is not None:
+                print('%-12s index uses %.1f MB' % (
+                    engine, cache.memory_index.memory_footprint() / 1048576.0))
+            times = []
+            found = 0
+            for query in queries:
+                for repetition in range(args.repeat):
+                    seconds, results = timed(cache.searchfor, query)
+                    times.append(seconds)
+                found += len(results)
+            print('%-12s %9.3fs %10.2fms %10.2fms %10.1f' % (
+                engine, setup, 1000 * sum(times) / len(times),
+                1000 * max(times), found / float(len(queries))))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()